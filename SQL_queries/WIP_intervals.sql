@@ -0,0 +1,93 @@
+/****** WIP history stored as intervals: one row per unit and location from WIP_SnapshotStart to WIP_SnapshotEnd ******/
+CREATE TABLE [SBILearning].[dbo].[DNun_tbl_Production_WIP_intervals](
+    [Site] [char](2) NOT NULL,
+    [Building] [varchar](7) NOT NULL,
+    [SerialNumber] [char](12) NOT NULL,
+    [StockCode] [varchar](16) NOT NULL,
+    [SKU] [varchar](100) NOT NULL,
+    [CheckpointID] [int] NOT NULL,
+    [CheckpointName] [varchar](50) NOT NULL,
+    [ProcessArea] [varchar](20) NOT NULL,
+    [TransactionID] [bigint] NOT NULL,
+    [TransactionDate] [datetime] NOT NULL,
+    [WIP_SnapshotStart] [datetime] NOT NULL,
+    [WIP_SnapshotEnd] [datetime] NOT NULL,
+    [OrderType] [varchar](20) NULL,
+    [FactoryStatus] [varchar](20) NULL,
+    [ProductType] [varchar](8) NOT NULL,
+    [Customer] [varchar](5) NULL,
+    [PackedIsLast_flag] [bit] NOT NULL,
+    [PackedPreviously_flag] [bit] NOT NULL,
+    [ExtractionDate] [datetime] NOT NULL);
+GO
+
+
+/****** Daily WIP rows on demand, with the same columns as [DNun_tbl_Production_WIP_history] ******/
+/* Working dwell time follows utilities.delta_working_hours: weekend start and end dates are moved to Monday 0:00 and
+   Friday 23:59:59.009999, then 24 hours are removed for each weekend day in between.
+   Weekdays are counted from 1900-01-01 (a Monday), so Monday = 0 regardless of DATEFIRST */
+CREATE VIEW [dbo].[DNun_vw_Production_WIP_history_daily] AS
+WITH Tally_CTE AS (
+    SELECT TOP (1000) ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) - 1 AS DayOffset
+    FROM sys.all_objects AS a CROSS JOIN sys.all_objects AS b
+)
+SELECT i.[Site]
+      ,i.[Building]
+      ,i.[SerialNumber]
+      ,i.[StockCode]
+      ,i.[SKU]
+      ,i.[CheckpointID]
+      ,i.[CheckpointName]
+      ,i.[ProcessArea]
+      ,i.[TransactionID]
+      ,i.[TransactionDate]
+      ,s.[WIP_SnapshotDate]
+      ,CAST(DATEDIFF_BIG(MILLISECOND, i.[TransactionDate], s.[WIP_SnapshotDate]) / 3600000.0
+            AS DECIMAL(9, 4)) AS DwellTime_calendar
+      ,CAST(CASE WHEN i.[TransactionDate] > s.[WIP_SnapshotDate]
+                 THEN 0
+                 WHEN DATEDIFF(DAY, i.[TransactionDate], s.[WIP_SnapshotDate]) < 2
+                 THEN DATEDIFF_BIG(MILLISECOND, i.[TransactionDate], s.[WIP_SnapshotDate]) / 3600000.0
+                 ELSE DATEDIFF_BIG(MICROSECOND, a.[WorkStart], a.[WorkEnd]) / 3600000000.0
+                      - 24 * ((wd.[StartWeekday] + wd.[DaysBetween] + 2) / 7 + (wd.[StartWeekday] + wd.[DaysBetween] + 1) / 7
+                              - (wd.[StartWeekday] + 2) / 7 - (wd.[StartWeekday] + 1) / 7)
+            END AS DECIMAL(9, 4)) AS DwellTime_working
+      ,i.[OrderType]
+      ,i.[FactoryStatus]
+      ,i.[ProductType]
+      ,i.[Customer]
+      ,i.[PackedIsLast_flag]
+      ,i.[PackedPreviously_flag]
+      ,i.[ExtractionDate]
+FROM [SBILearning].[dbo].[DNun_tbl_Production_WIP_intervals] AS i
+INNER JOIN Tally_CTE AS t
+    ON t.DayOffset <= DATEDIFF(DAY, i.[WIP_SnapshotStart], i.[WIP_SnapshotEnd])
+CROSS APPLY (
+    SELECT DATEADD(DAY, t.DayOffset, i.[WIP_SnapshotStart]) AS WIP_SnapshotDate
+) AS s
+CROSS APPLY (
+    SELECT DATEDIFF(DAY, 0, i.[TransactionDate]) % 7 AS StartWeekday
+          ,DATEDIFF(DAY, 0, s.[WIP_SnapshotDate]) % 7 AS EndWeekday
+) AS w
+CROSS APPLY (
+    SELECT CASE w.[StartWeekday]
+               WHEN 5 THEN DATEADD(DAY, 2, CAST(CAST(i.[TransactionDate] AS DATE) AS DATETIME2(7)))
+               WHEN 6 THEN DATEADD(DAY, 1, CAST(CAST(i.[TransactionDate] AS DATE) AS DATETIME2(7)))
+               ELSE CAST(i.[TransactionDate] AS DATETIME2(7))
+           END AS WorkStart
+          ,CASE w.[EndWeekday]
+               WHEN 5 THEN DATEADD(MICROSECOND, 9999, DATEADD(SECOND, 86399 - 86400,
+                                   CAST(CAST(s.[WIP_SnapshotDate] AS DATE) AS DATETIME2(7))))
+               WHEN 6 THEN DATEADD(MICROSECOND, 9999, DATEADD(SECOND, 86399 - 2 * 86400,
+                                   CAST(CAST(s.[WIP_SnapshotDate] AS DATE) AS DATETIME2(7))))
+               ELSE CAST(s.[WIP_SnapshotDate] AS DATETIME2(7))
+           END AS WorkEnd
+) AS a
+CROSS APPLY (
+    SELECT CASE WHEN w.[StartWeekday] >= 5 THEN 0 ELSE w.[StartWeekday] END AS StartWeekday
+          ,CASE WHEN FLOOR(DATEDIFF_BIG(MICROSECOND, a.[WorkStart], a.[WorkEnd]) / 86400000000.0) - 1 > 0
+                THEN CAST(FLOOR(DATEDIFF_BIG(MICROSECOND, a.[WorkStart], a.[WorkEnd]) / 86400000000.0) - 1 AS INT)
+                ELSE 0
+           END AS DaysBetween
+) AS wd;
+GO
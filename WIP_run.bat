@@ -1,8 +1,4 @@
 @echo off
-echo Running raw data extraction
-python "src\main.py"
-echo Raw data extraction completed.
-
-echo Running data transformation and loading
-python "src\main.py"
+echo Running the WIP pipeline: extract, link, clean and load
+python "src\main.py" %*
 echo Script completed.
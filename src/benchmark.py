@@ -0,0 +1,340 @@
+# Benchmarks of the WIP program stages
+from storage import *
+from transform import read_chunks_manifest, link_raw_data, assign_wip
+from loading import wip_rows, CHUNK_SIZE
+from model import PopulationHistory
+from synthetic import generate_raw_data
+from extraction import select_ph_rawData, DATE_THRESHOLD
+from db_conn import create_async_pool
+from utilities import datetime_from_py_to_sql, compact_dtypes, memory_footprint, delta_working_hours_array, \
+    df_partitioner
+from metrics import read_query_metrics, query_metrics_summary
+from datetime import datetime as dt
+import asyncio
+import numpy as np
+import pandas as pd
+import threading
+import tracemalloc
+import ctypes
+import gc
+import os
+import sys
+try:  # Unix
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SERVER_NAME_asbuilt = 'ZwhirlpoolR'
+DATABASE_NAME_asbuilt = 'ASBuiltDW'
+# Chunk numbers of the transform benchmark, far above the ones of a run so that its chunk files are left alone
+BENCHMARK_CHUNK_BASE = 9_000
+
+
+def benchmark_handoff(dataframe, chunks_count=8, repeat=3):
+    """
+    Function times the hand-off of a dataframe between the extraction run and the cleaning pool for each file format:
+    the parallel write of its chunks and the read of every chunk
+    :param dataframe: A dataframe containing raw data
+    :type dataframe: pandas.Dataframe
+    :param chunks_count: The number of chunks the dataframe is split into
+    :type chunks_count: int
+    :param repeat: The number of runs of each format. The best run is kept
+    :type repeat: int
+    :return: A dataframe with the best write and read times in seconds and the files size in MB of each format
+    :rtype: pandas.Dataframe
+    """
+    chunks = [dataframe.iloc[rows].reset_index(drop=True)
+              for rows in np.array_split(np.arange(dataframe.shape[0]), chunks_count)]
+    results = []
+    for handoff_format in ('hdf5', 'arrow'):
+        paths = [chunk_path('benchmark', chunk_num, handoff_format) for chunk_num in range(1, chunks_count + 1)]
+        write_times = []
+        read_times = []
+        for _ in range(repeat):
+            time_tracker = dt.now()
+            write_chunks(list(zip(chunks, paths)), handoff_format=handoff_format)
+            write_times.append((dt.now() - time_tracker).total_seconds())
+            time_tracker = dt.now()
+            for path in paths:
+                read_chunk(path, handoff_format=handoff_format)
+            read_times.append((dt.now() - time_tracker).total_seconds())
+        results.append({'format': handoff_format, 'write_s': min(write_times), 'read_s': min(read_times),
+                        'size_MB': sum(os.path.getsize(path) for path in paths) / 1_048_576})
+        for path in paths:
+            os.remove(path)
+    return pd.DataFrame(results)
+
+
+def memory_report(dataframes):
+    """
+    Function reports the memory footprint of dataframes with the column types they get from the DB rows (strings as
+    Python objects, 64-bit integers) and with the compact column types of RAW_DTYPES
+    :param dataframes: The dataframes to report, by name
+    :type dataframes: dict
+    :return: A dataframe with the rows count and the footprint in MB before and after of each dataframe
+    :rtype: pandas.Dataframe
+    """
+    results = []
+    for name, dataframe in dataframes.items():
+        plain_df = dataframe.astype({**{column: object for column in dataframe.select_dtypes('category').columns},
+                                     **{column: 'int64' for column in dataframe.select_dtypes('integer').columns}})
+        results.append({'data': name, 'rows': dataframe.shape[0], 'plain_MB': memory_footprint(plain_df),
+                        'compact_MB': memory_footprint(compact_dtypes(plain_df))})
+    return pd.DataFrame(results)
+
+
+def measure_stage(stage_function, *args, **kwargs):
+    """
+    Function runs one stage and measures its wall time and the peak of the memory allocated while it runs
+    :param stage_function: The function of the stage
+    :type stage_function: function
+    :return: The result of the stage, its wall time in seconds and its peak allocated memory in MB
+    :rtype: tuple
+    """
+    tracemalloc.start()
+    time_tracker = dt.now()
+    try:
+        result = stage_function(*args, **kwargs)
+        return result, (dt.now() - time_tracker).total_seconds(), tracemalloc.get_traced_memory()[1] / 1_048_576
+    finally:
+        tracemalloc.stop()
+
+
+def clean_chunks(rawData_df, sap_historicalStatus_df, isServerLevel, chunks_count=2):
+    """
+    Function cleans linked raw data the way the cleaning pool does, one chunk after the other in this process: the
+    units are split into chunks of balanced cost, each chunk is exported and assign_wip stores its cleaned chunk
+    :param rawData_df: A dataframe containing the linked raw data
+    :type rawData_df: pandas.Dataframe
+    :param sap_historicalStatus_df: A dataframe containing the SAP historical status data of the same units
+    :type sap_historicalStatus_df: pandas.Dataframe
+    :param isServerLevel: A flag that indicates whether the raw data is server data or rack data
+    :param chunks_count: The number of chunks
+    :type chunks_count: int
+    :return: The numbers of the cleaned chunks
+    :rtype: list
+    """
+    unit_costs = PopulationHistory(rawData_df, None, dt.now(), isServer=isServerLevel).estimate_unit_costs()
+    chunk_nums = []
+    for rawData_chunk, sap_chunk, _ in df_partitioner(rawData_df, sap_historicalStatus_df, chunks_count, unit_costs):
+        chunk_num = BENCHMARK_CHUNK_BASE + len(chunk_nums) + (0 if isServerLevel else chunks_count)
+        write_chunks([(rawData_chunk, chunk_path('wip_rawData', chunk_num)),
+                      (sap_chunk, chunk_path('sap_historyData', chunk_num))])
+        assign_wip(None, chunk_num, isServerLevel, load=False)
+        chunk_nums.append(chunk_num)
+    return chunk_nums
+
+
+def dwell_times(wip_df):
+    """
+    Function computes the calendar and working dwell times of cleaned WIP data, as assign_wip does
+    :param wip_df: A dataframe containing the cleaned WIP records, with datetime columns
+    :type wip_df: pandas.Dataframe
+    :return: The calendar and the working dwell times in hours
+    :rtype: tuple
+    """
+    calendar_dwell = (wip_df['SnapshotTime'] - wip_df['TransactionDate']).dt.total_seconds() / 3600
+    return calendar_dwell, delta_working_hours_array(wip_df['TransactionDate'], wip_df['SnapshotTime'],
+                                                     calendar=False)
+
+
+def serialize_wip(wip_df):
+    """
+    Function serializes cleaned WIP data for the load: the typed rows of values, in the batches of each INSERT
+    :param wip_df: A dataframe containing the cleaned WIP records
+    :type wip_df: pandas.Dataframe
+    :return: The number of INSERT batches
+    :rtype: int
+    """
+    cleaned_wip_list = wip_rows(wip_df)
+    wip_batches = [cleaned_wip_list[i: i + CHUNK_SIZE] for i in range(0, len(cleaned_wip_list), CHUNK_SIZE)]
+    return len(wip_batches)
+
+
+def benchmark_transform(units_counts=(10_000, 100_000, 1_000_000), seed=0):
+    """
+    Function benchmarks the transform stages on synthetic manufacturing histories of several scales: the generation,
+    the linkage of the rack data, the WIP cleaning of the server and rack chunks, the dwell time computation and the
+    serialization for the load. Each stage reports its wall time and the peak memory allocated while it runs; the
+    cleaning also reports its throughput in units and WIP rows per second
+    :param units_counts: The numbers of servers of the synthetic histories
+    :type units_counts: tuple
+    :param seed: The seed of the synthetic histories, so that runs are comparable
+    :type seed: int
+    :return: A dataframe with one row per scale and stage
+    :rtype: pandas.Dataframe
+    """
+    results = []
+    for units_count in units_counts:
+        def record(stage, seconds, peak_MB, **measures):
+            results.append({'units': units_count, 'stage': stage, 'wall_s': seconds, 'peak_MB': peak_MB, **measures})
+            print(f"{units_count:,} units - {stage}: {seconds:.2f} s, {peak_MB:,.0f} MB")
+
+        (re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, sr_sap_statusH_df, re_sap_statusH_df,
+         customers_df), seconds, peak_MB = measure_stage(generate_raw_data, units_count, seed)
+        record('generate', seconds, peak_MB, rows=re_rawData_df.shape[0] + sr_rawData_df.shape[0])
+
+        (re_rawData_df, sr_rawData_df), seconds, peak_MB = measure_stage(
+            link_raw_data, re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, customers_df)
+        record('link_raw_data', seconds, peak_MB, rows=re_rawData_df.shape[0] + sr_rawData_df.shape[0])
+        del re_rackBuild_df, re_rackEoL_df
+
+        chunk_nums = []
+        for rawData_df, sap_historicalStatus_df, isServerLevel in ((sr_rawData_df, sr_sap_statusH_df, True),
+                                                                    (re_rawData_df, re_sap_statusH_df, False)):
+            level_chunk_nums, seconds, peak_MB = measure_stage(clean_chunks, rawData_df, sap_historicalStatus_df,
+                                                               isServerLevel)
+            chunk_nums += level_chunk_nums
+            wip_count = sum(read_chunk(chunk_path('wip_cleaned', chunk_num)).shape[0]
+                            for chunk_num in level_chunk_nums)
+            distinctSN_count = rawData_df['SerialNumber'].nunique()
+            record(f"assign_wip {'SR' if isServerLevel else 'RE'}", seconds, peak_MB, rows=wip_count,
+                   units_per_s=distinctSN_count / seconds, rows_per_s=wip_count / seconds)
+        del re_rawData_df, sr_rawData_df, sr_sap_statusH_df, re_sap_statusH_df
+
+        wip_df = pd.concat([read_chunk(chunk_path('wip_cleaned', chunk_num)) for chunk_num in chunk_nums],
+                           ignore_index=True)
+        _, seconds, peak_MB = measure_stage(dwell_times, wip_df)
+        record('dwell', seconds, peak_MB, rows=wip_df.shape[0], rows_per_s=wip_df.shape[0] / seconds)
+        _, seconds, peak_MB = measure_stage(serialize_wip, wip_df)
+        record('serialize', seconds, peak_MB, rows=wip_df.shape[0], rows_per_s=wip_df.shape[0] / seconds)
+        del wip_df
+
+        for chunk_num in chunk_nums:
+            for name in ('wip_rawData', 'sap_historyData', 'wip_cleaned'):
+                os.remove(chunk_path(name, chunk_num))
+    print(f"Peak RSS of the benchmark process: {process_memory_MB()[1]:,.0f} MB")
+    return pd.DataFrame(results)
+
+
+def process_memory_MB():
+    """
+    Function returns the resident memory (the working set on Windows) of this process and its peak so far
+    :return: The resident memory and its peak in MB
+    :rtype: tuple
+    """
+    if resource is None:
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + \
+                       [(field, ctypes.c_size_t) for field in ('PeakWorkingSetSize', 'WorkingSetSize',
+                                                               'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                                                               'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage',
+                                                               'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.WorkingSetSize / 1_048_576, counters.PeakWorkingSetSize / 1_048_576
+    with open('/proc/self/statm') as statm:  # Linux
+        rss_bytes = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return rss_bytes / 1_048_576, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KB
+
+
+def measure_peak_rss(stage_function, *args, interval=0.01, **kwargs):
+    """
+    Function runs one stage and samples the resident memory of the process while it runs. Unlike the peak of the
+    process, the peak of the samples is not hidden by the earlier stages
+    :param stage_function: The function of the stage
+    :type stage_function: function
+    :param interval: The seconds between two samples
+    :type interval: float
+    :return: The result of the stage, its wall time in seconds, and the resident memory in MB before the stage and at
+    its peak
+    :rtype: tuple
+    """
+    rss_samples = [process_memory_MB()[0]]
+    stop_sampling = threading.Event()
+
+    def sample_rss():
+        while not stop_sampling.wait(interval):
+            rss_samples.append(process_memory_MB()[0])
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    time_tracker = dt.now()
+    try:
+        result = stage_function(*args, **kwargs)
+        seconds = (dt.now() - time_tracker).total_seconds()
+    finally:
+        stop_sampling.set()
+        sampler.join()
+    rss_samples.append(process_memory_MB()[0])
+    return result, seconds, rss_samples[0], max(rss_samples)
+
+
+def benchmark_allocation(units_counts=(1_000_000,), seed=0):
+    """
+    Function reports the resident memory of the raw data allocation (link_raw_data) on synthetic manufacturing
+    histories: before it, with its input loaded, and at its peak
+    :param units_counts: The numbers of servers of the synthetic histories
+    :type units_counts: tuple
+    :param seed: The seed of the synthetic histories, so that runs are comparable
+    :type seed: int
+    :return: A dataframe with the resident memory in MB before the allocation and at its peak, the difference and the
+    wall time in seconds of each scale
+    :rtype: pandas.Dataframe
+    """
+    results = []
+    for units_count in units_counts:
+        re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, _, _, customers_df = \
+            generate_raw_data(units_count, seed)
+        gc.collect()
+        _, seconds, input_MB, peak_MB = measure_peak_rss(link_raw_data, re_rawData_df, sr_rawData_df, re_rackBuild_df,
+                                                         re_rackEoL_df, customers_df)
+        results.append({'units': units_count, 'input_rss_MB': input_MB, 'peak_rss_MB': peak_MB,
+                        'allocation_MB': peak_MB - input_MB, 'wall_s': seconds})
+        del re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, customers_df
+        gc.collect()
+    return pd.DataFrame(results)
+
+
+async def benchmark_ph_extraction(partitions_counts=(1, 2, 4, 8, 12), date_threshold=DATE_THRESHOLD):
+    """
+    Function times the product history raw data extraction for each number of concurrent TransactionDate ranges
+    :param partitions_counts: The numbers of ranges to time
+    :type partitions_counts: tuple
+    :param date_threshold: The lower limit of data extraction
+    :type date_threshold: datetime.datetime
+    :return: A dataframe with the wall time in seconds and the rows count of each number of ranges
+    :rtype: pandas.Dataframe
+    """
+    async_pool_asbuilt = await create_async_pool(SERVER_NAME_asbuilt, DATABASE_NAME_asbuilt)
+    results = []
+    try:
+        for partitions_count in partitions_counts:
+            time_tracker = dt.now()
+            re_rawData_df, sr_rawData_df = await select_ph_rawData(async_pool_asbuilt,
+                                                                   datetime_from_py_to_sql(date_threshold),
+                                                                   partitions_count=partitions_count)
+            results.append({'partitions': partitions_count, 'wall_s': (dt.now() - time_tracker).total_seconds(),
+                            'rows': re_rawData_df.shape[0] + sr_rawData_df.shape[0]})
+    finally:
+        async_pool_asbuilt.close()
+        await async_pool_asbuilt.wait_closed()
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    if 'extraction' in sys.argv:  # Benchmark the product history extraction against the number of ranges
+        print(f"Product history extraction:\n{asyncio.run(benchmark_ph_extraction())}")
+    elif 'memory' in sys.argv:  # Report the memory footprint of the raw data chunks of the last extraction run
+        chunks_manifest = read_chunks_manifest()
+        print(memory_report({f"{name} ({chunk_info['chunk']})": read_chunk(chunk_path(name, chunk_info['chunk']))
+                             for chunk_info in chunks_manifest for name in ('wip_rawData', 'sap_historyData')}))
+    elif 'transform' in sys.argv:  # Benchmark the transform stages on synthetic data, e.g. transform 10000 100000
+        units_counts = tuple(int(arg) for arg in sys.argv[sys.argv.index('transform') + 1:]) or \
+            (10_000, 100_000, 1_000_000)
+        with pd.option_context('display.max_columns', None, 'display.width', 200):
+            print(benchmark_transform(units_counts))
+    elif 'allocation' in sys.argv:  # Peak memory of the raw data allocation on synthetic data, e.g. allocation 1000000
+        units_counts = tuple(int(arg) for arg in sys.argv[sys.argv.index('allocation') + 1:]) or (1_000_000,)
+        print(benchmark_allocation(units_counts))
+    elif 'metrics' in sys.argv:  # Compare the query metrics of the recorded runs
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(query_metrics_summary(read_query_metrics()))
+    else:  # Benchmark the hand-off with the raw data chunks of the last extraction run
+        chunks_manifest = read_chunks_manifest()
+        rawData_df = pd.concat([read_chunk(chunk_path('wip_rawData', chunk_info['chunk']))
+                                for chunk_info in chunks_manifest], ignore_index=True)
+        print(f"Hand-off of {rawData_df.shape[0]:,} raw data rows:\n{benchmark_handoff(rawData_df)}")
@@ -0,0 +1,248 @@
+# Local caches of the extracted data
+from storage import read_chunk, write_chunk
+from utilities import datetime_from_py_to_sql, concat_compact
+from datetime import datetime as dt, timedelta
+import pandas as pd
+import json
+import os
+import shutil
+import threading
+
+
+# Raw data cache: the rows of each cached SELECT query, in one file per month, and the high-watermark of each query
+USE_RAW_CACHE = True
+RAW_CACHE_DIRECTORY = "CleanedRecords_csv/raw_cache"
+RAW_CACHE_WATERMARKS = f"{RAW_CACHE_DIRECTORY}/watermarks.json"
+# Rows this old before the watermark are selected again, for late arrivals and late changes in the source tables
+RAW_CACHE_LOOKBACK = timedelta(days=3)
+# The cached queries are merged in concurrent threads, which update the watermarks file one at a time
+WATERMARKS_LOCK = threading.Lock()
+
+# Reference data cache: one file per reference table, selected again once it is older than its time to live
+REFERENCE_CACHE_DIRECTORY = "CleanedRecords_csv/reference_cache"
+REFERENCE_TTL = {'customers': timedelta(days=1), 'agile_SSCode': timedelta(days=7),
+                 'sap_productionOrders': timedelta(days=7)}
+
+
+def read_watermarks():
+    """
+    Function reads the high-watermarks of the raw data cache
+    :return: The latest cached date of each cached SELECT query
+    :rtype: dict
+    """
+    if not os.path.exists(RAW_CACHE_WATERMARKS):
+        return {}
+    with open(RAW_CACHE_WATERMARKS) as watermarks_file:
+        return json.load(watermarks_file)
+
+
+def write_watermark(name, watermark):
+    """
+    Function updates the high-watermark of one cached SELECT query. The file is replaced in one step, so a reader
+    never gets a partial file, and the update is locked, so concurrent merges do not overwrite each other's watermark
+    :param name: The name of the cached SELECT query
+    :type name: str
+    :param watermark: The latest cached date of the query in ISO format
+    :type watermark: str
+    :return: None
+    """
+    with WATERMARKS_LOCK:
+        watermarks = read_watermarks()
+        watermarks[name] = watermark
+        with open(f"{RAW_CACHE_WATERMARKS}.tmp", 'w') as watermarks_file:
+            json.dump(watermarks, watermarks_file, indent=2)
+        os.replace(f"{RAW_CACHE_WATERMARKS}.tmp", RAW_CACHE_WATERMARKS)
+
+
+def raw_cache_lowerBound(name, date_threshold):
+    """
+    Function returns the lower limit of the next extraction of a cached SELECT query: its watermark minus the
+    lookback, or date_threshold if nothing is cached yet
+    :param name: The name of the cached SELECT query
+    :type name: str
+    :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
+    :type date_threshold: str
+    :return: The lower limit of the extraction in SQL format
+    :rtype: str
+    """
+    watermark = read_watermarks().get(name) if USE_RAW_CACHE else None
+    if watermark is None:
+        return date_threshold
+    lower_bound = pd.Timestamp(watermark) - RAW_CACHE_LOOKBACK
+    if lower_bound <= pd.Timestamp(date_threshold):
+        return date_threshold
+    return datetime_from_py_to_sql(lower_bound.to_pydatetime())
+
+
+def merge_raw_cache(name, fetched_df, date_column, lower_bound, date_threshold):
+    """
+    Function merges the rows selected after lower_bound into the raw data cache and returns all the cached rows after
+    date_threshold, which are the rows a full extraction returns.
+    The cached rows after lower_bound are replaced by the selected rows. The selected rows before lower_bound are added
+    to the cache unless they are already in it. Months that end before date_threshold are evicted
+    :param name: The name of the cached SELECT query
+    :type name: str
+    :param fetched_df: A dataframe containing the rows selected from lower_bound
+    :type fetched_df: pandas.Dataframe
+    :param date_column: The datetime column the cache is partitioned by
+    :type date_column: str
+    :param lower_bound: The lower limit of the extraction of fetched_df in SQL format
+    :type lower_bound: str
+    :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
+    :type date_threshold: str
+    :return: A dataframe containing all the cached rows after date_threshold
+    :rtype: pandas.Dataframe
+    """
+    if not USE_RAW_CACHE:
+        return fetched_df
+    cache_directory = f"{RAW_CACHE_DIRECTORY}/{name}"
+    os.makedirs(cache_directory, exist_ok=True)
+    lower_bound = pd.Timestamp(lower_bound)
+    date_threshold = pd.Timestamp(date_threshold)
+
+    # Merge the selected rows into the months they belong to and into the months after lower_bound
+    cached_months = {pd.Period(file_name[:-len('.arrow')], 'M') for file_name in os.listdir(cache_directory)}
+    fetched_months = fetched_df[date_column].dt.to_period('M')
+    for month in sorted(set(fetched_months.dropna()) | {month for month in cached_months
+                                                         if month.end_time > lower_bound}):
+        month_path = f"{cache_directory}/{month}.arrow"
+        month_df = fetched_df[(fetched_months == month).to_numpy()]
+        if month in cached_months:
+            cached_df = read_chunk(month_path, handoff_format='arrow', memory_map=False)
+            cached_df = cached_df[cached_df[date_column] <= lower_bound]
+            month_df = concat_compact([cached_df, month_df], ignore_index=True).drop_duplicates(ignore_index=True)
+        write_chunk(month_df, month_path, handoff_format='arrow')
+        cached_months.add(month)
+
+    # Evict the months that are out of the extraction window
+    for month in [month for month in cached_months if month.end_time <= date_threshold]:
+        os.remove(f"{cache_directory}/{month}.arrow")
+        cached_months.remove(month)
+
+    # Keep the latest cached date, so that the next extraction starts from it
+    if fetched_df.shape[0] > 0:
+        write_watermark(name, fetched_df[date_column].max().isoformat())
+
+    cached_dfs = [read_chunk(f"{cache_directory}/{month}.arrow", handoff_format='arrow')
+                  for month in sorted(cached_months)]
+    if len(cached_dfs) < 1:
+        return fetched_df.iloc[:0]
+    raw_df = concat_compact(cached_dfs, ignore_index=True)
+    return raw_df[raw_df[date_column] > date_threshold].reset_index(drop=True)
+
+
+def clear_raw_cache():
+    """
+    Function deletes the raw data cache and its watermarks, so that the next extraction selects the whole window again
+    :return: None
+    """
+    if os.path.exists(RAW_CACHE_DIRECTORY):
+        shutil.rmtree(RAW_CACHE_DIRECTORY)
+
+
+def reference_cache_path(name):
+    """
+    Function returns the path of a cached reference table
+    :param name: The name of the reference table
+    :type name: str
+    :return: The path of the cache file
+    :rtype: str
+    """
+    return f"{REFERENCE_CACHE_DIRECTORY}/{name}.arrow"
+
+
+def read_reference_cache(name, fresh_after=None):
+    """
+    Function reads a cached reference table, unless it is older than its time to live or than fresh_after
+    :param name: The name of the reference table
+    :type name: str
+    :param fresh_after: The datetime the table must have been cached after. None to rely on the time to live only
+    :type fresh_after: datetime.datetime
+    :return: The cached reference table, or None if it must be selected again
+    :rtype: pandas.Dataframe
+    """
+    path = reference_cache_path(name)
+    if not os.path.exists(path):
+        return None
+    cached_time = dt.fromtimestamp(os.path.getmtime(path))
+    if dt.now() - cached_time > REFERENCE_TTL.get(name, timedelta(0)) or \
+            (fresh_after is not None and cached_time < fresh_after):
+        return None
+    # Not memory-mapped, since the file is replaced when the table expires
+    return read_chunk(path, handoff_format='arrow', memory_map=False)
+
+
+def write_reference_cache(name, reference_df):
+    """
+    Function caches a reference table. The file is replaced in one step, so a reader never gets a partial table
+    :param name: The name of the reference table
+    :type name: str
+    :param reference_df: The reference table
+    :type reference_df: pandas.Dataframe
+    :return: None
+    """
+    os.makedirs(REFERENCE_CACHE_DIRECTORY, exist_ok=True)
+    path = reference_cache_path(name)
+    write_chunk(reference_df, f"{path}.tmp", handoff_format='arrow')
+    os.replace(f"{path}.tmp", path)
+
+
+def reference_missingKeys_path(name):
+    """
+    Function returns the path of the keys that were missing from a cached reference table when it was checked
+    :param name: The name of the reference table
+    :type name: str
+    :return: The path of the missing keys file
+    :rtype: str
+    """
+    return f"{REFERENCE_CACHE_DIRECTORY}/{name}_missingKeys.json"
+
+
+def read_reference_missingKeys(name):
+    """
+    Function reads the keys of the joined rows that were missing from the current cached reference table
+    :param name: The name of the reference table
+    :type name: str
+    :return: The missing keys, or None if the current cached table was not checked yet
+    :rtype: set
+    """
+    path = reference_missingKeys_path(name)
+    if not os.path.exists(path) or not os.path.exists(reference_cache_path(name)):
+        return None
+    with open(path) as missingKeys_file:
+        missingKeys = json.load(missingKeys_file)
+    # Keys recorded for an earlier version of the table say nothing about the current one
+    if missingKeys['cached_ns'] != os.stat(reference_cache_path(name)).st_mtime_ns:
+        return None
+    return set(missingKeys['keys'])
+
+
+def write_reference_missingKeys(name, keys):
+    """
+    Function records keys of the joined rows that are missing from the current cached reference table, together with
+    the keys already recorded for it
+    :param name: The name of the reference table
+    :type name: str
+    :param keys: The missing keys
+    :type keys: set
+    :return: None
+    """
+    path = reference_missingKeys_path(name)
+    keys = set(keys) | (read_reference_missingKeys(name) or set())
+    with open(f"{path}.tmp", 'w') as missingKeys_file:
+        json.dump({'cached_ns': os.stat(reference_cache_path(name)).st_mtime_ns, 'keys': sorted(keys)},
+                  missingKeys_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def clear_reference_cache(names=None):
+    """
+    Function invalidates cached reference tables, so that the next run selects them again
+    :param names: The names of the reference tables. None to invalidate all of them
+    :type names: list
+    :return: None
+    """
+    for name in (REFERENCE_TTL if names is None else names):
+        for path in (reference_cache_path(name), reference_missingKeys_path(name)):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,6 +1,39 @@
 # Functions for database connection
-import pyodbc
-import aioodbc
+from local_db import LocalConnection, LocalAsyncConnection, LocalAsyncPool
+import os
+try:  # The SQL Server backend needs the ODBC packages. The local backend runs without them
+    import pyodbc
+    import aioodbc
+except ImportError:
+    pyodbc = aioodbc = None
+
+
+# Environment variable holding the DB backend of the run, so that the worker processes of the loading pool connect to
+# the same backend as the main process: 'sqlserver' for the SQL Server databases, 'local' for the local database
+# (local_db.py), which holds the tables of every server and database
+DB_BACKEND_VARIABLE = 'WIP_DB_BACKEND'
+DB_BACKENDS = ('sqlserver', 'local')
+
+
+def db_backend():
+    """
+    Function returns the DB backend of the run
+    :return: The name of the backend
+    :rtype: str
+    """
+    return os.environ.get(DB_BACKEND_VARIABLE, 'sqlserver')
+
+
+def use_db_backend(backend):
+    """
+    Function sets the DB backend that every connection of this process and of the processes it starts goes through
+    :param backend: The name of the backend, one of DB_BACKENDS
+    :type backend: str
+    :return: None
+    """
+    if backend not in DB_BACKENDS:
+        raise ValueError(f"Unknown DB backend '{backend}'. Use one of {DB_BACKENDS}")
+    os.environ[DB_BACKEND_VARIABLE] = backend
 
 
 def make_connection(server_name, database_name):
@@ -13,6 +46,8 @@ def make_connection(server_name, database_name):
     :return: The connection made to the database
     :rtype: pyodbc.Connection
     """
+    if db_backend() == 'local':
+        return LocalConnection()
     dsn = f"""Driver={{SQL Server}}; 
     Server={server_name}; 
     Database{database_name}; 
@@ -30,6 +65,8 @@ async def async_db_connection(server_name, database_name):
     :type database_name: str
     :return: The async connection made to the database
     """
+    if db_backend() == 'local':
+        return LocalAsyncConnection(LocalConnection())
     dsn = f"""
         Driver={{SQL Server}};
         Server={server_name};
@@ -50,6 +87,8 @@ async def create_async_pool(server_name, database_name):
     :type database_name: str
     :return: The asynchronous pool for the database
     """
+    if db_backend() == 'local':
+        return LocalAsyncPool()
     dsn = f"""
             Driver={{SQL Server}};
             Server={server_name};
@@ -2,6 +2,7 @@
 from alerts import *
 import logging
 from utilities import show_message
+from metrics import execute_metered
 from datetime import datetime as dt, timedelta
 
 
@@ -27,7 +28,7 @@ def delete_oldData(db_conn):
         delete_start = dt.now()
         with db_conn.cursor() as cursor:
             print("Deleting old data...")
-            cursor.execute(query)
+            execute_metered(cursor, 'wip_old_delete', query)
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_D_ERROR, exc_info=True)
@@ -38,19 +39,20 @@ def delete_oldData(db_conn):
               f"T: {dt.now() - delete_start}\n")
 
 
-def delete_allData(db_conn):
+def delete_allData(db_conn, asIntervals=False):
     """
     Delete function truncates the WIP table
     :param db_conn: The connection to the database
-    :return: None
+    :param asIntervals: Flag to truncate the WIP intervals table instead of the WIP table
+    :return: True if the table was truncated, None if the TRUNCATE failed
     """
-    query = "TRUNCATE TABLE [SBILearning].[dbo].[DNun_tbl_Production_WIP_history];"
+    query = f"TRUNCATE TABLE [SBILearning].[dbo].[DNun_tbl_Production_WIP_{'intervals' if asIntervals else 'history'}];"
 
     try:
         delete_start = dt.now()
         with db_conn.cursor() as cursor:
             print("Deleting all data...")
-            cursor.execute(query)
+            execute_metered(cursor, 'wip_truncate', query)
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_D_ERROR, exc_info=True)
@@ -58,3 +60,4 @@ def delete_allData(db_conn):
     else:
         db_conn.commit()
         print(f"WIP table has been cleared\nT: {dt.now() - delete_start}\n")
+        return True
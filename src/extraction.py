@@ -1,9 +1,13 @@
 # SELECT SQL queries
 from utilities import *
 from alerts import *
+from cache import *
+from metrics import *
 import pandas as pd
 from datetime import datetime as dt, timedelta, date
 import logging
+import asyncio
+from functools import partial
 
 SQL_Q_ERROR = "An SQL SELECT statement error occurred"
 # To build table from scratch
@@ -12,17 +16,159 @@ if dt.now().date() == date(2023, 10, 30):
 else:  # Normal runs
     DATE_THRESHOLD = dt.now() - timedelta(days=400)
 
+# Number of rows pulled from the DB at a time by the SELECT functions
+FETCH_BATCH_SIZE = 100_000
+# Number of TransactionDate ranges of the product history raw data selected concurrently. Together with the other
+# concurrent SELECT queries, it should not exceed the size of the async pool
+PH_PARTITIONS = 8
+# Upper limit of the extraction window, evaluated by the DB server
+SQL_UPPER_LIMIT = "CONCAT(CAST(GETDATE() AS DATE), ' 9:00')"
+# Select the SAP history of the serial numbers uploaded from the product history raw data, instead of scanning
+# product history again for them in the SAP query. Off by default: the SAP query then waits for the product history
+# extraction instead of running next to it, and the saving of the joined query over that wait is not measured yet
+SAP_SNS_FROM_PH = False
+# Classify the rows as rack or server data and remap the hipot starts in the SQL queries (True), instead of on the
+# fetched dataframes. The raw data caches of the two queries are kept apart, under the names given by raw_cache_name
+SQL_CLASSIFICATION = True
+# SQL condition of the rack stock codes, the same as the RE_STOCKCODE_PATTERN regex
+RE_STOCKCODE_SQL = "{} COLLATE Latin1_General_BIN LIKE 'RE-[0-9][0-9][0-9]%'"
+RE_STOCKCODE_PATTERN = r"^RE-\d{3,5}-?\d{0,3}"
+# SQL condition of the hipot start rows of a hipot checkpoint, which are failed transactions with a 'Test Start' message
+HIPOT_START_SQL = ("(ph.[CheckPointId] = {} AND ph.[Success] = 0 "
+                   "AND ph.[Message] COLLATE Latin1_General_BIN = 'Test Start')")
+# Reference tables being selected, so that concurrent queries wait for one SELECT instead of running their own
+REFERENCE_LOADS = {}
+
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.ERROR)
 
 
-def select_wipTable_count(db_conn):
-    query = "SELECT COUNT(*) FROM [SBILearning].[dbo].[DNun_tbl_Production_WIP_history];"
+def assure_batch_types(batch_df, strip_columns=(), datetime_columns=()):
+    """
+    Function ensures correct serial numbers by cleaning their leading and trailing spaces and ensures the datetime
+    columns are of type datetime
+    :param batch_df: A dataframe of fetched rows
+    :type batch_df: pandas.Dataframe
+    :param strip_columns: The serial number columns
+    :param datetime_columns: The datetime columns
+    :return: The same dataframe, with its columns typed
+    :rtype: pandas.Dataframe
+    """
+    for column in strip_columns:
+        batch_df[column] = batch_df[column].str.strip()
+    for column in datetime_columns:
+        batch_df[column] = pd.to_datetime(batch_df[column])
+    return batch_df
+
+
+def raw_cache_name(name):
+    """
+    Function gives the raw data cache name of a query that returns the IsRack column with SQL_CLASSIFICATION. The
+    cached rows keep the columns and the checkpoint IDs of the query that selected them, so the rows of the query with
+    and without the classification are cached and watermarked apart
+    :param name: The name of the query
+    :type name: str
+    :return: The name of its raw data cache
+    :rtype: str
+    """
+    return f"{name}_sqlClass" if SQL_CLASSIFICATION else name
+
+
+def isRack_mask(dataframe):
+    """
+    Function gives the rack rows of a dataframe classified by the SQL query. A row without IsRack was not classified,
+    e.g. it comes from a raw data cache of the query without the classification, so it is not counted as either
+    :param dataframe: A dataframe with the IsRack column
+    :type dataframe: pandas.Dataframe
+    :return: True for the RE rows and False for the SR rows
+    :rtype: numpy.ndarray
+    """
+    if dataframe['IsRack'].isna().any():
+        raise ValueError(f"{dataframe['IsRack'].isna().sum():,} rows have no IsRack classification. "
+                         f"Run with --refresh-cache to select them again")
+    return dataframe['IsRack'].to_numpy(dtype=bool)
+
+
+def transactionDate_ranges(date_threshold, partitions_count):
+    """
+    Function splits the extraction window, from date_threshold to today at 9AM, into TransactionDate ranges of equal
+    length. A range includes its upper bound only, so that every row falls in exactly one range
+    :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
+    :type date_threshold: str
+    :param partitions_count: The number of ranges
+    :type partitions_count: int
+    :return: The lower and upper bounds of each range as SQL expressions
+    :rtype: list
+    """
+    inner_bounds = pd.date_range(pd.Timestamp(date_threshold), fixed_date(dt.now()),
+                                 periods=partitions_count + 1)[1:-1].floor('ms')
+    sql_bounds = ([f"'{date_threshold}'"] +
+                  [f"'{datetime_from_py_to_sql(bound.to_pydatetime())}'" for bound in inner_bounds] + [SQL_UPPER_LIMIT])
+    return list(zip(sql_bounds[:-1], sql_bounds[1:]))
+
+
+async def fetch_batches(cursor, batch_size=FETCH_BATCH_SIZE, batch_function=None, query_metrics=None):
+    """
+    Asynchronous generator function that pulls the rows of an executed query in batches with fetchmany and converts
+    each batch to a dataframe straight away, so that only one batch of DB rows is held in memory at a time. The
+    columns of each batch are cast to their compact storage type (RAW_DTYPES) after batch_function
+    :param cursor: The cursor of an executed SELECT query
+    :param batch_size: The number of rows of each batch
+    :type batch_size: int
+    :param batch_function: A function that types or reduces each batch dataframe, e.g. assure_batch_types
+    :param query_metrics: The metrics of the query, as returned by async_execute_metered. They are saved once all the
+    rows are fetched
+    :type query_metrics: QueryMetrics
+    :return: The dataframe of each batch
+    :rtype: pandas.Dataframe
+    """
+    cols = [column[0] for column in cursor.description]
+    while True:
+        fetch_start = perf_counter()
+        rows = await cursor.fetchmany(batch_size)
+        if query_metrics is not None:
+            query_metrics.fetched(rows, fetch_start)
+        if not rows:
+            break
+        build_start = perf_counter()
+        batch_df = pd.DataFrame.from_records(rows, columns=cols)
+        del rows
+        batch_df = compact_dtypes(batch_df if batch_function is None else batch_function(batch_df))
+        if query_metrics is not None:
+            query_metrics.built(build_start)
+        yield batch_df
+    if query_metrics is not None:
+        query_metrics.save()
+
+
+async def fetch_dataframe(cursor, batch_size=FETCH_BATCH_SIZE, batch_function=None, query_metrics=None):
+    """
+    Function pulls all the rows of an executed query in batches with fetch_batches and concatenates the batch
+    dataframes once, instead of building one dataframe from all the DB rows at once
+    :param cursor: The cursor of an executed SELECT query
+    :param batch_size: The number of rows of each batch
+    :type batch_size: int
+    :param batch_function: A function that types or reduces each batch dataframe, e.g. assure_batch_types
+    :param query_metrics: The metrics of the query, as returned by async_execute_metered
+    :type query_metrics: QueryMetrics
+    :return: A dataframe containing all the rows
+    :rtype: pandas.Dataframe
+    """
+    batches = [batch_df async for batch_df in fetch_batches(cursor, batch_size, batch_function, query_metrics)]
+    if len(batches) < 1:
+        empty_df = pd.DataFrame([], columns=[column[0] for column in cursor.description])
+        return compact_dtypes(empty_df if batch_function is None else batch_function(empty_df))
+    return concat_compact(batches, ignore_index=True)
+
+
+def select_wipTable_count(db_conn, asIntervals=False):
+    query = f"SELECT COUNT(*) " \
+            f"FROM [SBILearning].[dbo].[DNun_tbl_Production_WIP_{'intervals' if asIntervals else 'history'}];"
 
     try:
         with db_conn.cursor() as cursor:
-            cursor.execute(query)
-            table_count = int(cursor.fetchone()[0])
+            query_metrics = execute_metered(cursor, 'wip_count', query)
+            table_count = int(fetchone_metered(cursor, query_metrics)[0])
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
@@ -46,8 +192,8 @@ def select_wip_maxDate(db_conn, snapshotTime=False):
     try:
         time_tracker = dt.now()
         with db_conn.cursor() as cursor:
-            cursor.execute(query)
-            max_date = cursor.fetchone()
+            query_metrics = execute_metered(cursor, 'wip_maxDate', query)
+            max_date = fetchone_metered(cursor, query_metrics)
             max_date = max_date[0]
     except Exception as e:
         print(repr(e))
@@ -56,6 +202,8 @@ def select_wip_maxDate(db_conn, snapshotTime=False):
     else:
         if max_date is None:  # Table is empty
             max_date = DATE_THRESHOLD
+        elif isinstance(max_date, str):  # The local DB backend returns datetimes as text
+            max_date = pd.Timestamp(max_date).to_pydatetime()
         print(f"SELECT process for MAX date from WIP ran successfully. The latest MAX date is: {max_date}\n"
               f"T: {dt.now() - time_tracker}\n")
         return max_date
@@ -92,20 +240,14 @@ async def select_customers(async_pool):
         time_tracker = dt.now()
         async with async_pool.acquire() as db_conn:
             async with db_conn.cursor() as cursor:
-                await cursor.execute(query_sap)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                customers_df = pd.DataFrame.from_records(rows, columns=cols)
-
-                await cursor.execute(query_azu)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                azu_customer_df = pd.DataFrame.from_records(rows, columns=cols)
-
-                await cursor.execute(query_amz)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                amz_customer_df = pd.DataFrame.from_records(rows, columns=cols)
+                query_metrics = await async_execute_metered(cursor, 'customers_sap', query_sap)
+                customers_df = await fetch_dataframe(cursor, query_metrics=query_metrics)
+
+                query_metrics = await async_execute_metered(cursor, 'customers_azu', query_azu)
+                azu_customer_df = await fetch_dataframe(cursor, query_metrics=query_metrics)
+
+                query_metrics = await async_execute_metered(cursor, 'customers_amz', query_amz)
+                amz_customer_df = await fetch_dataframe(cursor, query_metrics=query_metrics)
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
@@ -116,20 +258,181 @@ async def select_customers(async_pool):
         customers_df = pd.concat([customers_df, azu_customer_df, amz_customer_df], ignore_index=True)
         customers_df.dropna(inplace=True)
         customers_df.drop_duplicates(subset=['StockCode'], inplace=True)
+        customers_df = compact_dtypes(customers_df)
         print(f"SELECT process for customers ran successfully. T: {dt.now() - time_tracker}\n")
         return customers_df
 
 
-async def select_ph_rawData(async_pool, date_threshold):
+async def select_agile_SSCode(async_pool):
     """
-    SELECT function to get all the raw data from product history
+    Function gets the SKU of each stock code from Agile
+    :param async_pool: The asynchronous pool to access the DB
+    :return: A dataframe containing stock codes and SKUs
+    :rtype: pandas.Dataframe
+    """
+    query = """
+            SELECT ITEM_NUMBER AS StockCode, SKU
+            FROM [ASBuiltDW].[dbo].[tbl_ref_agile_SSCode];
+            """
+    print("SELECT process for Agile SKUs is running on the background...\n")
+    try:
+        time_tracker = dt.now()
+        async with async_pool.acquire() as db_conn:
+            async with db_conn.cursor() as cursor:
+                query_metrics = await async_execute_metered(cursor, 'agile_SSCode', query)
+                agile_SSCode_df = await fetch_dataframe(cursor, query_metrics=query_metrics)
+    except Exception as e:
+        print(repr(e))
+        LOGGER.error(SQL_Q_ERROR, exc_info=True)
+        show_message(AlertType.FAILED)
+    else:
+        print(f"SELECT process for Agile SKUs ran successfully. T: {dt.now() - time_tracker}\n")
+        return agile_SSCode_df
+
+
+async def select_sap_productionOrders(async_pool):
+    """
+    Function gets the order type of each production order from SAP
+    :param async_pool: The asynchronous pool to access the DB
+    :return: A dataframe containing job orders and order types
+    :rtype: pandas.Dataframe
+    """
+    query = """
+            SELECT JobOrder, OrderTypeCode AS OrderType
+            FROM [ASBuiltDW].[dbo].[tbl_Manufacturing_ProductionOrdersSAP_Current];
+            """
+    print("SELECT process for SAP production orders is running on the background...\n")
+    try:
+        time_tracker = dt.now()
+        async with async_pool.acquire() as db_conn:
+            async with db_conn.cursor() as cursor:
+                query_metrics = await async_execute_metered(cursor, 'sap_productionOrders', query)
+                productionOrders_df = await fetch_dataframe(cursor, query_metrics=query_metrics)
+    except Exception as e:
+        print(repr(e))
+        LOGGER.error(SQL_Q_ERROR, exc_info=True)
+        show_message(AlertType.FAILED)
+    else:
+        print(f"SELECT process for SAP production orders ran successfully. T: {dt.now() - time_tracker}\n")
+        return productionOrders_df
+
+
+REFERENCE_SELECTS = {'customers': select_customers, 'agile_SSCode': select_agile_SSCode,
+                     'sap_productionOrders': select_sap_productionOrders}
+
+
+async def select_reference_data(async_pool, name, fresh_after=None):
+    """
+    Function gets a reference table from the reference data cache, or selects it and caches it if the cached table
+    expired or was cached before fresh_after
+    :param async_pool: The asynchronous pool to access the DB
+    :param name: The name of the reference table, a key of REFERENCE_SELECTS
+    :type name: str
+    :param fresh_after: The datetime the table must have been cached after. None to rely on its time to live only
+    :type fresh_after: datetime.datetime
+    :return: The reference table, or None if the SELECT failed
+    :rtype: pandas.Dataframe
+    """
+    async def select_and_cache():
+        selected_df = await REFERENCE_SELECTS[name](async_pool)
+        if selected_df is not None:
+            await asyncio.to_thread(write_reference_cache, name, selected_df)
+        return selected_df
+
+    while name in REFERENCE_LOADS:  # Another query is selecting this table already
+        await asyncio.wait({REFERENCE_LOADS[name]})
+    reference_df = read_reference_cache(name, fresh_after)
+    if reference_df is not None:
+        return reference_df
+    REFERENCE_LOADS[name] = asyncio.ensure_future(select_and_cache())
+    try:
+        return await REFERENCE_LOADS[name]
+    finally:
+        del REFERENCE_LOADS[name]
+
+
+def sql_key(series, length=None):
+    """
+    Function returns the join key of a string column as SQL Server compares it: case-insensitive and without trailing
+    spaces. Each distinct value is converted once
+    :param series: The string column
+    :type series: pandas.Series
+    :param length: The number of leading characters of the key, like SUBSTRING(column, 1, length). None for all of them
+    :type length: int
+    :return: The join key
+    :rtype: pandas.Series
+    """
+    return series.map({value: value[:length].rstrip().upper() for value in series.dropna().unique()}).astype(object)
+
+
+async def join_reference_data(async_pool, facts_df, serial_column='SerialNumber'):
+    """
+    Function joins the SKU and the OrderType of the cached reference tables to product history rows, like the INNER
+    JOIN on tbl_ref_agile_SSCode and the LEFT JOIN on tbl_Manufacturing_ProductionOrdersSAP_Current do in SQL.
+    The keys of the rows that are missing from a cached table are recorded, and the table is selected again when a
+    key that was not missing before is missing from it, since the key may have been added to the table since then
+    :param async_pool: The asynchronous pool to access the DB
+    :param facts_df: A dataframe containing product history rows with their StockCode
+    :type facts_df: pandas.Dataframe
+    :param serial_column: The serial number column, whose first 8 characters are the job order
+    :type serial_column: str
+    :return: The product history rows with their SKU and OrderType
+    :rtype: pandas.Dataframe
+    """
+    joined_df = facts_df
+    # The key column of each reference table is its first column
+    for name, key_column, key_length, how in (('agile_SSCode', 'StockCode', None, 'inner'),
+                                              ('sap_productionOrders', serial_column, 8, 'left')):
+        fact_keys = sql_key(joined_df[key_column], key_length)
+        reference_df = await select_reference_data(async_pool, name)
+        if reference_df is None:
+            raise RuntimeError(f"The reference table {name} was not selected")
+        reference_keys = sql_key(reference_df.iloc[:, 0])
+        missing_keys = set(fact_keys.dropna().unique()) - set(reference_keys.dropna().unique())
+        checked_keys = read_reference_missingKeys(name)
+        if checked_keys is not None and len(missing_keys - checked_keys) > 0:  # New missing keys
+            reference_df = await select_reference_data(async_pool, name, fresh_after=dt.now())
+            if reference_df is None:
+                raise RuntimeError(f"The reference table {name} was not selected")
+            reference_keys = sql_key(reference_df.iloc[:, 0])
+            missing_keys -= set(reference_keys.dropna().unique())
+        write_reference_missingKeys(name, missing_keys)
+        reference_df = reference_df.iloc[:, 1:].assign(joinKey=reference_keys.to_numpy())[reference_keys.notna()]
+        joined_df = (joined_df.assign(joinKey=fact_keys.to_numpy())
+                     .merge(reference_df, on='joinKey', how=how)
+                     .drop(columns='joinKey'))
+    return compact_dtypes(joined_df)
+
+
+async def select_ph_rawData(async_pool, date_threshold, partitions_count=PH_PARTITIONS,
+                            serialNumbers_future=None):
+    """
+    SELECT function to get all the raw data from product history. Only the rows after the watermark of the raw data
+    cache, minus its lookback, are selected and merged into the cache. The selected window is split into
+    TransactionDate ranges that are selected concurrently, each one on its own connection of the pool.
+    Hipot starts (failed 247 and 151 transactions with a 'Test Start' message) get the checkpoint IDs 2470 and 1510 and
+    the other failed transactions are purged. With SQL_CLASSIFICATION this is done in the query, which also returns
+    the IsRack column that splits the rows into RE and SR data
     :param async_pool: The asynchronous pool to access the DB
     :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
     :type date_threshold: str
+    :param partitions_count: The number of TransactionDate ranges selected concurrently
+    :type partitions_count: int
+    :param serialNumbers_future: A future that gets the serial numbers of the raw data, as returned by
+    ph_serialNumbers, before the join with the reference tables drops any row. It gets None if the SELECT fails
+    :type serialNumbers_future: asyncio.Future
     :return: A tuple containing two dataframes, one for SR and the other for RE,
     with all raw elements from product history
     :rtype: tuple
     """
+    if SQL_CLASSIFICATION:
+        checkPointId_sql = (f"CASE WHEN {HIPOT_START_SQL.format(247)} THEN 2470 "
+                            f"WHEN {HIPOT_START_SQL.format(151)} THEN 1510 ELSE ph.[CheckPointId] END")
+        isRack_sql = f"\n          ,CASE WHEN {RE_STOCKCODE_SQL.format('ph.[StockCode]')} THEN 1 ELSE 0 END AS IsRack"
+        success_sql = (f"\n      AND (ph.[Success] <> 0 OR ph.[Success] IS NULL OR {HIPOT_START_SQL.format(247)}"
+                       f"\n            OR {HIPOT_START_SQL.format(151)})")
+    else:
+        checkPointId_sql, isRack_sql, success_sql = "ph.[CheckPointId]", "", ""
     query = f"""
         SELECT 'NJ' AS Site
             ,CASE WHEN ph.[Location] LIKE '%350%'
@@ -141,21 +444,15 @@ async def select_ph_rawData(async_pool, date_threshold):
           ,ph.[SerialNumber]
           ,ph.[StockCode]
           ,ph.[StringField1]
-          ,ph.[CheckPointId]
+          ,{checkPointId_sql} AS CheckPointId
           ,ph.[CheckPointName]
           ,ph.[TransactionDate]
           ,ph.[Success]
           ,ph.[Message]
-          ,ph.[TransID]
-          ,agi_SS.[SKU]
-          ,sap_mfgPO.[OrderTypeCode] AS OrderType
+          ,ph.[TransID]{isRack_sql}
       FROM [ASBuiltDW].[dbo].[producthistory] AS ph
-      INNER JOIN [ASBuiltDW].[dbo].[tbl_ref_agile_SSCode] AS agi_SS
-            ON ph.StockCode = agi_SS.ITEM_NUMBER
-      LEFT JOIN [ASBuiltDW].[dbo].[tbl_Manufacturing_ProductionOrdersSAP_Current] AS sap_mfgPO
-            ON SUBSTRING(ph.[SerialNumber], 1, 8) = sap_mfgPO.[JobOrder]
-      WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > '{date_threshold}'
-      AND ph.TransactionDate <= CONCAT(CAST(GETDATE() AS DATE), ' 9:00')
+      WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > {{lower_bound}}
+      AND ph.TransactionDate <= {{upper_bound}}
       AND LEN(ph.SerialNumber) = 12
       AND (ph.[StockCode] LIKE 'RE-%' OR ph.[StockCode] LIKE 'SR-%' OR ph.[StockCode] LIKE 'JB-%'
             OR ph.[StockCode] LIKE 'FR-%')
@@ -167,27 +464,48 @@ async def select_ph_rawData(async_pool, date_threshold):
                            247, 228, 229,
                            270, 237, 230, 231,
                            300, 301,
-                           151, 234, 302);
+                           151, 234, 302){success_sql};
     """
     print("SELECT process for Server raw data from [ASBuiltDW].[dbo].[producthistory] running in the background...\n")
-    try:
-        time_tracker = dt.now()
+    async def select_range(range_num, lower_bound, upper_bound):
         async with async_pool.acquire() as db_conn:
             async with db_conn.cursor() as cursor:
-                await cursor.execute(query)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                ph_rawData_df = pd.DataFrame.from_records(rows, columns=cols)
+                query_metrics = await async_execute_metered(
+                    cursor, 'ph_rawData', query.format(lower_bound=lower_bound, upper_bound=upper_bound),
+                    chunk=range_num)
+                return await fetch_dataframe(cursor, batch_function=partial(
+                    assure_batch_types, strip_columns=('SerialNumber', 'StringField1'),
+                    datetime_columns=('TransactionDate',)), query_metrics=query_metrics)
+
+    try:
+        time_tracker = dt.now()
+        cache_name = raw_cache_name('ph_rawData')
+        cache_lowerBound = raw_cache_lowerBound(cache_name, date_threshold)
+        range_dfs = await asyncio.gather(*[select_range(range_num, lower_bound, upper_bound)
+                                           for range_num, (lower_bound, upper_bound)
+                                           in enumerate(transactionDate_ranges(cache_lowerBound, partitions_count),
+                                                        start=1)])
+        ph_rawData_df = concat_compact(range_dfs, ignore_index=True)
+        del range_dfs
+        ph_rawData_df = await asyncio.to_thread(merge_raw_cache, cache_name, ph_rawData_df, 'TransactionDate',
+                                                cache_lowerBound, date_threshold)
+        if serialNumbers_future is not None:
+            serialNumbers_future.set_result(ph_serialNumbers(ph_rawData_df))
+        ph_rawData_df = await join_reference_data(async_pool, ph_rawData_df)
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
         show_message(AlertType.FAILED)
+        if serialNumbers_future is not None and not serialNumbers_future.done():
+            serialNumbers_future.set_result(None)
     else:
-        # Ensure correct Serial Numbers by cleaning leading and trailing spaces
-        ph_rawData_df['SerialNumber'] = ph_rawData_df['SerialNumber'].str.strip()
-        ph_rawData_df['StringField1'] = ph_rawData_df['StringField1'].str.strip()
-        # Re-assure TransactionDate is of type datetime
-        ph_rawData_df['TransactionDate'] = pd.to_datetime(ph_rawData_df['TransactionDate'])
+        if SQL_CLASSIFICATION:  # The query remapped the hipot starts and classified the rows
+            rack_mask = isRack_mask(ph_rawData_df)
+            re_rawData_df = ph_rawData_df[rack_mask].drop(columns=['IsRack'])
+            sr_rawData_df = ph_rawData_df[~rack_mask].drop(columns=['IsRack'])
+            print(f"SELECT process for main raw data ran successfully\nT: {dt.now() - time_tracker}\n")
+            return re_rawData_df, sr_rawData_df
+
         # Separate instances of Hipot Start for both RE and SR
         re_hipotStart_df = (ph_rawData_df[(ph_rawData_df['CheckPointId'] == 247) & (ph_rawData_df['Success'] == 0) &
                                           (ph_rawData_df['Message'] == 'Test Start')])
@@ -200,10 +518,10 @@ async def select_ph_rawData(async_pool, date_threshold):
         mask = ph_rawData_df['Success'] != 0
         ph_rawData_df = ph_rawData_df[mask]
         # Combine Hipot Start with rest of data
-        ph_rawData_df = pd.concat([ph_rawData_df, re_hipotStart_df, sr_hipotStart_df], ignore_index=True)
+        ph_rawData_df = concat_compact([ph_rawData_df, re_hipotStart_df, sr_hipotStart_df], ignore_index=True)
         # Separate SR and RE data
-        re_mask = ph_rawData_df['StockCode'].str.contains(r"^RE-\d{3,5}-?\d{0,3}")
-        sr_mask = ~ph_rawData_df['StockCode'].str.contains(r"^RE-\d{3,5}-?\d{0,3}")
+        re_mask = ph_rawData_df['StockCode'].str.contains(RE_STOCKCODE_PATTERN)
+        sr_mask = ~ph_rawData_df['StockCode'].str.contains(RE_STOCKCODE_PATTERN)
         re_rawData_df = ph_rawData_df[re_mask]
         sr_rawData_df = ph_rawData_df[sr_mask]
         print(f"SELECT process for main raw data ran successfully\nT: {dt.now() - time_tracker}\n")
@@ -212,13 +530,15 @@ async def select_ph_rawData(async_pool, date_threshold):
 
 async def select_ph_rackBuildData(async_pool, date_threshold):
     """
-    SELECT function to get all the raw rack build data from product history
+    SELECT function to get all the raw rack build data from product history. Only the rows after the watermark of the
+    raw data cache, minus its lookback, are selected and merged into the cache
     :param async_pool: The asynchronous pool to access the DB
     :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
     :type date_threshold: str
     :return: A dataframe containing the raw rack build data from product history
     :rtype: pandas.Dataframe
     """
+    cache_lowerBound = raw_cache_lowerBound('ph_rackBuild', date_threshold)
     query = f"""
            SELECT 'NJ' AS Site
                ,CASE WHEN ph.[Location] LIKE '%350%'
@@ -236,14 +556,8 @@ async def select_ph_rackBuildData(async_pool, date_threshold):
              ,ph.[Success]
              ,ph.[Message]
              ,ph.[TransID]
-             ,agi_SS.[SKU]
-             ,sap_mfgPO.[OrderTypeCode] AS OrderType
          FROM [ASBuiltDW].[dbo].[producthistory] AS ph
-         INNER JOIN [ASBuiltDW].[dbo].[tbl_ref_agile_SSCode] AS agi_SS
-               ON ph.StockCode = agi_SS.ITEM_NUMBER
-         LEFT JOIN [ASBuiltDW].[dbo].[tbl_Manufacturing_ProductionOrdersSAP_Current] AS sap_mfgPO
-               ON SUBSTRING(ph.[SerialNumber], 1, 8) = sap_mfgPO.[JobOrder]
-         WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > '{date_threshold}'
+         WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > '{cache_lowerBound}'
          AND ph.TransactionDate <= CONCAT(CAST(GETDATE() AS DATE), ' 9:00')
          AND LEN(ph.SerialNumber) = 12 AND ph.[Success] = 1
          AND ph.[StockCode] LIKE 'RE-%'
@@ -257,32 +571,33 @@ async def select_ph_rackBuildData(async_pool, date_threshold):
         time_tracker = dt.now()
         async with async_pool.acquire() as db_conn:
             async with db_conn.cursor() as cursor:
-                await cursor.execute(query)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                ph_rackBuild_df = pd.DataFrame.from_records(rows, columns=cols)
+                query_metrics = await async_execute_metered(cursor, 'ph_rackBuild', query)
+                ph_rackBuild_df = await fetch_dataframe(cursor, batch_function=partial(
+                    assure_batch_types, strip_columns=('RackSN',), datetime_columns=('TransactionDate',)),
+                    query_metrics=query_metrics)
+        ph_rackBuild_df = await asyncio.to_thread(merge_raw_cache, 'ph_rackBuild', ph_rackBuild_df, 'TransactionDate',
+                                                  cache_lowerBound, date_threshold)
+        ph_rackBuild_df = await join_reference_data(async_pool, ph_rackBuild_df, serial_column='RackSN')
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
         show_message(AlertType.FAILED)
     else:
-        # Ensure correct Serial Numbers by cleaning leading and trailing spaces
-        ph_rackBuild_df['RackSN'] = ph_rackBuild_df['RackSN'].str.strip()
-        # Re-assure TransactionDate is of type datetime
-        ph_rackBuild_df['TransactionDate'] = pd.to_datetime(ph_rackBuild_df['TransactionDate'])
         print(f"SELECT process for raw rack build data ran successfully\nT: {dt.now() - time_tracker}\n")
         return ph_rackBuild_df
 
 
 async def select_ph_rackEoL_data(async_pool, date_threshold):
     """
-    SELECT function to get all the raw rack end-of-line data from product history
+    SELECT function to get all the raw rack end-of-line data from product history. Only the rows after the watermark
+    of the raw data cache, minus its lookback, are selected and merged into the cache
     :param async_pool: The asynchronous pool to access the DB
     :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
     :type date_threshold: str
     :return: A dataframe containing the raw rack end-of-line data from product history
     :rtype: pandas.Dataframe
     """
+    cache_lowerBound = raw_cache_lowerBound('ph_rackEoL', date_threshold)
     query = f"""
            SELECT 'NJ' AS Site
                ,CASE WHEN ph.[Location] LIKE '%350%'
@@ -300,14 +615,8 @@ async def select_ph_rackEoL_data(async_pool, date_threshold):
              ,ph.[Success]
              ,ph.[Message]
              ,ph.[TransID]
-             ,agi_SS.[SKU]
-             ,sap_mfgPO.[OrderTypeCode] AS OrderType
          FROM [ASBuiltDW].[dbo].[producthistory] AS ph
-         INNER JOIN [ASBuiltDW].[dbo].[tbl_ref_agile_SSCode] AS agi_SS
-               ON ph.StockCode = agi_SS.ITEM_NUMBER
-         LEFT JOIN [ASBuiltDW].[dbo].[tbl_Manufacturing_ProductionOrdersSAP_Current] AS sap_mfgPO
-               ON SUBSTRING(ph.[SerialNumber], 1, 8) = sap_mfgPO.[JobOrder]
-         WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > '{date_threshold}'
+         WHERE ph.[Site] = 'NJ' AND ph.TransactionDate > '{cache_lowerBound}'
          AND ph.TransactionDate <= CONCAT(CAST(GETDATE() AS DATE), ' 9:00')
          AND LEN(ph.SerialNumber) = 12 AND ph.[Success] = 1
          AND ph.[StockCode] LIKE 'RE-%'
@@ -319,36 +628,122 @@ async def select_ph_rackEoL_data(async_pool, date_threshold):
         time_tracker = dt.now()
         async with async_pool.acquire() as db_conn:
             async with db_conn.cursor() as cursor:
-                await cursor.execute(query)
-                rows = await cursor.fetchall()
-                cols = [column[0] for column in cursor.description]
-                ph_rackEoL_df = pd.DataFrame.from_records(rows, columns=cols)
+                query_metrics = await async_execute_metered(cursor, 'ph_rackEoL', query)
+                ph_rackEoL_df = await fetch_dataframe(cursor, batch_function=partial(
+                    assure_batch_types, strip_columns=('RackSN',), datetime_columns=('TransactionDate',)),
+                    query_metrics=query_metrics)
+        ph_rackEoL_df = await asyncio.to_thread(merge_raw_cache, 'ph_rackEoL', ph_rackEoL_df, 'TransactionDate',
+                                                cache_lowerBound, date_threshold)
+        ph_rackEoL_df = await join_reference_data(async_pool, ph_rackEoL_df, serial_column='RackSN')
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
         show_message(AlertType.FAILED)
     else:
-        # Ensure correct Serial Numbers by cleaning leading and trailing spaces
-        ph_rackEoL_df['RackSN'] = ph_rackEoL_df['RackSN'].str.strip()
-        # Re-assure TransactionDate is of type datetime
-        ph_rackEoL_df['TransactionDate'] = pd.to_datetime(ph_rackEoL_df['TransactionDate'])
         print(f"SELECT process for raw rack End-of-Line data ran successfully\nT: {dt.now() - time_tracker}\n")
         return ph_rackEoL_df
 
 
-async def select_sap_historicalStatus(async_pool, date_threshold):
+def ph_serialNumbers(*rawData_dfs):
+    """
+    Function returns the distinct serial numbers of product history raw data with their first transaction date
+    :param rawData_dfs: Dataframes containing product history raw data
+    :return: A dataframe containing SerialNumber and FirstTransactionDate
+    :rtype: pandas.Dataframe
+    """
+    rawData_df = pd.concat([rawData_df[['SerialNumber', 'TransactionDate']] for rawData_df in rawData_dfs],
+                           ignore_index=True)
+    return (rawData_df.groupby('SerialNumber', sort=False)['TransactionDate'].min()
+            .rename('FirstTransactionDate').reset_index())
+
+
+def compact_sap_statusChanges(sap_statusH_df):
     """
-    SELECT function to get the historical status data from SAP
+    Function compacts SAP historical status data, which is a daily snapshot of the status of every serial number, to
+    the extractions where the status of a serial number changes. The status at any time is the one of the latest
+    extraction before it in both the full and the compacted data, so the FactoryStatus of the WIP is not changed.
+    For extractions of one serial number sharing the same timestamp, only the first one is kept, as
+    model.sort_sap_historicalStatus does
+    :param sap_statusH_df: A dataframe containing SAP historical status data
+    :type sap_statusH_df: pandas.Dataframe
+    :return: The status changes of each serial number, sorted by serial number and extraction timestamp
+    :rtype: pandas.Dataframe
+    """
+    sap_statusH_df = sap_statusH_df[sap_statusH_df['EXTRACTED_DATE_TIME'].notna()]
+    sap_statusH_df = sap_statusH_df.sort_values(['SerialNumber', 'EXTRACTED_DATE_TIME'], kind='stable')
+    sap_statusH_df = sap_statusH_df.drop_duplicates(subset=['SerialNumber', 'EXTRACTED_DATE_TIME'])
+    serialNumbers = sap_statusH_df['SerialNumber']
+    statuses = sap_statusH_df['STATUS']
+    previous_statuses = statuses.shift()
+    change_mask = ((serialNumbers != serialNumbers.shift()) |
+                   ~((statuses == previous_statuses) | (statuses.isna() & previous_statuses.isna())))
+    return sap_statusH_df[change_mask].reset_index(drop=True)
+
+
+async def upload_serialNumbers(cursor, serialNumbers_df):
+    """
+    Function uploads serial numbers and their first transaction dates to the #phSNs temp table of the cursor session.
+    The rows are sent as one JSON parameter of one INSERT query, which OPENJSON turns back into rows on the server,
+    instead of one round trip per row
+    :param cursor: The cursor of the session that uses the temp table
+    :param serialNumbers_df: A dataframe containing SerialNumber and FirstTransactionDate
+    :type serialNumbers_df: pandas.Dataframe
+    :return: None
+    """
+    # The serial numbers are compared with the collation of the database, as they are in producthistory
+    await async_execute_metered(cursor, 'phSNs_create', """
+        DROP TABLE IF EXISTS #phSNs;
+        CREATE TABLE #phSNs([SerialNumber] [varchar](20) COLLATE DATABASE_DEFAULT NOT NULL PRIMARY KEY,
+                            [FirstTransactionDate] [datetime2](3) NOT NULL);
+    """)
+    # Datetimes in SQL format, truncated to milliseconds, the precision of the FirstTransactionDate column
+    serialNumbers_json = pd.DataFrame({
+        's': serialNumbers_df['SerialNumber'].astype(object),
+        'd': serialNumbers_df['FirstTransactionDate'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:23]
+    }).to_json(orient='records')
+    await async_execute_metered(cursor, 'phSNs_insert', """
+        INSERT INTO #phSNs([SerialNumber], [FirstTransactionDate])
+        SELECT [SerialNumber], [FirstTransactionDate]
+        FROM OPENJSON(?) WITH ([SerialNumber] varchar(20) '$.s', [FirstTransactionDate] datetime2(3) '$.d');
+    """, serialNumbers_json)
+
+
+async def select_sap_historicalStatus(async_pool, date_threshold, serialNumbers_df=None):
+    """
+    SELECT function to get the historical status data from SAP. Only the rows after the watermark of the raw data
+    cache, minus its lookback, are selected and merged into the cache, together with the whole history of the serial
+    numbers that are new in product history since then.
+    The serial numbers are either selected from product history in the query, or uploaded from serialNumbers_df to a
+    temp table that the query joins
     :param async_pool: The asynchronous pool to access the DB
     :param date_threshold: the datetime in SQL format used as the lower limit of data extraction
     :type date_threshold: str
+    :param serialNumbers_df: The serial numbers of the extracted product history raw data with their first transaction
+    date, as returned by ph_serialNumbers. None to select them from product history
+    :type serialNumbers_df: pandas.Dataframe
     :return: Two dataframes, one for SR and the other for RE,
     containing historical SAP status data: SN, STATUS, Extraction Timestamp
     :rtype: tuple
     """
+    cache_name = raw_cache_name('sap_historicalStatus')
+    cache_lowerBound = raw_cache_lowerBound(cache_name, date_threshold)
+    isRack_sql = (f"\n        ,CASE WHEN {RE_STOCKCODE_SQL.format('[MATNR]')} THEN 1 ELSE 0 END AS IsRack"
+                  if SQL_CLASSIFICATION else "")
+    query_uploadedSNs = f"""
+        SELECT sap.[SERIAL_NO] AS SerialNumber
+        ,sap.[MATNR] AS StockCode
+        ,sap.[STATUS]
+        ,sap.[EXTRACTED_DATE_TIME]{isRack_sql}
+        FROM [sapdb].[sap].[ZTPTP_SNSTATUS_SerialStatus_History] AS sap
+        INNER JOIN #phSNs AS phSNs
+            ON sap.[SERIAL_NO] = phSNs.[SerialNumber]
+        WHERE sap.[EXTRACTED_DATE_TIME] > '{date_threshold}'
+        AND sap.[BUKRS] = 'US01'
+        AND (sap.[EXTRACTED_DATE_TIME] > '{cache_lowerBound}' OR phSNs.[FirstTransactionDate] > '{cache_lowerBound}');
+    """
     query = f"""
         WITH phSNs_CTE AS (
-            SELECT DISTINCT [SerialNumber]
+            SELECT [SerialNumber], MIN([TransactionDate]) AS FirstTransactionDate
             FROM [ASBuiltDW].[dbo].[producthistory]
             WHERE [Site] = 'NJ' AND [TransactionDate] > '{date_threshold}'
               AND [TransactionDate] <= CONCAT(CAST(GETDATE() AS DATE), ' 9:00')
@@ -364,44 +759,60 @@ async def select_sap_historicalStatus(async_pool, date_threshold):
                                    270, 237, 230, 231,
                                    300, 301,
                                    151, 234, 302)
+            GROUP BY [SerialNumber]
         )
         SELECT [SERIAL_NO] AS SerialNumber
         ,[MATNR] AS StockCode
         ,[STATUS]
-        ,[EXTRACTED_DATE_TIME]
+        ,[EXTRACTED_DATE_TIME]{isRack_sql}
         FROM [sapdb].[sap].[ZTPTP_SNSTATUS_SerialStatus_History]
         WHERE [EXTRACTED_DATE_TIME] > '{date_threshold}'
-        AND [BUKRS] = 'US01' AND [SERIAL_NO] IN (SELECT * FROM phSNs_CTE);
+        AND [BUKRS] = 'US01' AND [SERIAL_NO] IN (SELECT [SerialNumber] FROM phSNs_CTE)
+        AND ([EXTRACTED_DATE_TIME] > '{cache_lowerBound}'
+             OR [SERIAL_NO] IN (SELECT [SerialNumber] FROM phSNs_CTE
+                                WHERE [FirstTransactionDate] > '{cache_lowerBound}'));
     """
     print("SELECT process for SAP Historical Status data is running on the background...\n")
     try:
         time_tracker = dt.now()
         async with async_pool.acquire() as db_conn:
             async with db_conn.cursor() as cursor:
-                await cursor.execute(query)
-                rows = await cursor.fetchall()
-                print(f"SAP Historical Status query execution is done. T: {dt.now() - time_tracker}")
-                time_tracker = dt.now()
-                cols = [column[0] for column in cursor.description]
-                sap_historySatuts_df = pd.DataFrame.from_records(rows, columns=cols)
-                print(f"SAP Historical Status dataframe is built. T: {dt.now() - time_tracker}")
+                if serialNumbers_df is None:
+                    query_metrics = await async_execute_metered(cursor, 'sap_historicalStatus', query)
+                else:
+                    await upload_serialNumbers(cursor, serialNumbers_df)
+                    print(f"{serialNumbers_df.shape[0]:,} serial numbers uploaded for the SAP Historical Status data. "
+                          f"T: {dt.now() - time_tracker}")
+                    query_metrics = await async_execute_metered(cursor, 'sap_historicalStatus_uploadedSNs',
+                                                                query_uploadedSNs)
+                sap_historySatuts_df = await fetch_dataframe(cursor, batch_function=partial(
+                    assure_batch_types, strip_columns=('SerialNumber',), datetime_columns=('EXTRACTED_DATE_TIME',)),
+                    query_metrics=query_metrics)
+                if serialNumbers_df is not None:  # The connection goes back to the pool
+                    await async_execute_metered(cursor, 'phSNs_drop', "DROP TABLE #phSNs;")
+                print(f"SAP Historical Status dataframe is built in batches of {FETCH_BATCH_SIZE:,} rows. "
+                      f"T: {dt.now() - time_tracker}")
                 time_tracker = dt.now()
+        sap_historySatuts_df = await asyncio.to_thread(merge_raw_cache, cache_name, sap_historySatuts_df,
+                                                       'EXTRACTED_DATE_TIME', cache_lowerBound, date_threshold)
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
         show_message(AlertType.FAILED)
     else:
-        # Ensure correct Serial Numbers by cleaning leading and trailing spaces
-        sap_historySatuts_df['SerialNumber'] = sap_historySatuts_df['SerialNumber'].str.strip()
-        # Ensure Extraction date is of type datetime
-        sap_historySatuts_df['EXTRACTED_DATE_TIME'] = pd.to_datetime(sap_historySatuts_df['EXTRACTED_DATE_TIME'])
-        print(f"SAP Historical Status dataframe data assurance is done. T: {dt.now() - time_tracker}")
-        time_tracker = dt.now()
         # Separate SR and RE data
-        re_mask = sap_historySatuts_df['StockCode'].str.contains(r"^RE-\d{3,5}-?\d{0,3}")
-        sr_mask = ~sap_historySatuts_df['StockCode'].str.contains(r"^RE-\d{3,5}-?\d{0,3}")
-        re_sap_statusH_df = sap_historySatuts_df[re_mask]
-        sr_sap_statusH_df = sap_historySatuts_df[sr_mask]
+        if SQL_CLASSIFICATION:  # The query classified the rows
+            re_mask = isRack_mask(sap_historySatuts_df)
+            sr_mask = ~re_mask
+            sap_historySatuts_df = sap_historySatuts_df.drop(columns=['IsRack'])
+        else:
+            re_mask = sap_historySatuts_df['StockCode'].str.contains(RE_STOCKCODE_PATTERN)
+            sr_mask = ~sap_historySatuts_df['StockCode'].str.contains(RE_STOCKCODE_PATTERN)
+        # Keep only the status changes of each serial number
+        re_sap_statusH_df = compact_sap_statusChanges(sap_historySatuts_df[re_mask])
+        sr_sap_statusH_df = compact_sap_statusChanges(sap_historySatuts_df[sr_mask])
+        print(f"SAP Historical Status compacted from {sap_historySatuts_df.shape[0]:,} extractions to "
+              f"{re_sap_statusH_df.shape[0] + sr_sap_statusH_df.shape[0]:,} status changes")
         # Drop StockCode column
         re_sap_statusH_df.drop(columns=['StockCode'])
         sr_sap_statusH_df.drop(columns=['StockCode'])
@@ -455,8 +866,18 @@ def select_wip_maxStatus(db_conn, isForUpdate=True):
         time_tracker = dt.now()
         print(f"SELECT process for WIP data of distinct units {'that have not shipped ' if isForUpdate else ''}"
               f"is running in the background...\n")
-        wip_shipmentStatus_df = pd.read_sql_query(query, db_conn, parse_dates=['TransactionDate', 'WIP_SnapshotDate',
-                                                                               'ExtractionDate'])
+        with db_conn.cursor() as cursor:
+            query_metrics = execute_metered(cursor, f"wip_maxStatus{'_forUpdate' if isForUpdate else ''}", query)
+            rows = fetchall_metered(cursor, query_metrics)
+            build_start = perf_counter()
+            cols = [column[0] for column in cursor.description]
+            wip_shipmentStatus_df = pd.DataFrame.from_records(rows, columns=cols, coerce_float=True)
+            del rows
+            for column in ('TransactionDate', 'WIP_SnapshotDate', 'ExtractionDate'):
+                if column in wip_shipmentStatus_df.columns:
+                    wip_shipmentStatus_df[column] = pd.to_datetime(wip_shipmentStatus_df[column])
+            query_metrics.built(build_start)
+            query_metrics.save()
     except Exception as e:
         print(repr(e))
         LOGGER.error(SQL_Q_ERROR, exc_info=True)
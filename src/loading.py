@@ -1,13 +1,12 @@
 # INSERT SQL queries or Dataframe to CSV
-from tqdm import tqdm
 from alerts import *
 from datetime import datetime as dt
 import logging
-import multiprocessing
 import pandas as pd
 import time as ti
-from utilities import show_message, items_to_SQL_values
+from utilities import show_message
 from db_conn import make_connection
+from metrics import execute_metered, executemany_metered
 
 
 SUCCESS_OP = "The INSERT operation completed successfully"
@@ -19,86 +18,8 @@ LOGGER.setLevel(logging.ERROR)
 SERVER_NAME_sbi = 'WQMSDEV01'
 DATABASE_NAME_sbi = 'SBILearning'
 
-
-def load_wip_data(wip_df, semaphore, to_csv=False, isServer=True):
-    """
-    Function to load new cleaned data to SQL table either indirectly, via CSV, or directly, via INSERT query.
-    For SQL INSERT: The data is first inserted to temporary tables carrying in their names the process number, hence
-    allowing pseudo-parallel insertion.
-    Then, all the data from the temp table is bulk inserted into the main SQL WIP table.
-    :param wip_df: A dataframe containing the cleaned WIP records
-    :type wip_df: pandas.Dataframe
-    :param semaphore: A semaphore for the process that will be used to upload the data to SQL
-    :type semaphore: multiprocessing.Semaphore
-    :param to_csv: A flag to indicate whether to load the data to a CSV file or not
-    :param isServer: A flag to indicate whether the data in cleaned_wip_df is server data or not
-    :return: None
-    """
-    # Process number
-    if multiprocessing.current_process().name == "SR_Pro_1":
-        pro_num = 1
-    elif multiprocessing.current_process().name == "SR_Pro_2":
-        pro_num = 2
-    elif multiprocessing.current_process().name == "SR_Pro_3":
-        pro_num = 3
-    elif multiprocessing.current_process().name == "SR_Pro_4":
-        pro_num = 4
-    else:  # RE Process
-        pro_num = 5
-
-    if to_csv:  # Save a CSV file of the cleaned data
-        wip_df[['DwellTime_calendar', 'DwellTime_working']] = wip_df[
-            ['DwellTime_calendar', 'DwellTime_working']].applymap(lambda x: format(x, '.7f'))
-        print(f"Creating ({pro_num}) {'SR' if isServer else 'RE'} WIP .csv file in the background...")
-        wip_df.to_csv(f"CleanedRecords_csv/wip_{'sr' if isServer else 're'}_records_{pro_num}.csv", index=False)
-        print(f"CSV file for ({pro_num}) {'SR' if isServer else 'RE'} WIP created successfully\n")
-    else:
-        print(f"({pro_num}) {'SR' if isServer else 'RE'} INSERT Process:\n")
-
-        wip_df[['DwellTime_calendar', 'DwellTime_working']] = wip_df[
-            ['DwellTime_calendar', 'DwellTime_working']].applymap(lambda x: format(x, '.7f'))
-        wip_df[['PackedIsLast_flag', 'PackedPreviously_flag']] = \
-            wip_df[['PackedIsLast_flag', 'PackedPreviously_flag']].astype(int)
-        wip_df = wip_df.fillna('NULL')
-        # Convert dataframe to tuples
-        cleaned_wip_list = [tuple(row) for _, row in wip_df.iterrows()]
-
-        if len(cleaned_wip_list) > 0:
-            wip_values_chunked = []
-            wip_values_listItem = []
-            wip_remaining = []
-            wip_values_remaining = []
-            wip_values = []
-
-            # Divide the list of tuples into chunks
-            if len(cleaned_wip_list) > CHUNK_SIZE:
-                num_chunks = len(cleaned_wip_list) // CHUNK_SIZE
-                wip_chunks = [cleaned_wip_list[i * CHUNK_SIZE: ((i + 1) * CHUNK_SIZE)] for i in range(num_chunks)]
-                wip_remaining = cleaned_wip_list[num_chunks * CHUNK_SIZE:]
-
-                # Unify the tuples in the lists into single lists of just values
-                for list_object in tqdm(wip_chunks, total=len(wip_chunks),
-                                        desc=f"Parsing through ({pro_num}){'SR' if isServer else 'RE'} "
-                                             f"WIP values (big chunk)"):
-                    for item in list_object:
-                        wip_values_listItem.extend(item)
-                    wip_values_chunked.append(wip_values_listItem.copy())
-                    wip_values_listItem.clear()
-                for item in tqdm(wip_remaining, total=len(wip_remaining),
-                                 desc=f"Parsing through ({pro_num}){'SR' if isServer else 'RE'} "
-                                      f"WIP values (small chunk)"):
-                    wip_values_remaining.extend(item)
-
-                big_load = True
-            else:  # Chunk size smaller than 1,000
-                for item in tqdm(cleaned_wip_list, total=len(cleaned_wip_list),
-                                 desc=f"Parsing through ({pro_num}){'SR' if isServer else 'RE'} "
-                                      f"WIP values (small chunk)"):
-                    wip_values.extend(item)
-                big_load = False
-
-            create_query_temp = f"""
-                    CREATE TABLE [SBILearning].[dbo].temp_tbl_Production_WIP_history_{pro_num}(
+# Column definitions of the WIP table and of the WIP intervals table
+WIP_TABLE_COLUMNS = """
                     [Site] [char](2) NOT NULL,
                     [Building] [varchar](7) NOT NULL,
                     [SerialNumber] [char](12) NOT NULL,
@@ -118,22 +39,110 @@ def load_wip_data(wip_df, semaphore, to_csv=False, isServer=True):
                     [Customer] [varchar](5) NULL,
                     [PackedIsLast_flag] [bit] NOT NULL,
                     [PackedPreviously_flag] [bit] NOT NULL,
-                    [ExtractionDate] [datetime] NOT NULL);
+                    [ExtractionDate] [datetime] NOT NULL
+"""
+WIP_INTERVAL_TABLE_COLUMNS = """
+                    [Site] [char](2) NOT NULL,
+                    [Building] [varchar](7) NOT NULL,
+                    [SerialNumber] [char](12) NOT NULL,
+                    [StockCode] [varchar](16) NOT NULL,
+                    [SKU] [varchar](100) NOT NULL,
+                    [CheckpointID] [int] NOT NULL,
+                    [CheckpointName] [varchar](50) NOT NULL,
+                    [ProcessArea] [varchar](20) NOT NULL,
+                    [TransactionID] [bigint] NOT NULL,
+                    [TransactionDate] [datetime] NOT NULL,
+                    [WIP_SnapshotStart] [datetime] NOT NULL,
+                    [WIP_SnapshotEnd] [datetime] NOT NULL,
+                    [OrderType] [varchar](20) NULL,
+                    [FactoryStatus] [varchar](20) NULL,
+                    [ProductType] [varchar](8) NOT NULL,
+                    [Customer] [varchar](5) NULL,
+                    [PackedIsLast_flag] [bit] NOT NULL,
+                    [PackedPreviously_flag] [bit] NOT NULL,
+                    [ExtractionDate] [datetime] NOT NULL
+"""
+
+
+def wip_rows(wip_df):
+    """
+    Function converts cleaned WIP records into the rows of the INSERT query, one tuple of typed values per record.
+    Datetimes are truncated to milliseconds, as the SQL datetime type keeps them, and missing values become None,
+    so the driver sends them as NULL
+    :param wip_df: A dataframe containing the cleaned WIP records
+    :type wip_df: pandas.Dataframe
+    :return: The rows of values
+    :rtype: list
+    """
+    columns_values = []
+    for column in wip_df.columns:
+        values = wip_df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):  # numpy turns NaT into None
+            columns_values.append(values.to_numpy(dtype='datetime64[ms]').astype(object).tolist())
+        else:  # Plain Python values: floats, ints, bools and the strings of the categories
+            columns_values.append(values.astype(object).where(values.notna(), None).tolist())
+    return list(zip(*columns_values))
+
+
+def load_wip_data(wip_df, semaphore, chunk_num, to_csv=False, isServer=True, asIntervals=False):
+    """
+    Function to load new cleaned data to SQL table either indirectly, via CSV, or directly, via INSERT query.
+    For SQL INSERT: The rows are sent as the typed parameters of an INSERT query, in batches of CHUNK_SIZE rows.
+    The data is first inserted to temporary tables carrying in their names the chunk number, hence allowing
+    pseudo-parallel insertion.
+    Then, all the data from the temp table is bulk inserted into the main SQL WIP table.
+    :param wip_df: A dataframe containing the cleaned WIP records
+    :type wip_df: pandas.Dataframe
+    :param semaphore: A semaphore for the process that will be used to upload the data to SQL
+    :type semaphore: multiprocessing.Semaphore
+    :param chunk_num: The number of the raw data chunk that wip_df was cleaned from
+    :type chunk_num: int
+    :param to_csv: A flag to indicate whether to load the data to a CSV file or not
+    :param isServer: A flag to indicate whether the data in cleaned_wip_df is server data or not
+    :param asIntervals: A flag to indicate whether wip_df contains WIP intervals, which are loaded to the WIP intervals
+    table, instead of daily WIP rows
+    :return: True if the data was loaded, None if the INSERT failed
+    """
+    # Target table
+    table_name = 'Production_WIP_intervals' if asIntervals else 'Production_WIP_history'
+    table_columns = WIP_INTERVAL_TABLE_COLUMNS if asIntervals else WIP_TABLE_COLUMNS
+
+    if to_csv:  # Save a CSV file of the cleaned data
+        # Datetimes in SQL format, as datetime_from_py_to_sql writes them
+        datetime_columns = wip_df.select_dtypes('datetime').columns
+        wip_df[datetime_columns] = wip_df[datetime_columns].apply(
+            lambda values: values.dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:23])
+        print(f"Creating ({chunk_num}) {'SR' if isServer else 'RE'} WIP .csv file in the background...")
+        wip_df.to_csv(f"CleanedRecords_csv/wip_{'sr' if isServer else 're'}_"
+                      f"{'intervals' if asIntervals else 'records'}_{chunk_num}.csv", index=False, float_format='%.7f')
+        print(f"CSV file for ({chunk_num}) {'SR' if isServer else 'RE'} WIP created successfully\n")
+        return True
+    else:
+        print(f"({chunk_num}) {'SR' if isServer else 'RE'} INSERT Process:\n")
+
+        cleaned_wip_list = wip_rows(wip_df)
+
+        if len(cleaned_wip_list) > 0:
+            # Divide the list of tuples into batches of rows
+            wip_batches = [cleaned_wip_list[i: i + CHUNK_SIZE] for i in range(0, len(cleaned_wip_list), CHUNK_SIZE)]
+            big_load = len(wip_batches) > 1
+            row_parameters = ', '.join(['?'] * wip_df.shape[1])
+
+            create_query_temp = f"""
+                    CREATE TABLE [SBILearning].[dbo].temp_tbl_{table_name}_{chunk_num}({table_columns});
             """
-            insert_query_temp = """
-                    INSERT INTO [SBILearning].[dbo].temp_tbl_Production_WIP_history_{0}
-                    VALUES
-                    {1};
+            insert_query_temp = f"""
+                    INSERT INTO [SBILearning].[dbo].temp_tbl_{table_name}_{chunk_num}
+                    VALUES ({row_parameters});
             """
-            drop_query_temp = f"DROP TABLE [SBILearning].[dbo].temp_tbl_Production_WIP_history_{pro_num};"
+            drop_query_temp = f"DROP TABLE [SBILearning].[dbo].temp_tbl_{table_name}_{chunk_num};"
             insert_query_main = f"""
-                    INSERT INTO [SBILearning].[dbo].[DNun_tbl_Production_WIP_history]
-                    SELECT * FROM [SBILearning].[dbo].temp_tbl_Production_WIP_history_{pro_num};
+                    INSERT INTO [SBILearning].[dbo].[DNun_tbl_{table_name}]
+                    SELECT * FROM [SBILearning].[dbo].temp_tbl_{table_name}_{chunk_num};
             """
-            insertQuery_main_small = """
-                                INSERT INTO [SBILearning].[dbo].[DNun_tbl_Production_WIP_history]
-                                VALUES
-                                {};
+            insertQuery_main_small = f"""
+                                INSERT INTO [SBILearning].[dbo].[DNun_tbl_{table_name}]
+                                VALUES ({row_parameters});
                         """
             # INSERT new records into DB
             try:
@@ -141,122 +150,95 @@ def load_wip_data(wip_df, semaphore, to_csv=False, isServer=True):
                 # Establish DB Connections
                 db_conn = make_connection(SERVER_NAME_sbi, DATABASE_NAME_sbi)
                 with db_conn.cursor() as cursor:
+                    cursor.fast_executemany = True  # Send each batch of parameters in one round trip
                     if big_load:
-                        upload_size = len(wip_values_chunked)
+                        upload_size = len(wip_batches)
 
                         # SQL UPLOAD
                         # Flags for upload process progress
                         nickel = dime = dime_2 = quarter = dime_3 = dime_4 = half = dime_6 = quarter_3 = \
                             dime_8 = ninety = ninety_5 = True
-                        progress_prompt = f"\n({pro_num}) {'SR' if isServer else 'RE'} WIP INSERT operation at "
+                        progress_prompt = f"\n({chunk_num}) {'SR' if isServer else 'RE'} WIP INSERT operation at "
 
-                        print(f"\n({pro_num}) {'SR' if isServer else 'RE'} WIP INSERT operation is "
+                        print(f"\n({chunk_num}) {'SR' if isServer else 'RE'} WIP INSERT operation is "
                               f"running on the background. Progress will show intermittently\n")
                         # Create temp table
-                        cursor.execute(create_query_temp)
-
-                        if pro_num == 2:  # SQL upload for SR data - Process 2
-                            for index, wip_item in enumerate(tqdm(wip_values_chunked, total=upload_size,
-                                                                  desc=f"INSERTING new ({pro_num}) "
-                                                                       f"{'SR' if isServer else 'RE'} "
-                                                                       f"WIP records in chunks")):
-                                cursor.execute(insert_query_temp.format(pro_num,
-                                                                        items_to_SQL_values(wip_item,
-                                                                                            isForUpdate=False)))
-                                # Bulk INSERT
-                                if (index + 1) == upload_size:
-                                    print(f"\n({pro_num}) {'SR' if isServer else 'RE'} - SEMAPHORE WARNING: YELLOW")
-                                    ti.sleep(7.3)
-                                    with semaphore:
-                                        print(f"\n({pro_num}) {'SR' if isServer else 'RE'} "
-                                              f"BULK INSERT - SEMAPHORE WARNING: RED {dt.now()}")
-                                        cursor.execute(insert_query_main)
-                                        print(f"\nSEMAPHORE GREEN for Process #{pro_num}")
-                                    cursor.execute(drop_query_temp)  # End of BULK INSERT
-                                    print(f"\n({pro_num}) DROPPED temp {'SR' if isServer else 'RE'} WIP table")
-
-                        else:  # SQL upload for RE data and SR data - Processes 1, 3, 4
-                            for index, wip_item in enumerate(wip_values_chunked):
-                                cursor.execute(insert_query_temp.format(pro_num,
-                                                                        items_to_SQL_values(wip_item,
-                                                                                            isForUpdate=False)))
-                                # Bulk INSERT
-                                if (index + 1) == upload_size:
-                                    print(f"\n({pro_num}) {'SR' if isServer else 'RE'} - SEMAPHORE WARNING: YELLOW")
-                                    ti.sleep(7.3)
-                                    with semaphore:
-                                        print(f"\n({pro_num}) {'SR' if isServer else 'RE'} "
-                                              f"BULK INSERT - SEMAPHORE WARNING: RED {dt.now()}")
-                                        cursor.execute(insert_query_main)
-                                        print(f"\nSEMAPHORE GREEN for Process #{pro_num}")
-                                    cursor.execute(drop_query_temp)  # End of BULK INSERT
-                                    print(f"\n({pro_num}) DROPPED temp {'SR' if isServer else 'RE'} WIP table")
-
-                                # Progress feedback
-                                current_progress = (index + 1) / upload_size
-                                if ninety_5 and current_progress >= 0.95:
-                                    print(f"{progress_prompt}95% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    ninety_5 = False
-                                elif ninety and current_progress >= 0.9:
-                                    print(f"{progress_prompt}90% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    ninety = False
-                                elif dime_8 and current_progress >= 0.8:
-                                    print(f"{progress_prompt}80% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime_8 = False
-                                elif quarter_3 and current_progress >= 0.75:
-                                    print(f"{progress_prompt}75% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    quarter_3 = False
-                                elif dime_6 and current_progress >= 0.6:
-                                    print(f"{progress_prompt}60% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime_6 = False
-                                elif half and current_progress >= 0.5:
-                                    print(f"{progress_prompt}50% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    half = False
-                                elif dime_4 and current_progress >= 0.4:
-                                    print(f"{progress_prompt}40% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime_4 = False
-                                elif dime_3 and current_progress >= 0.3:
-                                    print(f"{progress_prompt}30% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime_3 = False
-                                elif quarter and current_progress >= 0.25:
-                                    print(f"{progress_prompt}25% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    quarter = False
-                                elif dime_2 and current_progress >= 0.2:
-                                    print(f"{progress_prompt}20% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime_2 = False
-                                elif dime and current_progress >= 0.1:
-                                    print(f"{progress_prompt}10% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    dime = False
-                                elif nickel and current_progress >= 0.05:
-                                    print(f"{progress_prompt}5% ({upload_size} items) T: {dt.now() - insert_start}")
-                                    nickel = False
-                            print(f"{progress_prompt}100%. Duration: {dt.now() - insert_start}\n")
-
-                        # Insert remaining values
-                        if len(wip_remaining) > 0:
-                            print(f"\nInserting an additional small size ({len(wip_remaining)} rows) "
-                                  f"of ({pro_num}) {'SR' if isServer else 'RE'} WIP records in the background..."
-                                  f"\nWARNING: This zone is locked")
-                            with semaphore:
-                                cursor.execute(insertQuery_main_small.format(items_to_SQL_values(
-                                    wip_values_remaining, isForUpdate=False, chunk_size=len(wip_remaining))))
-                    else:  # Insert small chunk (less than 1,000 rows)
+                        execute_metered(cursor, 'wip_temp_create', create_query_temp, chunk=chunk_num)
+
+                        for index, wip_batch in enumerate(wip_batches):
+                            executemany_metered(cursor, 'wip_temp_insert', insert_query_temp, wip_batch,
+                                                chunk=chunk_num)
+                            # Bulk INSERT
+                            if (index + 1) == upload_size:
+                                print(f"\n({chunk_num}) {'SR' if isServer else 'RE'} - SEMAPHORE WARNING: YELLOW")
+                                ti.sleep(7.3)
+                                with semaphore:
+                                    print(f"\n({chunk_num}) {'SR' if isServer else 'RE'} "
+                                          f"BULK INSERT - SEMAPHORE WARNING: RED {dt.now()}")
+                                    execute_metered(cursor, 'wip_bulk_insert', insert_query_main, chunk=chunk_num)
+                                    print(f"\nSEMAPHORE GREEN for chunk #{chunk_num}")
+                                # End of BULK INSERT
+                                execute_metered(cursor, 'wip_temp_drop', drop_query_temp, chunk=chunk_num)
+                                print(f"\n({chunk_num}) DROPPED temp {'SR' if isServer else 'RE'} WIP table")
+
+                            # Progress feedback
+                            current_progress = (index + 1) / upload_size
+                            if ninety_5 and current_progress >= 0.95:
+                                print(f"{progress_prompt}95% ({upload_size} items) T: {dt.now() - insert_start}")
+                                ninety_5 = False
+                            elif ninety and current_progress >= 0.9:
+                                print(f"{progress_prompt}90% ({upload_size} items) T: {dt.now() - insert_start}")
+                                ninety = False
+                            elif dime_8 and current_progress >= 0.8:
+                                print(f"{progress_prompt}80% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime_8 = False
+                            elif quarter_3 and current_progress >= 0.75:
+                                print(f"{progress_prompt}75% ({upload_size} items) T: {dt.now() - insert_start}")
+                                quarter_3 = False
+                            elif dime_6 and current_progress >= 0.6:
+                                print(f"{progress_prompt}60% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime_6 = False
+                            elif half and current_progress >= 0.5:
+                                print(f"{progress_prompt}50% ({upload_size} items) T: {dt.now() - insert_start}")
+                                half = False
+                            elif dime_4 and current_progress >= 0.4:
+                                print(f"{progress_prompt}40% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime_4 = False
+                            elif dime_3 and current_progress >= 0.3:
+                                print(f"{progress_prompt}30% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime_3 = False
+                            elif quarter and current_progress >= 0.25:
+                                print(f"{progress_prompt}25% ({upload_size} items) T: {dt.now() - insert_start}")
+                                quarter = False
+                            elif dime_2 and current_progress >= 0.2:
+                                print(f"{progress_prompt}20% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime_2 = False
+                            elif dime and current_progress >= 0.1:
+                                print(f"{progress_prompt}10% ({upload_size} items) T: {dt.now() - insert_start}")
+                                dime = False
+                            elif nickel and current_progress >= 0.05:
+                                print(f"{progress_prompt}5% ({upload_size} items) T: {dt.now() - insert_start}")
+                                nickel = False
+                        print(f"{progress_prompt}100%. Duration: {dt.now() - insert_start}\n")
+                    else:  # Insert small chunk (up to CHUNK_SIZE rows)
                         print(f"\nInserting a small size ({len(cleaned_wip_list)} rows) of "
-                              f"({pro_num}) {'SR' if isServer else 'RE'} WIP records in the background..."
+                              f"({chunk_num}) {'SR' if isServer else 'RE'} WIP records in the background..."
                               f"\nWARNING: This zone is locked")
                         with semaphore:
-                            cursor.execute(insertQuery_main_small.format(items_to_SQL_values(
-                                wip_values, isForUpdate=False, chunk_size=len(cleaned_wip_list))))
+                            executemany_metered(cursor, 'wip_small_insert', insertQuery_main_small, cleaned_wip_list,
+                                                chunk=chunk_num)
             except Exception as e:
                 print(repr(e))
                 LOGGER.error(SQL_I_ERROR, exc_info=True)
                 show_message(AlertType.FAILED)
             else:
                 db_conn.commit()
-                print(f"\n({pro_num}) {'SR' if isServer else 'RE'} INSERT Operation ran successfully.\n"
+                print(f"\n({chunk_num}) {'SR' if isServer else 'RE'} INSERT Operation ran successfully.\n"
                       f"T: {dt.now() - insert_start}\n")
                 # Close the DB connection
                 db_conn.close()
+                return True
         # If no new records in server_dw_list
         else:
             print("\nNo new records to INSERT\n")
+            return True
@@ -0,0 +1,436 @@
+# Local embedded database backend: a SQLite file that stands in for the SQL Server databases on offline runs
+from datetime import datetime as dt
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import asyncio
+import os
+import re
+import sqlite3
+
+
+LOCAL_DB_PATH = "CleanedRecords_csv/local_db/wip_local.sqlite"
+# Connections open at once in the local async pool, the same as the SQL Server async pool
+LOCAL_POOL_SIZE = 15
+# Seconds a connection waits for the write lock of another connection
+LOCAL_LOCK_TIMEOUT = 60
+# Column definitions of the source tables read by the extraction, with the columns the queries use
+SOURCE_TABLE_COLUMNS = {
+    'producthistory': """
+                    [Site] [varchar](10) NULL,
+                    [Location] [varchar](50) NULL,
+                    [SerialNumber] [varchar](20) NULL,
+                    [StockCode] [varchar](30) NULL,
+                    [StringField1] [varchar](50) NULL,
+                    [CheckPointId] [int] NULL,
+                    [CheckPointName] [varchar](50) NULL,
+                    [TransactionDate] [datetime] NULL,
+                    [Success] [bit] NULL,
+                    [Message] [varchar](255) NULL,
+                    [TransID] [bigint] NULL
+""",
+    'ZTPTP_SNSTATUS_SerialStatus_History': """
+                    [SERIAL_NO] [varchar](20) NULL,
+                    [MATNR] [varchar](30) NULL,
+                    [STATUS] [varchar](20) NULL,
+                    [EXTRACTED_DATE_TIME] [datetime] NULL,
+                    [BUKRS] [varchar](4) NULL
+""",
+    'ZTFTP_ZTPOK_ProductionScheduleHeader': """
+                    [CUSTID] [varchar](20) NULL,
+                    [MATNR] [varchar](30) NULL
+""",
+    'tbl_ref_agile_ITEM': """
+                    [STOCKCODE] [varchar](30) NULL,
+                    [MSPARTNUM] [varchar](50) NULL,
+                    [AZPARTNUM] [varchar](50) NULL
+""",
+    'tbl_ref_agile_SSCode': """
+                    [ITEM_NUMBER] [varchar](30) NULL,
+                    [SKU] [varchar](100) NULL
+""",
+    'tbl_Manufacturing_ProductionOrdersSAP_Current': """
+                    [JobOrder] [varchar](20) NULL,
+                    [OrderTypeCode] [varchar](20) NULL
+"""}
+# Rewrites of the T-SQL the queries use into SQLite, applied in order
+SQL_REWRITES = (
+    # Three-part names: the local database holds the tables of every server and database
+    (re.compile(r"\[\w+\]\.\[\w+\]\."), ""),
+    (re.compile(r"CONCAT\(CAST\(GETDATE\(\) AS DATE\), '\s*(\d+):(\d+)'\)", re.IGNORECASE),
+     lambda match: f"(strftime('%Y-%m-%d', 'now', 'localtime') || ' {int(match[1]):02d}:{match[2]}:00.000')"),
+    (re.compile(r"DATEADD\(DAY,\s*(-?\d+),\s*GETDATE\(\)\)", re.IGNORECASE),
+     r"strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', '\1 days')"),
+    (re.compile(r"GETDATE\(\)", re.IGNORECASE), "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"),
+    (re.compile(r"\s+COLLATE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"TRUNCATE\s+TABLE", re.IGNORECASE), "DELETE FROM"),
+    (re.compile(r"CREATE\s+TABLE\s+#", re.IGNORECASE), "CREATE TEMP TABLE "),
+    (re.compile(r"#(\w+)"), r"\1"),
+    # Derived tables of constants: FROM (VALUES ...) AS Items(Value)
+    (re.compile(r"FROM\s*\(\s*VALUES(.*?)\)\s*AS\s+(\w+)\((\w+)\)", re.IGNORECASE | re.DOTALL),
+     r"FROM (SELECT column1 AS \3 FROM (VALUES\1)) AS \2"),
+    # Rows of a JSON array parameter: OPENJSON(?) WITH ([col] type '$.key', ...)
+    (re.compile(r"OPENJSON\((\?)\)\s*WITH\s*\(((?:\s*\[\w+\]\s+\w+(?:\(\d+\))?\s+'[^']*'\s*,?)+)\)",
+                re.IGNORECASE),
+     lambda match: "(SELECT {} FROM json_each({}))".format(", ".join(
+         f"json_extract(value, '{path}') AS [{column}]"
+         for column, path in re.findall(r"\[(\w+)\]\s+\w+(?:\(\d+\))?\s+'([^']*)'", match[2])), match[1])),
+    # UPDATE through a joined alias: UPDATE o SET o.[col] = ... FROM table AS o JOIN cte AS u ON o.[key] = u.[value]
+    (re.compile(r"UPDATE\s+(\w+)\s+SET\s+(.*?)\s+FROM\s+(\S+)\s+AS\s+\1\s+JOIN\s+(\w+)\s+AS\s+(\w+)\s+"
+                r"ON\s+\1\.(\[\w+\])\s*=\s*\5\.(\[\w+\])", re.IGNORECASE | re.DOTALL),
+     lambda match: (f"UPDATE {match[3]} SET {match[2].replace(match[1] + '.', '')} "
+                    f"WHERE {match[6]} IN (SELECT {match[7]} FROM {match[4]})")))
+
+
+def translate_sql(query):
+    """
+    Function translates a T-SQL query of the pipeline into SQLite
+    :param query: The T-SQL query
+    :type query: str
+    :return: The SQLite query
+    :rtype: str
+    """
+    for pattern, replacement in SQL_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+@lru_cache(maxsize=256)
+def like_regex(pattern):
+    """
+    Function converts a T-SQL LIKE pattern, with its % and _ wildcards and its [] character classes, into a regex.
+    The comparison is case-insensitive, like the default collation of the SQL Server databases
+    :param pattern: The LIKE pattern
+    :type pattern: str
+    :return: The compiled regex
+    :rtype: re.Pattern
+    """
+    regex = ""
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == '%':
+            regex += ".*"
+        elif character == '_':
+            regex += "."
+        elif character == '[' and ']' in pattern[position + 1:]:
+            class_end = pattern.index(']', position + 1)
+            class_chars = pattern[position + 1:class_end]
+            negate = class_chars.startswith('^')
+            class_chars = class_chars[1:] if negate else class_chars
+            regex += ("[^" if negate else "[") + "".join(
+                char if char == '-' else re.escape(char) for char in class_chars) + "]"
+            position = class_end
+        else:
+            regex += re.escape(character)
+        position += 1
+    return re.compile(regex, re.IGNORECASE | re.DOTALL)
+
+
+def tsql_like(pattern, value):
+    """
+    Function evaluates value LIKE pattern with the T-SQL semantics. SQLite calls it for every LIKE of a local query
+    :return: 1 if value matches pattern, 0 if not, None if either is NULL
+    """
+    if pattern is None or value is None:
+        return None
+    return int(like_regex(pattern).fullmatch(str(value)) is not None)
+
+
+def tsql_len(value):
+    """
+    Function evaluates LEN(value) with the T-SQL semantics: trailing spaces are not counted
+    :return: The length, or None if value is NULL
+    """
+    return None if value is None else len(str(value).rstrip(' '))
+
+
+def sql_datetime(value):
+    """
+    Function stores datetimes as text in the format of datetime_from_py_to_sql, which sorts like the dates it holds
+    :param value: A datetime or a pandas Timestamp
+    :return: The datetime in SQL format
+    :rtype: str
+    """
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+
+
+sqlite3.register_adapter(dt, sql_datetime)
+sqlite3.register_adapter(pd.Timestamp, sql_datetime)
+for numpy_type in (np.int8, np.int16, np.int32, np.int64):
+    sqlite3.register_adapter(numpy_type, int)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_adapter(np.bool_, int)
+
+
+def connect_local_db(db_path=LOCAL_DB_PATH):
+    """
+    Function opens a connection to the local database, with the T-SQL functions its queries need
+    :param db_path: The path of the SQLite file
+    :type db_path: str
+    :return: The connection
+    :rtype: sqlite3.Connection
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=LOCAL_LOCK_TIMEOUT, check_same_thread=False)
+    connection.create_function('like', 2, tsql_like, deterministic=True)
+    connection.create_function('LEN', 1, tsql_len, deterministic=True)
+    return connection
+
+
+class LocalCursor:
+    """
+    Class represents a cursor of the local database with the interface of a pyodbc cursor: it runs T-SQL queries of
+    the pipeline, with parameters (?) given one by one or in one sequence, and several statements in one query
+    """
+
+    def __init__(self, connection):
+        """
+        Constructor for class LocalCursor
+        :param connection: The connection to the local database
+        :type connection: sqlite3.Connection
+        """
+        self.cursor = connection.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, *parameters):
+        """
+        Method executes a T-SQL query
+        :param query: The T-SQL query
+        :type query: str
+        :param parameters: The values of the parameters (?) of the query
+        :return: The cursor
+        :rtype: LocalCursor
+        """
+        if len(parameters) == 1 and isinstance(parameters[0], (list, tuple)):
+            parameters = parameters[0]
+        query = translate_sql(query)
+        try:
+            self.cursor.execute(query, parameters)
+        except sqlite3.ProgrammingError as e:
+            if parameters or 'one statement at a time' not in str(e):
+                raise
+            self.cursor.executescript(query)  # Several statements, e.g. DROP and CREATE of a temp table
+        return self
+
+    def executemany(self, query, rows):
+        """
+        Method executes a T-SQL query once per row of parameters
+        :param query: The T-SQL query
+        :type query: str
+        :param rows: The values of the parameters (?) of the query, one sequence per row
+        :type rows: list
+        :return: The cursor
+        :rtype: LocalCursor
+        """
+        self.cursor.executemany(translate_sql(query), rows)
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class LocalConnection:
+    """
+    Class represents a connection to the local database with the interface of a pyodbc connection
+    """
+
+    def __init__(self, db_path=LOCAL_DB_PATH):
+        """
+        Constructor for class LocalConnection
+        :param db_path: The path of the SQLite file
+        :type db_path: str
+        """
+        self.connection = connect_local_db(db_path)
+
+    def cursor(self):
+        return LocalCursor(self.connection)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class LocalAsyncCursor:
+    """
+    Class represents a cursor of the local database with the interface of an aioodbc cursor. Queries and fetches run
+    in a worker thread, so that concurrent queries of the pool overlap like on the SQL Server
+    """
+
+    def __init__(self, local_cursor):
+        """
+        Constructor for class LocalAsyncCursor
+        :param local_cursor: The synchronous cursor
+        :type local_cursor: LocalCursor
+        """
+        self.local_cursor = local_cursor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.local_cursor.close()
+
+    @property
+    def description(self):
+        return self.local_cursor.description
+
+    @property
+    def rowcount(self):
+        return self.local_cursor.rowcount
+
+    async def execute(self, query, *parameters):
+        await asyncio.to_thread(self.local_cursor.execute, query, *parameters)
+        return self
+
+    async def fetchone(self):
+        return await asyncio.to_thread(self.local_cursor.fetchone)
+
+    async def fetchmany(self, size):
+        return await asyncio.to_thread(self.local_cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await asyncio.to_thread(self.local_cursor.fetchall)
+
+
+class LocalAsyncConnection:
+    """
+    Class represents a connection of the local async pool, with the interface of an aioodbc connection
+    """
+
+    def __init__(self, local_connection):
+        """
+        Constructor for class LocalAsyncConnection
+        :param local_connection: The synchronous connection
+        :type local_connection: LocalConnection
+        """
+        self.local_connection = local_connection
+
+    def cursor(self):
+        return LocalAsyncCursor(self.local_connection.cursor())
+
+    async def commit(self):
+        self.local_connection.commit()
+
+
+class LocalAsyncPool:
+    """
+    Class represents an asynchronous pool of connections to the local database, with the interface of an aioodbc
+    pool. Each acquire opens its own connection, so temp tables stay private to it like on the SQL Server
+    """
+
+    def __init__(self, db_path=LOCAL_DB_PATH, maxsize=LOCAL_POOL_SIZE):
+        """
+        Constructor for class LocalAsyncPool
+        :param db_path: The path of the SQLite file
+        :type db_path: str
+        :param maxsize: The number of connections open at once
+        :type maxsize: int
+        """
+        self.db_path = db_path
+        self.semaphore = asyncio.Semaphore(maxsize)
+
+    def acquire(self):
+        return LocalPoolConnection(self)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class LocalPoolConnection:
+    """
+    Class represents the acquisition of a connection of the local async pool, as an asynchronous context manager
+    """
+
+    def __init__(self, pool):
+        """
+        Constructor for class LocalPoolConnection
+        :param pool: The pool the connection is acquired from
+        :type pool: LocalAsyncPool
+        """
+        self.pool = pool
+        self.local_connection = None
+
+    async def __aenter__(self):
+        await self.pool.semaphore.acquire()
+        self.local_connection = LocalConnection(self.pool.db_path)
+        return LocalAsyncConnection(self.local_connection)
+
+    async def __aexit__(self, *exc_info):
+        self.local_connection.close()
+        self.pool.semaphore.release()
+
+
+def seed_local_db(db_path=LOCAL_DB_PATH):
+    """
+    Function creates the tables of the local database that do not exist yet: the product history, SAP and Agile
+    source tables and the WIP tables
+    :param db_path: The path of the SQLite file
+    :type db_path: str
+    :return: None
+    """
+    # Imported here, since loading connects to the DB through db_conn, which uses this module
+    from loading import WIP_TABLE_COLUMNS, WIP_INTERVAL_TABLE_COLUMNS
+    table_columns = {**SOURCE_TABLE_COLUMNS, 'DNun_tbl_Production_WIP_history': WIP_TABLE_COLUMNS,
+                     'DNun_tbl_Production_WIP_intervals': WIP_INTERVAL_TABLE_COLUMNS}
+    connection = connect_local_db(db_path)
+    try:
+        for table_name, columns in table_columns.items():
+            connection.execute(translate_sql(f"CREATE TABLE IF NOT EXISTS [{table_name}]({columns});"))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def load_local_table(table_name, dataframe, db_path=LOCAL_DB_PATH, replace=False):
+    """
+    Function inserts the rows of a dataframe into a table of the local database, e.g. synthetic product history
+    :param table_name: The name of the table, without its database and schema
+    :type table_name: str
+    :param dataframe: The rows, with the columns of the table
+    :type dataframe: pandas.Dataframe
+    :param db_path: The path of the SQLite file
+    :type db_path: str
+    :param replace: A flag to delete the rows of the table first
+    :return: None
+    """
+    dataframe = dataframe.astype({column: object for column in dataframe.select_dtypes('category').columns})
+    columns = ", ".join(f"[{column}]" for column in dataframe.columns)
+    placeholders = ", ".join(['?'] * dataframe.shape[1])
+    connection = connect_local_db(db_path)
+    try:
+        if replace:
+            connection.execute(f"DELETE FROM [{table_name}];")
+        connection.executemany(f"INSERT INTO [{table_name}]({columns}) VALUES ({placeholders});",
+                               [tuple(None if pd.isna(value) else value for value in row)
+                                for row in dataframe.itertuples(index=False, name=None)])
+        connection.commit()
+    finally:
+        connection.close()
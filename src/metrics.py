@@ -0,0 +1,235 @@
+# Per-query metrics of the SQL queries, written to one machine-readable file per run
+from datetime import datetime as dt
+from time import perf_counter
+import pandas as pd
+import glob
+import json
+import os
+
+
+METRICS_DIRECTORY = "CleanedRecords_csv/metrics"
+# Environment variable holding the metrics file of the current run, so that the worker processes of the cleaning and
+# loading pools write to the same file as the main process
+METRICS_FILE_VARIABLE = 'WIP_METRICS_FILE'
+# Rows of each fetched batch that are measured to estimate the payload bytes of the whole batch
+PAYLOAD_SAMPLE_ROWS = 100
+
+
+def start_metrics_run():
+    """
+    Function starts the metrics file of a new run. The queries of this process and of the processes it starts are
+    recorded in it
+    :return: The path of the metrics file
+    :rtype: str
+    """
+    os.makedirs(METRICS_DIRECTORY, exist_ok=True)
+    metrics_file = f"{METRICS_DIRECTORY}/query_metrics_{dt.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    os.environ[METRICS_FILE_VARIABLE] = metrics_file
+    return metrics_file
+
+
+def metrics_path():
+    """
+    Function returns the metrics file of the current run, and starts a run if there is none
+    :return: The path of the metrics file
+    :rtype: str
+    """
+    return os.environ.get(METRICS_FILE_VARIABLE) or start_metrics_run()
+
+
+def payload_bytes(rows):
+    """
+    Function estimates the payload of DB rows or query parameters from a sample of them: strings count their length
+    and every other non-null value counts 8 bytes
+    :param rows: The rows, each one a sequence of values
+    :type rows: list
+    :return: The approximate payload in bytes
+    :rtype: int
+    """
+    sample = rows[:PAYLOAD_SAMPLE_ROWS]
+    if len(sample) < 1:
+        return 0
+    sample_bytes = sum(len(value) if isinstance(value, (str, bytes)) else 8
+                       for row in sample for value in row if value is not None)
+    return int(sample_bytes * len(rows) / len(sample))
+
+
+class QueryMetrics:
+    """
+    Timings and sizes of one SQL query. All times are in seconds from the start of the execute:
+    execute_s until the execute returns, first_row_s until the first row is fetched, fetch_s spent fetching rows and
+    build_s spent building dataframes from them
+    """
+    def __init__(self, name, query, parameters=(), chunk=None):
+        if len(parameters) == 1 and isinstance(parameters[0], (list, tuple)):  # All the values in one sequence
+            parameters = parameters[0]
+        self.record = {'query': name, 'chunk': chunk, 'pid': os.getpid(), 'started': dt.now().isoformat(),
+                       'execute_s': None, 'first_row_s': None, 'fetch_s': 0.0, 'build_s': 0.0, 'rows': 0,
+                       'sent_bytes': len(query) + payload_bytes([parameters]), 'fetched_bytes': 0}
+        self._start = perf_counter()
+
+    def executed(self, cursor, rows_count=None):
+        """
+        Method records the end of the execute. A statement without result rows is complete, so it is saved with its
+        affected rows count
+        :param cursor: The cursor that executed the query
+        :param rows_count: The affected rows count, when the cursor does not report it
+        :type rows_count: int
+        :return: None
+        """
+        self.record['execute_s'] = perf_counter() - self._start
+        if cursor.description is None:
+            self.record['rows'] = max(cursor.rowcount, 0) if rows_count is None else rows_count
+            self.save()
+
+    def fetched(self, rows, fetch_start):
+        """
+        Method records a fetch of DB rows
+        :param rows: The fetched rows
+        :type rows: list
+        :param fetch_start: The perf_counter value when the fetch started
+        :type fetch_start: float
+        :return: None
+        """
+        fetch_end = perf_counter()
+        self.record['fetch_s'] += fetch_end - fetch_start
+        if len(rows) > 0 and self.record['first_row_s'] is None:
+            self.record['first_row_s'] = fetch_end - self._start
+        self.record['rows'] += len(rows)
+        self.record['fetched_bytes'] += payload_bytes(rows)
+
+    def built(self, build_start):
+        """
+        Method records the build of a dataframe from fetched rows
+        :param build_start: The perf_counter value when the build started
+        :type build_start: float
+        :return: None
+        """
+        self.record['build_s'] += perf_counter() - build_start
+
+    def save(self):
+        """
+        Method appends the metrics of the query to the metrics file of the run, as one JSON line
+        :return: None
+        """
+        with open(metrics_path(), 'a') as metrics_file:
+            metrics_file.write(json.dumps(self.record) + '\n')
+
+
+def execute_metered(cursor, name, query, *parameters, chunk=None):
+    """
+    Function executes a query with a cursor and records its metrics
+    :param cursor: A DB cursor
+    :param name: The name of the query in the metrics file. It should be the same in every run
+    :type name: str
+    :param query: The SQL query
+    :type query: str
+    :param parameters: The values of the parameters (?) of the query
+    :param chunk: The number of the data chunk the query is run for, if any
+    :type chunk: int
+    :return: The metrics of the query, to record its fetches
+    :rtype: QueryMetrics
+    """
+    query_metrics = QueryMetrics(name, query, parameters, chunk)
+    cursor.execute(query, *parameters)
+    query_metrics.executed(cursor)
+    return query_metrics
+
+
+def executemany_metered(cursor, name, query, rows, chunk=None):
+    """
+    Function executes a query once per row of parameters with a cursor and records its metrics as one query
+    :param cursor: A DB cursor
+    :param name: The name of the query in the metrics file. It should be the same in every run
+    :type name: str
+    :param query: The SQL query
+    :type query: str
+    :param rows: The values of the parameters (?) of the query, one sequence per row
+    :type rows: list
+    :param chunk: The number of the data chunk the query is run for, if any
+    :type chunk: int
+    :return: The metrics of the query
+    :rtype: QueryMetrics
+    """
+    query_metrics = QueryMetrics(name, query, chunk=chunk)
+    query_metrics.record['sent_bytes'] += payload_bytes(rows)
+    cursor.executemany(query, rows)
+    query_metrics.executed(cursor, rows_count=len(rows))
+    return query_metrics
+
+
+async def async_execute_metered(cursor, name, query, *parameters, chunk=None):
+    """
+    Function executes a query with an asynchronous cursor and records its metrics. Same as execute_metered
+    :return: The metrics of the query, to record its fetches
+    :rtype: QueryMetrics
+    """
+    query_metrics = QueryMetrics(name, query, parameters, chunk)
+    await cursor.execute(query, *parameters)
+    query_metrics.executed(cursor)
+    return query_metrics
+
+
+def fetchone_metered(cursor, query_metrics):
+    """
+    Function fetches the first row of an executed query and saves its metrics
+    :param cursor: The cursor of an executed SELECT query
+    :param query_metrics: The metrics of the query, as returned by execute_metered
+    :type query_metrics: QueryMetrics
+    :return: The row, or None if the query returned no rows
+    """
+    fetch_start = perf_counter()
+    row = cursor.fetchone()
+    query_metrics.fetched([] if row is None else [row], fetch_start)
+    query_metrics.save()
+    return row
+
+
+def fetchall_metered(cursor, query_metrics):
+    """
+    Function fetches all the rows of an executed query and records the fetch. The metrics are saved by the caller,
+    after it builds its dataframe
+    :param cursor: The cursor of an executed SELECT query
+    :param query_metrics: The metrics of the query, as returned by execute_metered
+    :type query_metrics: QueryMetrics
+    :return: The rows
+    :rtype: list
+    """
+    fetch_start = perf_counter()
+    rows = cursor.fetchall()
+    query_metrics.fetched(rows, fetch_start)
+    return rows
+
+
+def read_query_metrics(metrics_files=None):
+    """
+    Function reads the query metrics of several runs, to compare them
+    :param metrics_files: The paths of the metrics files. None to read all the runs in METRICS_DIRECTORY
+    :type metrics_files: list
+    :return: A dataframe with one row per query, and the run it belongs to
+    :rtype: pandas.Dataframe
+    """
+    if metrics_files is None:
+        metrics_files = sorted(glob.glob(f"{METRICS_DIRECTORY}/query_metrics_*.jsonl"))
+    run_dfs = [pd.read_json(metrics_file, lines=True, convert_dates=['started'])
+               .assign(run=os.path.basename(metrics_file)[len('query_metrics_'):-len('.jsonl')])
+               for metrics_file in metrics_files if os.path.getsize(metrics_file) > 0]
+    if len(run_dfs) < 1:
+        return pd.DataFrame([], columns=['run', 'query'])
+    return pd.concat(run_dfs, ignore_index=True)
+
+
+def query_metrics_summary(metrics_df):
+    """
+    Function sums the metrics of each query name in each run, e.g. all the INSERTs of the load of a run
+    :param metrics_df: The query metrics, as returned by read_query_metrics
+    :type metrics_df: pandas.Dataframe
+    :return: A dataframe with the executions count, times and sizes of each query in each run
+    :rtype: pandas.Dataframe
+    """
+    return (metrics_df.groupby(['run', 'query'])
+            .agg(executions=('query', 'size'), execute_s=('execute_s', 'sum'), first_row_s=('first_row_s', 'max'),
+                 fetch_s=('fetch_s', 'sum'), build_s=('build_s', 'sum'), rows=('rows', 'sum'),
+                 sent_MB=('sent_bytes', lambda sent_bytes: sent_bytes.sum() / 1_048_576),
+                 fetched_MB=('fetched_bytes', lambda fetched_bytes: fetched_bytes.sum() / 1_048_576))
+            .reset_index())
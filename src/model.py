@@ -1,10 +1,67 @@
 # Classes
+import numpy as np
 import pandas as pd
-from utilities import fixed_date
+from utilities import fixed_date, fixed_dates
 from datetime import timedelta
 
 
 DAYS_BACK = 190
+# Storage type of each column of the generated WIP rows
+WIP_DTYPES = {'Site': 'category', 'Building': 'category', 'SerialNumber': 'category', 'StockCode': 'category',
+              'SKU': 'category', 'CheckPointId': 'int32', 'CheckPointName': 'category', 'Area': 'category',
+              'TransID': 'int64', 'TransactionDate': 'datetime64[ns]', 'SnapshotTime': 'datetime64[ns]',
+              'DwellTime_calendar': 'float64', 'DwellTime_working': 'float64', 'OrderType': 'category',
+              'FactoryStatus': 'category', 'ProductType': 'category', 'Customer': 'category',
+              'PackedIsLast_flag': 'bool', 'PackedPreviously_flag': 'bool',
+              'ETL_time': 'datetime64[ns]'}  # 'isFrom_WIP' - Disabled indefinitely
+# Columns of the WIP rows stored as intervals: one row per unit and location from SnapshotStart to SnapshotEnd
+WIP_INTERVAL_COLUMNS = ['Site', 'Building', 'SerialNumber', 'StockCode', 'SKU', 'CheckPointId', 'CheckPointName',
+                        'Area', 'TransID', 'TransactionDate', 'SnapshotStart', 'SnapshotEnd', 'OrderType',
+                        'FactoryStatus', 'ProductType', 'Customer', 'PackedIsLast_flag', 'PackedPreviously_flag',
+                        'ETL_time']
+
+
+def sort_sap_historicalStatus(sap_historicalStatus_df):
+    """
+    Function sorts the SAP historical status data once, so that it is ready for the as-of join of resolve_factoryStatus.
+    For extractions of one serial number sharing the same timestamp, only the first one is kept
+    :param sap_historicalStatus_df: a dataframe containing SAP historical status data of one or many units
+    :type sap_historicalStatus_df: pandas.Dataframe
+    :return: The SAP historical status data (SerialNumber, EXTRACTED_DATE_TIME, STATUS) sorted by extraction timestamp
+    :rtype: pandas.Dataframe
+    """
+    sap_historicalStatus_df = sap_historicalStatus_df[['SerialNumber', 'EXTRACTED_DATE_TIME', 'STATUS']]
+    sap_historicalStatus_df = sap_historicalStatus_df[sap_historicalStatus_df['EXTRACTED_DATE_TIME'].notna()]
+    sap_historicalStatus_df = sap_historicalStatus_df.sort_values(['SerialNumber', 'EXTRACTED_DATE_TIME'],
+                                                                  kind='stable')
+    sap_historicalStatus_df = sap_historicalStatus_df.drop_duplicates(subset=['SerialNumber', 'EXTRACTED_DATE_TIME'])
+    return sap_historicalStatus_df.sort_values('EXTRACTED_DATE_TIME', kind='stable').reset_index(drop=True)
+
+
+def resolve_factoryStatus(wip_df, sap_historicalStatus_df):
+    """
+    Function resolves the SAP factory status of every WIP snapshot with a single sorted as-of join against the SAP
+    historical status, grouped by SerialNumber. The status of a snapshot is the one of the latest extraction at or
+    before the snapshot time. Snapshots with no such extraction keep their current FactoryStatus
+    :param wip_df: a dataframe containing WIP instances (SerialNumber, SnapshotTime, FactoryStatus)
+    :type wip_df: pandas.Dataframe
+    :param sap_historicalStatus_df: SAP historical status data as returned by sort_sap_historicalStatus
+    :type sap_historicalStatus_df: pandas.Dataframe
+    :return: The FactoryStatus column aligned with the rows of wip_df
+    :rtype: pandas.Series
+    """
+    snapshots_df = wip_df[['SerialNumber', 'SnapshotTime']].reset_index(drop=True)
+    snapshots_df['SnapshotTime'] = pd.to_datetime(snapshots_df['SnapshotTime'])
+    snapshots_df['SerialNumber'] = snapshots_df['SerialNumber'].astype(object)
+    snapshots_df = snapshots_df.sort_values('SnapshotTime', kind='stable').reset_index()
+    sap_historicalStatus_df = sap_historicalStatus_df.astype(
+        {'SerialNumber': object, 'EXTRACTED_DATE_TIME': snapshots_df['SnapshotTime'].dtype})
+    snapshots_df = pd.merge_asof(snapshots_df, sap_historicalStatus_df, left_on='SnapshotTime',
+                                 right_on='EXTRACTED_DATE_TIME', by='SerialNumber', direction='backward')
+    snapshots_df = snapshots_df.set_index('index').sort_index()
+
+    factoryStatus = pd.Series(snapshots_df['STATUS'].to_numpy(), index=wip_df.index, name='FactoryStatus')
+    return factoryStatus.where(snapshots_df['EXTRACTED_DATE_TIME'].notna().to_numpy(), wip_df['FactoryStatus'])
 
 
 class UnitHistory:
@@ -17,7 +74,8 @@ class UnitHistory:
         Constructor for class UnitHistory
         :param checkpoints_df: a dataframe containing product history data for this instance
         :type checkpoints_df: pandas.Dataframe
-        :param sap_historicalStatus_df: a dataframe containing SAP historical status data for this instance
+        :param sap_historicalStatus_df: a dataframe containing SAP historical status data for this instance. None if the
+        FactoryStatus is resolved afterwards for many units at once with resolve_factoryStatus
         :param today_now: Today's date
         :type today_now: datetime.datetime
         :param isServer: A flag that indicates if the unit is a server (True) or a rack (False)
@@ -33,24 +91,26 @@ class UnitHistory:
             self.shipmentCkps = {300, 301}
             self.criticalCkps = {200, 235, 254, 208, 252, 150, 170, 216, 218, 260, 243, 2470, 228, 270, 230, 300, 301}
 
-    def determine_processAndArea(self):
+    def determine_processAndArea(self, wip_buffer=None):
         """
         Method determines the process and area where the server is in by iterating through each day of the server
         life cycle
-        :return: A list object containing tuples, each representing a WIP instance
-        :rtype: list
+        :param wip_buffer: A columnar buffer where the columns of the WIP instances are appended directly
+        :type wip_buffer: ColumnarBuffer
+        :return: A dataframe with the columns of checkpoints_df, each row representing a WIP instance
+        :rtype: pandas.Dataframe
         """
         # Get the starter checkpoints
         mask = self.checkpoints_df['CheckPointId'].isin(self.criticalCkps)
         starterCkps_df = self.checkpoints_df[mask]
-        wipHistory_tuples = []
+        wipHistory_df = self.checkpoints_df.iloc[:0]
 
         if starterCkps_df.shape[0] > 0:
             # Find the boundaries of this unit (minimum and maximum checkpoint timestamps)
             min_timestamp = starterCkps_df['TransactionDate'].min(skipna=True)
             max_timestamp = starterCkps_df['TransactionDate'].max(skipna=True)
             today_upperBoundary = fixed_date(self.today_now)
-            starterCkps_df = starterCkps_df.sort_values('TransactionDate', ascending=False)
+            starterCkps_df = starterCkps_df.sort_values('TransactionDate', ascending=False, kind='stable')
             # Use only for initial population of the SQL table
             minThreshold = self.today_now - timedelta(days=DAYS_BACK)
 
@@ -62,14 +122,6 @@ class UnitHistory:
             else:
                 least_packingDate = packing_df['TransactionDate'].min(skipna=True)
 
-            # Sort SAP historical status dataframe in descending order of extraction timestamp
-            if self.sap_historicalStatus_df is not None:
-                self.sap_historicalStatus_df = self.sap_historicalStatus_df.sort_values('EXTRACTED_DATE_TIME',
-                                                                                        ascending=False)
-                sap_exists = True
-            else:
-                sap_exists = False
-
             # Determine the right upper boundary
             if starterCkps_df['CheckPointId'].iloc[0] in self.shipmentCkps:
                 # Add one day to the actual upper boundary if the max timestamp is less than today's upper boundary
@@ -93,38 +145,322 @@ class UnitHistory:
             if min_timestamp < minThreshold:
                 if starterCkps_df['CheckPointId'].iloc[0] in self.shipmentCkps:
                     if max_timestamp < minThreshold:  # Void very old instances that already shipped
-                        return []
+                        return wipHistory_df
                     else:
                         current_date = fixed_date(minThreshold)
                 else:
                     current_date = fixed_date(minThreshold)
 
-            # Iterate between the boundaries to find the location (process and area) of this unit for each day
+            # Iterate between the boundaries to find the location (process and area) of this unit for each day: the
+            # position of its row in the starter checkpoints
+            transactionDates = starterCkps_df['TransactionDate'].to_numpy(dtype='datetime64[ns]')
+            location_positions = []
+            snapshotTimes = []
             while current_date <= actual_upperBoundary:
                 # Get the starter checkpoints whose timestamps are less than current date
-                day_ckps_df = starterCkps_df[starterCkps_df['TransactionDate'] <= current_date]
-                if len(day_ckps_df['TransactionDate']) < 1:
-                    current_date = current_date + timedelta(days=1)
-                    continue
-                # Get the row that has the current location of this current instance
-                location_row = day_ckps_df.iloc[0].copy()  # Recommendation by pandas warning system to use copy() here
-                # Get the SAP status for this WIP snapshot date (current_date)
-                if sap_exists:
-                    current_historicalStatus_df = \
-                        self.sap_historicalStatus_df[
-                            self.sap_historicalStatus_df['EXTRACTED_DATE_TIME'] <= current_date]
-                    if current_historicalStatus_df.shape[0] > 0:
-                        current_status = current_historicalStatus_df['STATUS'].iloc[0]
-                        location_row.loc['FactoryStatus'] = current_status
-                transaction_timestamp = location_row.loc['TransactionDate']
-                location_row.loc['SnapshotTime'] = current_date
-                # Assign shipment status
-                location_row.loc['PackedIsLast_flag'] = PackedIsLast_flag
-                location_row.loc['PackedPreviously_flag'] = least_packingDate < transaction_timestamp
-                # Add the WIP instance to the WIP history
-                location_row_tuple = tuple(location_row)
-                wipHistory_tuples.append(location_row_tuple)
+                day_positions = np.flatnonzero(transactionDates <= np.datetime64(current_date))
+                if len(day_positions) > 0:
+                    # The first one has the current location of this current instance
+                    location_positions.append(day_positions[0])
+                    snapshotTimes.append(current_date)
                 # Increment current day by 1
                 current_date = current_date + timedelta(days=1)
 
-        return wipHistory_tuples
+            # Build the WIP instances of all the days at once
+            wipHistory_df = starterCkps_df.iloc[location_positions].reset_index(drop=True)
+            wipHistory_df['SnapshotTime'] = pd.to_datetime(snapshotTimes)
+            # Assign shipment status
+            wipHistory_df['PackedIsLast_flag'] = PackedIsLast_flag
+            wipHistory_df['PackedPreviously_flag'] = least_packingDate < wipHistory_df['TransactionDate']
+
+            # Get the SAP status for all the WIP snapshot dates of this unit at once
+            if self.sap_historicalStatus_df is not None and wipHistory_df.shape[0] > 0:
+                wipHistory_df['FactoryStatus'] = resolve_factoryStatus(
+                    wipHistory_df, sort_sap_historicalStatus(self.sap_historicalStatus_df))
+
+            if wip_buffer is not None and wipHistory_df.shape[0] > 0:
+                wip_buffer.extend_columns(wipHistory_df)
+
+        return wipHistory_df
+
+
+class PopulationHistory(UnitHistory):
+    """
+    Class represents all the servers or all the racks and their checkpoints - data comes from product history.
+    It builds the WIP snapshot grid (SerialNumber x daily 9AM snapshot) of every unit at once, instead of iterating
+    through each unit and each day of the unit life cycle
+    """
+
+    def determine_processAndArea(self):
+        """
+        Method determines the process and area where each unit is in for each day of its life cycle. The location of
+        a snapshot is the latest critical checkpoint at or before the snapshot time, resolved with a sorted as-of join.
+        It produces the same rows as UnitHistory.determine_processAndArea for every unit
+        :return: A dataframe with the columns of checkpoints_df, each row representing a WIP instance. The rows are
+        ordered by SerialNumber and SnapshotTime
+        :rtype: pandas.Dataframe
+        """
+        wip_columns = self.checkpoints_df.columns
+        # Get the starter checkpoints
+        mask = (self.checkpoints_df['CheckPointId'].isin(self.criticalCkps) &
+                self.checkpoints_df['TransactionDate'].notna())
+        starterCkps_df = self.checkpoints_df[mask]
+
+        if starterCkps_df.shape[0] < 1:
+            return pd.DataFrame([], columns=wip_columns)
+
+        # Sort the starter checkpoints once. For checkpoints of one unit sharing the same timestamp, keep the first
+        # one, which is the one UnitHistory finds on top of its descending sort
+        starterCkps_df = starterCkps_df.sort_values(['SerialNumber', 'TransactionDate'], kind='stable')
+        starterCkps_df = starterCkps_df.drop_duplicates(subset=['SerialNumber', 'TransactionDate'])
+
+        # Find the boundaries of each unit (minimum and maximum checkpoint timestamps) and its latest checkpoint
+        units_df = starterCkps_df.groupby('SerialNumber')['TransactionDate'].agg(['min', 'max'])
+        min_timestamp = units_df['min']
+        max_timestamp = units_df['max']
+        latest_ckp = starterCkps_df.drop_duplicates(subset=['SerialNumber'], keep='last').set_index('SerialNumber')
+        PackedIsLast_flag = latest_ckp['CheckPointId'].reindex(units_df.index).isin(self.shipmentCkps)
+        today_upperBoundary = fixed_date(self.today_now)
+        # Use only for initial population of the SQL table
+        minThreshold = self.today_now - timedelta(days=DAYS_BACK)
+
+        # Get the least packing transaction timestamp. Assign dummy value in the future if a unit does not have a
+        # packing date yet
+        packing_df = self.checkpoints_df[self.checkpoints_df['CheckPointId'].isin(self.shipmentCkps)]
+        least_packingDate = packing_df.groupby('SerialNumber')['TransactionDate'].min()
+        least_packingDate = least_packingDate.reindex(units_df.index).fillna(self.today_now + timedelta(days=10))
+
+        # Determine the right upper boundary
+        max_fixedDate = fixed_dates(max_timestamp)
+        packedLate_mask = ((max_timestamp > max_fixedDate) &
+                           (max_timestamp.dt.normalize() < pd.Timestamp(today_upperBoundary.date())))
+        packed_upperBoundary = max_fixedDate.where(~packedLate_mask, max_fixedDate + timedelta(days=1))
+        notPacked_upperBoundary = max_fixedDate.where(max_timestamp >= today_upperBoundary, today_upperBoundary)
+        actual_upperBoundary = packed_upperBoundary.where(PackedIsLast_flag, notPacked_upperBoundary)
+
+        # Set usable data for very old instances  # Use only for initial population of the SQL table
+        oldUnit_mask = min_timestamp < minThreshold
+        lower_boundary = fixed_dates(min_timestamp).where(~oldUnit_mask, fixed_date(minThreshold))
+        # Void very old instances that already shipped
+        void_mask = oldUnit_mask & PackedIsLast_flag & (max_timestamp < minThreshold)
+
+        # Build the snapshot grid: one row per unit per day between its boundaries
+        days_count = (actual_upperBoundary - lower_boundary) // timedelta(days=1) + 1
+        days_count = days_count.where(~void_mask, 0).clip(lower=0).to_numpy(dtype=np.int64)
+        grid_size = days_count.sum()
+        day_offsets = np.arange(grid_size) - np.repeat(np.cumsum(days_count) - days_count, days_count)
+        grid_df = pd.DataFrame({'SerialNumber': np.repeat(units_df.index.to_numpy(), days_count),
+                                'SnapshotTime': (np.repeat(lower_boundary.to_numpy(), days_count) +
+                                                 day_offsets * np.timedelta64(1, 'D'))})
+
+        # Get the row that has the location of each unit for each WIP snapshot date. Drop the snapshots that precede
+        # the first checkpoint of the unit
+        location_df = starterCkps_df.drop(columns=['SnapshotTime']).sort_values('TransactionDate', kind='stable')
+        wip_df = pd.merge_asof(grid_df.sort_values('SnapshotTime', kind='stable'), location_df,
+                               left_on='SnapshotTime', right_on='TransactionDate', by='SerialNumber',
+                               direction='backward')
+        wip_df = wip_df[wip_df['TransactionDate'].notna()].astype(location_df.dtypes.to_dict())
+
+        # Get the SAP status for each WIP snapshot date
+        if self.sap_historicalStatus_df is not None:
+            wip_df['FactoryStatus'] = resolve_factoryStatus(wip_df,
+                                                            sort_sap_historicalStatus(self.sap_historicalStatus_df))
+
+        # Assign shipment status
+        wip_df['PackedIsLast_flag'] = wip_df['SerialNumber'].map(PackedIsLast_flag).astype(bool)
+        wip_df['PackedPreviously_flag'] = wip_df['SerialNumber'].map(least_packingDate) < wip_df['TransactionDate']
+
+        wip_df = wip_df.sort_values(['SerialNumber', 'SnapshotTime'], kind='stable')
+        return wip_df[wip_columns].reset_index(drop=True)
+
+    def estimate_unit_costs(self):
+        """
+        Method estimates the cleaning cost of each unit as its count of checkpoint rows times the number of days of its
+        snapshot grid. The grid starts at the first checkpoint, or DAYS_BACK days ago for old units, and ends at the
+        last checkpoint for units that already shipped or today for units still in WIP
+        :return: The estimated cost of each unit, indexed by SerialNumber
+        :rtype: pandas.Series
+        """
+        units_df = self.checkpoints_df.groupby('SerialNumber', observed=True)['TransactionDate'].agg(['size', 'min',
+                                                                                                      'max'])
+        packing_df = self.checkpoints_df[self.checkpoints_df['CheckPointId'].isin(self.shipmentCkps)]
+        max_packingDate = packing_df.groupby('SerialNumber', observed=True)['TransactionDate'].max()
+        shipped_mask = max_packingDate.reindex(units_df.index) >= units_df['max']
+
+        lower_boundary = units_df['min'].clip(lower=self.today_now - timedelta(days=DAYS_BACK))
+        upper_boundary = units_df['max'].where(shipped_mask, self.today_now)
+        days_count = (upper_boundary.dt.normalize() - lower_boundary.dt.normalize()) // timedelta(days=1) + 1
+        return units_df['size'] * days_count.fillna(1).clip(lower=1).astype(np.int64)
+
+
+class ColumnarBuffer:
+    """
+    Class represents a compact column-oriented accumulator of WIP rows. Each column is a typed, growable NumPy array:
+    int codes for categories, datetime64 for dates and bool for flags
+    """
+
+    def __init__(self, dtypes=None, capacity=1_024):
+        """
+        Constructor for class ColumnarBuffer
+        :param dtypes: The columns of the buffer and their storage type ('category' or a NumPy dtype). Default is
+        WIP_DTYPES
+        :type dtypes: dict
+        :param capacity: The number of rows allocated up front. The arrays double in size when they are full
+        :type capacity: int
+        """
+        self.dtypes = WIP_DTYPES if dtypes is None else dtypes
+        self.capacity = capacity
+        self.size = 0
+        self._allocate()
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self):
+        """
+        Method allocates new empty arrays for all the columns
+        :return: None
+        """
+        self.arrays = {column: np.empty(self.capacity, dtype=np.int32 if dtype == 'category' else dtype)
+                       for column, dtype in self.dtypes.items()}
+        self.categories = {column: {} for column, dtype in self.dtypes.items() if dtype == 'category'}
+
+    def _reserve(self, rows_count):
+        """
+        Method grows the arrays so that rows_count more rows fit in the buffer
+        :param rows_count: The number of rows about to be appended
+        :type rows_count: int
+        :return: None
+        """
+        if self.size + rows_count <= self.capacity:
+            return
+        self.capacity = max(2 * self.capacity, self.size + rows_count)
+        for column, array in self.arrays.items():
+            new_array = np.empty(self.capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            self.arrays[column] = new_array
+
+    def _encode(self, column, values):
+        """
+        Method converts the values of one column to the storage type of the column
+        :param column: The column name
+        :type column: str
+        :param values: The values to convert
+        :return: The values ready to be stored in the array of the column
+        :rtype: numpy.ndarray
+        """
+        dtype = self.dtypes[column]
+        if dtype == 'category':  # Map each distinct value to its code, missing values are -1
+            if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):  # Reuse the codes of the categories
+                uniques_codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                uniques_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+            categories = self.categories[column]
+            codes = np.array([categories.setdefault(value, len(categories)) for value in uniques], dtype=np.int32)
+            return np.where(uniques_codes < 0, -1, codes[uniques_codes] if len(codes) > 0 else -1)
+        elif dtype.startswith('datetime64'):
+            values = values if isinstance(values, pd.Series) else pd.Series(list(values))
+            return pd.to_datetime(values).to_numpy(dtype=dtype)
+        return np.asarray(values, dtype=dtype)
+
+    def extend(self, rows):
+        """
+        Method appends rows to the buffer
+        :param rows: The rows to append. Each row is a tuple with the values in the order of the buffer columns
+        :type rows: list
+        :return: None
+        """
+        if len(rows) < 1:
+            return
+        self.extend_columns(dict(zip(self.dtypes, zip(*rows))))
+
+    def extend_columns(self, columns):
+        """
+        Method appends whole columns of values to the buffer
+        :param columns: The values of each buffer column, for example a dataframe containing the buffer columns
+        :type columns: dict or pandas.Dataframe
+        :return: None
+        """
+        rows_count = len(columns[next(iter(self.dtypes))])
+        self._reserve(rows_count)
+        for column in self.dtypes:
+            self.arrays[column][self.size: self.size + rows_count] = self._encode(column, columns[column])
+        self.size += rows_count
+
+    def to_frame(self):
+        """
+        Method turns the content of the buffer into a dataframe. The dataframe uses the arrays of the buffer without
+        copying them, so the buffer is emptied and gets new arrays for the next rows. The dataframe gets a view of the
+        rows each array holds, or a copy of them when most of the array is unused capacity that the view would keep
+        alive
+        :return: A dataframe with the buffer columns
+        :rtype: pandas.Dataframe
+        """
+        frame_columns = {}
+        for column, dtype in self.dtypes.items():
+            values = self.arrays[column][:self.size]
+            if self.capacity > 2 * self.size:
+                values = values.copy()
+            if dtype == 'category':
+                values = pd.Categorical.from_codes(values, categories=list(self.categories[column]))
+            frame_columns[column] = values
+        buffer_df = pd.DataFrame(frame_columns, copy=False)
+
+        self.size = 0
+        self._allocate()
+        return buffer_df
+
+
+class UnitSlices:
+    """
+    Class represents dataframes sorted once by unit, with the row boundaries of each unit, to go through the units one
+    at a time without grouping. The rows of a unit are one contiguous slice of each sorted dataframe, so a unit costs
+    two offsets instead of a group lookup and a copy
+    """
+
+    def __init__(self, dataframe, *aligned_dfs, unit_column='SerialNumber'):
+        """
+        Constructor for class UnitSlices
+        :param dataframe: The dataframe whose units are iterated, e.g. product history raw data
+        :type dataframe: pandas.Dataframe
+        :param aligned_dfs: Other dataframes of the same units, e.g. their SAP historical status data. Each unit gets
+        its rows of these dataframes too, and no rows if it has none
+        :param unit_column: The column that identifies the units
+        :type unit_column: str
+        """
+        codes, units = pd.factorize(dataframe[unit_column], sort=True)
+        self.units = pd.Index(units)
+        self.frames = []
+        self.boundaries = []
+        for frame, frame_codes in [(dataframe, codes)] + [(aligned_df, self.units.get_indexer(aligned_df[unit_column]))
+                                                          for aligned_df in aligned_dfs]:
+            # Sort by unit and keep the order of the rows within each unit. Rows without a unit (-1) come first
+            order = np.argsort(frame_codes, kind='stable')
+            sorted_codes = frame_codes[order]
+            first_row = np.searchsorted(sorted_codes, 0)
+            self.frames.append(frame.iloc[order[first_row:]].reset_index(drop=True))
+            self.boundaries.append(np.searchsorted(sorted_codes[first_row:], np.arange(len(self.units) + 1)))
+
+    def __len__(self):
+        return len(self.units)
+
+    def __iter__(self):
+        """
+        Method goes through the units in sorted order
+        :return: For each unit, a tuple with the unit, its rows of the dataframe and its rows of each aligned dataframe
+        :rtype: generator
+        """
+        for unit_num, unit in enumerate(self.units):
+            yield (unit, *[frame.iloc[boundaries[unit_num]: boundaries[unit_num + 1]]
+                           for frame, boundaries in zip(self.frames, self.boundaries)])
+
+    def positions(self):
+        """
+        Method goes through the units in sorted order and returns their row positions in the sorted dataframe, e.g. to
+        slice views of its column arrays
+        :return: For each unit, a tuple with the unit and the positions of its first and after its last row
+        :rtype: generator
+        """
+        boundaries = self.boundaries[0]
+        for unit_num, unit in enumerate(self.units):
+            yield unit, boundaries[unit_num], boundaries[unit_num + 1]
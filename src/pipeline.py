@@ -0,0 +1,249 @@
+# Resumable WIP pipeline: extract -> link -> clean -> load
+from transform import *
+from db_conn import create_async_pool
+from delete import delete_allData
+from datetime import datetime as dt
+from functools import partial
+import asyncio
+import hashlib
+import json
+import os
+
+
+SERVER_NAME_asbuilt = 'ZwhirlpoolR'
+DATABASE_NAME_asbuilt = 'ASBuiltDW'
+
+PIPELINE_STATE = "CleanedRecords_csv/pipeline_state.json"
+STAGES = ('extract', 'link', 'clean', 'load')
+# Hand-off files of the extract stage, in the order of the dataframes returned by extract_raw_data
+EXTRACTED_DATA = ('re_rawData', 'sr_rawData', 're_rackBuild', 're_rackEoL', 'sr_sap_statusH', 're_sap_statusH',
+                  'customers')
+# Hand-off files of the raw data linked by the extract stage while the SAP history was being extracted
+LINKED_DATA = ('re_linkedData', 'sr_linkedData')
+
+
+def files_fingerprint(paths, *parameters):
+    """
+    Function returns a fingerprint of the input files and the parameters of a stage. A file is identified by its
+    path, size and modification time, so a file that is written again gets a new fingerprint. A missing file gets a
+    new fingerprint every time, so the stage is run again instead of being skipped
+    :param paths: The paths of the input files
+    :type paths: list
+    :param parameters: Any other input of the stage that changes its results
+    :return: The fingerprint
+    :rtype: str
+    """
+    fingerprint = hashlib.sha1(json.dumps([str(parameter) for parameter in parameters]).encode())
+    for path in paths:
+        if not os.path.exists(path):
+            fingerprint.update(f"{path}|missing|{dt.now().isoformat()}".encode())
+            continue
+        path_stat = os.stat(path)
+        fingerprint.update(f"{path}|{path_stat.st_size}|{path_stat.st_mtime_ns}".encode())
+    return fingerprint.hexdigest()
+
+
+def read_pipeline_state():
+    """
+    Function reads the completion markers of the pipeline stages
+    :return: The state of each stage: its input fingerprint, its completed chunks and its completion time
+    :rtype: dict
+    """
+    if not os.path.exists(PIPELINE_STATE):
+        return {}
+    with open(PIPELINE_STATE) as state_file:
+        return json.load(state_file)
+
+
+def save_pipeline_state(pipeline_state):
+    """
+    Function saves the completion markers of the pipeline stages. The file is replaced in one step, so a crash
+    while saving does not leave a broken state file
+    :param pipeline_state: The state of each stage
+    :type pipeline_state: dict
+    :return: None
+    """
+    with open(f"{PIPELINE_STATE}.tmp", 'w') as state_file:
+        json.dump(pipeline_state, state_file, indent=2)
+    os.replace(f"{PIPELINE_STATE}.tmp", PIPELINE_STATE)
+
+
+def stage_fingerprint(stage, asIntervals=False):
+    """
+    Function returns the fingerprint of the inputs of a stage
+    :param stage: The name of the stage
+    :type stage: str
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :return: The fingerprint
+    :rtype: str
+    """
+    if stage == 'extract':  # The source data changes every day
+        return files_fingerprint([], dt.now().date())
+    elif stage == 'link':
+        return files_fingerprint([store_path(name) for name in EXTRACTED_DATA])
+    elif not os.path.exists(CHUNKS_MANIFEST):  # The chunks of the clean and load stages are unknown
+        return files_fingerprint([CHUNKS_MANIFEST], asIntervals)
+    elif stage == 'clean':
+        return files_fingerprint([CHUNKS_MANIFEST] + [chunk_path(name, chunk_info['chunk'])
+                                                      for chunk_info in read_chunks_manifest()
+                                                      for name in ('wip_rawData', 'sap_historyData')], asIntervals)
+    else:
+        return files_fingerprint([chunk_path('wip_cleaned', chunk_info['chunk'])
+                                  for chunk_info in read_chunks_manifest()], asIntervals)
+
+
+def stage_outputs(stage):
+    """
+    Function returns the files that a stage writes for the next stages
+    :param stage: The name of the stage
+    :type stage: str
+    :return: The paths of the output files
+    :rtype: list
+    """
+    if stage == 'extract':
+        return [store_path(name) for name in EXTRACTED_DATA]
+    elif stage == 'load':
+        return []
+    elif not os.path.exists(CHUNKS_MANIFEST):
+        return [CHUNKS_MANIFEST]
+    elif stage == 'link':
+        return [CHUNKS_MANIFEST] + [chunk_path(name, chunk_info['chunk']) for chunk_info in read_chunks_manifest()
+                                    for name in ('wip_rawData', 'sap_historyData')]
+    else:
+        return [chunk_path('wip_cleaned', chunk_info['chunk']) for chunk_info in read_chunks_manifest()]
+
+
+async def extract_stage(conn_sbi, stage_state, save_state, asIntervals=False):
+    """
+    Stage that truncates the WIP table for a fresh upload and extracts the raw data to the hand-off files. The raw data
+    is also linked while the SAP history is extracted, and stored for the link stage
+    :param conn_sbi: The connection for SBI DB
+    :param stage_state: The state of the stage: its input fingerprint, its completed chunks and its completion time
+    :type stage_state: dict
+    :param save_state: A function that saves the pipeline state, after a chunk is completed
+    :type save_state: function
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :return: None
+    """
+    if not delete_allData(conn_sbi, asIntervals=asIntervals):
+        raise RuntimeError("The WIP table was not truncated before the extraction")
+    # Linked data of an earlier extraction
+    for name in LINKED_DATA:
+        if os.path.exists(store_path(name)):
+            os.remove(store_path(name))
+    async_pool_asbuilt = await create_async_pool(SERVER_NAME_asbuilt, DATABASE_NAME_asbuilt)
+    try:
+        extracted_dfs, linked_dfs = await extract_link_raw_data(async_pool_asbuilt, conn_sbi)
+    finally:
+        async_pool_asbuilt.close()
+        await async_pool_asbuilt.wait_closed()
+    write_chunks(list(zip(extracted_dfs + linked_dfs, [store_path(name) for name in EXTRACTED_DATA + LINKED_DATA])))
+
+
+def link_stage(conn_sbi, stage_state, save_state, asIntervals=False):
+    """
+    Stage that links the extracted raw data and splits it into the chunks of the cleaning pool. The raw data linked
+    by the extract stage is used when there is one
+    :param conn_sbi: The connection for SBI DB
+    :param stage_state: The state of the stage: its input fingerprint, its completed chunks and its completion time
+    :type stage_state: dict
+    :param save_state: A function that saves the pipeline state, after a chunk is completed
+    :type save_state: function
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :return: None
+    """
+    if all(os.path.exists(store_path(name)) for name in LINKED_DATA):
+        re_rawData_df, sr_rawData_df = [read_chunk(store_path(name)) for name in LINKED_DATA]
+        sr_sap_statusH_df, re_sap_statusH_df = [read_chunk(store_path(name))
+                                                for name in ('sr_sap_statusH', 're_sap_statusH')]
+    else:
+        re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, sr_sap_statusH_df, re_sap_statusH_df, \
+            customers_df = [read_chunk(store_path(name)) for name in EXTRACTED_DATA]
+        re_rawData_df, sr_rawData_df = link_raw_data(re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df,
+                                                     customers_df)
+    export_wip_chunks(sr_rawData_df, sr_sap_statusH_df, re_rawData_df, re_sap_statusH_df)
+
+
+def clean_stage(conn_sbi, stage_state, save_state, asIntervals=False):
+    """
+    Stage that cleans the chunks that are not cleaned yet and stores the cleaned chunks
+    :param conn_sbi: The connection for SBI DB
+    :param stage_state: The state of the stage: its input fingerprint, its completed chunks and its completion time
+    :type stage_state: dict
+    :param save_state: A function that saves the pipeline state, after a chunk is completed
+    :type save_state: function
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :return: None
+    """
+    pending_chunks = [chunk_info for chunk_info in read_chunks_manifest()
+                      if chunk_info['chunk'] not in stage_state['chunks']]
+    for chunk_num in run_wip_pool(partial(clean_wip_chunk, asIntervals=asIntervals, load=False), pending_chunks,
+                                  description="WIP chunks cleaned"):
+        stage_state['chunks'].append(chunk_num)
+        save_state()
+
+
+def load_stage(conn_sbi, stage_state, save_state, asIntervals=False):
+    """
+    Stage that loads the cleaned chunks that are not loaded yet. Each chunk is committed at once, so a chunk marked
+    as loaded is never loaded twice
+    :param conn_sbi: The connection for SBI DB
+    :param stage_state: The state of the stage: its input fingerprint, its completed chunks and its completion time
+    :type stage_state: dict
+    :param save_state: A function that saves the pipeline state, after a chunk is completed
+    :type save_state: function
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :return: None
+    """
+    if len(stage_state['chunks']) < 1:  # Nothing of this load is in the table yet
+        if not delete_allData(conn_sbi, asIntervals=asIntervals):
+            raise RuntimeError("The WIP table was not truncated before the load")
+    pending_chunks = [chunk_info for chunk_info in read_chunks_manifest()
+                      if chunk_info['chunk'] not in stage_state['chunks']]
+    for chunk_num in run_wip_pool(partial(load_wip_chunk, asIntervals=asIntervals), pending_chunks,
+                                  description="WIP chunks loaded"):
+        stage_state['chunks'].append(chunk_num)
+        save_state()
+
+
+STAGE_FUNCTIONS = {'extract': extract_stage, 'link': link_stage, 'clean': clean_stage, 'load': load_stage}
+
+
+def run_pipeline(conn_sbi, asIntervals=False, restart=False):
+    """
+    Function runs the WIP pipeline stages in order: extract, link, clean and load.
+    A stage is skipped when it completed before with the same input fingerprint and its output files still exist, so
+    after a failure the pipeline resumes from the stage that failed. The clean and load stages also resume from their
+    last completed chunk.
+    Every stage function takes the SBI connection, its stage state, a function that saves the pipeline state and
+    the intervals flag
+    :param conn_sbi: The connection for SBI DB
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :param restart: a flag to ignore the completion markers and run every stage
+    :return: None
+    """
+    pipeline_state = {} if restart else read_pipeline_state()
+
+    for stage in STAGES:
+        fingerprint = stage_fingerprint(stage, asIntervals)
+        stage_state = pipeline_state.get(stage, {})
+        if stage_state.get('fingerprint') != fingerprint or \
+                (stage_state.get('completed') and not all(os.path.exists(path) for path in stage_outputs(stage))):
+            # New inputs, or output files that were removed: start the stage over
+            stage_state = {'fingerprint': fingerprint, 'chunks': [], 'completed': None}
+        pipeline_state[stage] = stage_state
+        if stage_state['completed']:
+            print(f"Stage '{stage}' completed on {stage_state['completed']} with the same inputs. Skipped\n")
+            continue
+
+        stage_start = dt.now()
+        print(f"\n___ Stage '{stage}' ___\n")
+        stage_function = STAGE_FUNCTIONS[stage]
+        stage_arguments = (conn_sbi, stage_state, partial(save_pipeline_state, pipeline_state), asIntervals)
+        if asyncio.iscoroutinefunction(stage_function):
+            asyncio.run(stage_function(*stage_arguments))
+        else:
+            stage_function(*stage_arguments)
+        stage_state['completed'] = dt.now().isoformat(timespec='seconds')
+        save_pipeline_state(pipeline_state)
+        print(f"Stage '{stage}' completed. T: {dt.now() - stage_start}\n")
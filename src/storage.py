@@ -0,0 +1,109 @@
+# Functions for the hand-off of the raw data chunks between the extraction run and the cleaning pool
+from concurrent.futures import ThreadPoolExecutor
+import json
+import pandas as pd
+import pyarrow as pa
+
+
+# File format of the raw data chunks: 'arrow' (Arrow IPC files, memory-mapped by the workers) or 'hdf5'
+HANDOFF_FORMAT = 'arrow'
+HANDOFF_DIRECTORY = "CleanedRecords_csv"
+# Schema metadata key of the string columns that are dictionary-encoded on disk only
+DECODED_COLUMNS_KEY = b'wip_decoded_columns'
+
+
+def store_path(name, handoff_format=HANDOFF_FORMAT):
+    """
+    Function returns the path of a hand-off file
+    :param name: The name of the data in the file
+    :type name: str
+    :param handoff_format: The file format, 'arrow' or 'hdf5'
+    :type handoff_format: str
+    :return: The path of the hand-off file
+    :rtype: str
+    """
+    return f"{HANDOFF_DIRECTORY}/{name}.{'arrow' if handoff_format == 'arrow' else 'h5'}"
+
+
+def chunk_path(name, chunk_num, handoff_format=HANDOFF_FORMAT):
+    """
+    Function returns the path of a raw data chunk file
+    :param name: The name of the data in the chunk, e.g. wip_rawData or sap_historyData
+    :type name: str
+    :param chunk_num: The number of the chunk
+    :type chunk_num: int
+    :param handoff_format: The file format of the chunk, 'arrow' or 'hdf5'
+    :type handoff_format: str
+    :return: The path of the chunk file
+    :rtype: str
+    """
+    return store_path(f"{name}_c{chunk_num}", handoff_format)
+
+
+def write_chunk(dataframe, path, handoff_format=HANDOFF_FORMAT):
+    """
+    Function writes a raw data chunk to a file. In Arrow format the string columns are stored dictionary-encoded,
+    so each distinct string is written once per column, and the file is left uncompressed so that it can be
+    memory-mapped by read_chunk
+    :param dataframe: The raw data chunk
+    :type dataframe: pandas.Dataframe
+    :param path: The path of the chunk file
+    :type path: str
+    :param handoff_format: The file format of the chunk, 'arrow' or 'hdf5'
+    :type handoff_format: str
+    :return: None
+    """
+    if handoff_format == 'hdf5':  # The table format stores the category columns
+        dataframe.to_hdf(path, index=False, key='data', mode='w', format='table')
+        return
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    string_columns = [field.name for field in table.schema if pa.types.is_string(field.type)]
+    for column in string_columns:
+        table = table.set_column(table.schema.get_field_index(column), column,
+                                 table.column(column).dictionary_encode())
+    table = table.replace_schema_metadata({**table.schema.metadata,
+                                           DECODED_COLUMNS_KEY: json.dumps(string_columns).encode()})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_chunks(chunks, handoff_format=HANDOFF_FORMAT, max_workers=8):
+    """
+    Function writes many raw data chunks to their files in parallel threads. Arrow releases the GIL while it writes.
+    HDF5 files are written one at a time because PyTables is not thread-safe
+    :param chunks: Pairs of a raw data chunk and the path of its file
+    :type chunks: list
+    :param handoff_format: The file format of the chunks, 'arrow' or 'hdf5'
+    :type handoff_format: str
+    :param max_workers: The maximum number of writing threads
+    :type max_workers: int
+    :return: None
+    """
+    with ThreadPoolExecutor(max_workers=max_workers if handoff_format == 'arrow' else 1) as executor:
+        # Consume the results so that any writing error is raised here
+        list(executor.map(lambda chunk: write_chunk(*chunk, handoff_format=handoff_format), chunks))
+
+
+def read_chunk(path, handoff_format=HANDOFF_FORMAT, memory_map=True):
+    """
+    Function reads a raw data chunk from its file. Arrow files are memory-mapped, so the numeric and datetime columns
+    are not parsed and only the dictionaries of the string columns are turned back into Python strings
+    :param path: The path of the chunk file
+    :type path: str
+    :param handoff_format: The file format of the chunk, 'arrow' or 'hdf5'
+    :type handoff_format: str
+    :param memory_map: a flag to memory-map the Arrow file. A file that is written again after the read must not be
+    mapped, since a mapped file cannot be replaced on Windows
+    :type memory_map: bool
+    :return: The raw data chunk, with the same columns and dtypes it was written with
+    :rtype: pandas.Dataframe
+    """
+    if handoff_format == 'hdf5':
+        return pd.read_hdf(path, key='data')
+
+    with (pa.memory_map(path, 'r') if memory_map else pa.OSFile(path, 'rb')) as source:
+        table = pa.ipc.open_file(source).read_all()
+        decoded_columns = json.loads(table.schema.metadata.get(DECODED_COLUMNS_KEY, b'[]'))
+        dataframe = table.to_pandas()
+    return dataframe.astype({column: object for column in decoded_columns})
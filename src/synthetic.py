@@ -0,0 +1,235 @@
+# Synthetic manufacturing history in the shape of the extracted raw data, to run and profile the pipeline without
+# the production databases
+from utilities import compact_dtypes
+from datetime import datetime as dt, timedelta
+import numpy as np
+import pandas as pd
+
+
+# Servers per rack and share of the servers that ship on their own instead of in a rack
+RACK_SIZE = 16
+SINGLE_SERVER_SHARE = 0.1
+# Units start their build within this many days before today
+HISTORY_DAYS = 240
+# Share of the checkpoint rows that are scanned again later (rework, repeated scans)
+RESCAN_SHARE = 0.05
+SERVER_STOCKCODES_COUNT = 40
+RACK_STOCKCODES_COUNT = 8
+ORDER_TYPES = ('ZP01', 'ZP02', 'ZP03', None)
+SAP_STATUSES = ('REL', 'PCNF', 'CNF', 'GMPS', 'DLV')
+# Checkpoints of the rack life cycle, in order
+RACK_BUILD_CKPS = (200, 235, 254, 208, 252)
+RACK_EOL_CKPS = (216, 218, 260)
+RACK_HIPOT_CKPS = (2470, 247)
+RACK_SHIPPING_CKPS = (270, 230, 300)
+# Checkpoints of the servers of a rack, in order. The checkpoints in SERVER_RACK_SCAN_CKPS carry the RackSN in
+# StringField1
+RACK_SERVER_CKPS = (100, 101, 150, 170, 102, 202, 224, 228, 230, 301)
+SERVER_RACK_SCAN_CKPS = (150, 202, 224)
+# Checkpoints of a single server and the mean hours between them
+SINGLE_SERVER_CKPS = (100, 101, 150, 170, 102, 1510, 151, 234, 302)
+SINGLE_SERVER_GAPS = (0, 6, 4, 24, 12, 2, 0.5, 4, 24)
+# Hipot start checkpoints, remapped by the extraction from failed 'Test Start' transactions
+HIPOT_START_CKPS = (2470, 1510)
+RAW_COLUMNS = ['Site', 'Building', 'SerialNumber', 'StockCode', 'StringField1', 'CheckPointId', 'CheckPointName',
+               'TransactionDate', 'Success', 'Message', 'TransID', 'SKU', 'OrderType']
+
+
+def rack_timelines(rng, racks_count):
+    """
+    Function draws the checkpoint times of each rack, in hours from its start, and the anchors the checkpoints of its
+    servers are placed around
+    :param rng: The random generator
+    :type rng: numpy.random.Generator
+    :param racks_count: The number of racks
+    :type racks_count: int
+    :return: The rack checkpoint times (racks_count x checkpoints, in the order of the rack checkpoints) and the anchors
+    :rtype: tuple
+    """
+    def gaps(mean_hours, count=1):
+        return np.cumsum(rng.exponential(mean_hours, (racks_count, count)), axis=1)
+
+    build_start = rng.exponential(8, (racks_count, 1))
+    build = build_start + gaps(1.5, len(RACK_BUILD_CKPS))
+    slt_end = build[:, -1:] + 1 + rng.exponential(48, (racks_count, 1))
+    eol = slt_end + 1 + gaps(2, len(RACK_EOL_CKPS))
+    test_out = eol[:, -1:] + 1 + rng.exponential(12, (racks_count, 1))
+    hipot = test_out + 0.5 + gaps(0.5, len(RACK_HIPOT_CKPS))
+    shipping = hipot[:, -1:] + 1 + gaps(8, len(RACK_SHIPPING_CKPS))
+    anchors = {'build_start': build_start[:, 0], 'build_end': build[:, -1], 'slt_end': slt_end[:, 0],
+               'eol_end': eol[:, -1], 'test_out': test_out[:, 0], 'hipot_end': hipot[:, -1],
+               'shipped': shipping[:, -1]}
+    return np.hstack([build, eol, hipot, shipping]), anchors
+
+
+def rack_server_timelines(rng, anchors, server_racks):
+    """
+    Function draws the checkpoint times of the servers of the racks, in hours from the start of their rack. The
+    rack build, rack End-of-Line and rack Hi-Pot checkpoints fall between the server checkpoints they are linked by
+    :param rng: The random generator
+    :type rng: numpy.random.Generator
+    :param anchors: The anchors of each rack, as returned by rack_timelines
+    :type anchors: dict
+    :param server_racks: The rack of each server
+    :type server_racks: numpy.ndarray
+    :return: The server checkpoint times (servers x checkpoints, in the order of RACK_SERVER_CKPS)
+    :rtype: numpy.ndarray
+    """
+    servers_count = len(server_racks)
+    anchor = {name: times[server_racks] for name, times in anchors.items()}
+
+    def jitter(low=0.0, high=1.0):
+        return rng.uniform(low, high, servers_count)
+
+    sltIn = anchor['build_end'] + jitter()
+    finalTouch = anchor['hipot_end'] + jitter()
+    return np.column_stack([-jitter(2, 6),  # 100 Assembly start
+                            anchor['build_start'] - jitter(),  # 101 Assembly finish
+                            sltIn,  # 150 SLT check-in
+                            sltIn + (anchor['slt_end'] - sltIn) * jitter(0.2, 0.8),  # 170
+                            anchor['slt_end'] - jitter(),  # 102 SLT pass
+                            anchor['eol_end'] + jitter(),  # 202 Rack scan
+                            anchor['test_out'] - jitter(),  # 224 Rack test check-out
+                            finalTouch,  # 228 Final touch check-in
+                            finalTouch + rng.exponential(3, servers_count),  # 230
+                            anchor['shipped'] + jitter()])  # 301
+
+
+def generate_raw_data(units_count, seed=0, today_now=None):
+    """
+    Function generates a synthetic manufacturing history with units_count servers: the servers of racks and single
+    servers, the racks, their SAP status history and the customers. Units start within HISTORY_DAYS days and the
+    checkpoints after today_now are left out, so part of the units are still in WIP. The rack build, End-of-Line and
+    Hi-Pot checkpoints of each rack fall between the server checkpoints that link them to its servers
+    :param units_count: The number of servers
+    :type units_count: int
+    :param seed: The seed of the random generator, so that a scale is generated the same every time
+    :type seed: int
+    :param today_now: The date of the run. Default is now
+    :type today_now: datetime.datetime
+    :return: A tuple with the dataframes returned by extract_raw_data: rack and server raw data, rack build data, rack
+    End-of-Line data, server and rack SAP historical status data, and customers
+    :rtype: tuple
+    """
+    rng = np.random.default_rng(seed)
+    today_now = today_now or dt.now()
+    singles_count = int(units_count * SINGLE_SERVER_SHARE)
+    racks_count = -(-(units_count - singles_count) // RACK_SIZE)
+    server_racks = np.arange(units_count - singles_count) // RACK_SIZE
+
+    # Checkpoint times in hours from the start of each rack or single server
+    rack_times, anchors = rack_timelines(rng, racks_count)
+    rackServer_times = rack_server_timelines(rng, anchors, server_racks)
+    singleServer_times = np.cumsum(rng.exponential(SINGLE_SERVER_GAPS, (singles_count, len(SINGLE_SERVER_GAPS))),
+                                   axis=1)
+    rack_ckps = RACK_BUILD_CKPS + RACK_EOL_CKPS + RACK_HIPOT_CKPS + RACK_SHIPPING_CKPS
+
+    # Serial numbers, stock codes and order types of the units: racks first, then the servers
+    rack_SNs = np.array([f"{900_000_000_000 + rack}" for rack in range(racks_count)], dtype=object)
+    server_SNs = np.array([f"{200_000_000_000 + server}" for server in range(units_count)], dtype=object)
+    rack_stockCodes = np.array([f"RE-{100 + code}-{code % 10:02d}" for code in range(RACK_STOCKCODES_COUNT)],
+                               dtype=object)
+    server_stockCodes = np.array([f"SR-{1000 + code}" for code in range(SERVER_STOCKCODES_COUNT)], dtype=object)
+    rack_stockCode = rack_stockCodes[rng.integers(0, RACK_STOCKCODES_COUNT, racks_count)]
+    server_stockCode = server_stockCodes[rng.integers(0, SERVER_STOCKCODES_COUNT, units_count)]
+
+    # One row per checkpoint: unit, checkpoint, time and rack scanned
+    rack_start = today_now - pd.to_timedelta(rng.uniform(0, HISTORY_DAYS * 24, racks_count), unit='h')
+    single_start = today_now - pd.to_timedelta(rng.uniform(0, HISTORY_DAYS * 24, singles_count), unit='h')
+    rack_rows = {'unit': np.repeat(np.arange(racks_count), len(rack_ckps)),
+                 'CheckPointId': np.tile(rack_ckps, racks_count),
+                 'TransactionDate': np.repeat(rack_start.to_numpy(), len(rack_ckps)) +
+                 pd.to_timedelta(rack_times.ravel(), unit='h').to_numpy(),
+                 'rack': np.full(racks_count * len(rack_ckps), -1)}
+    scan_mask = np.isin(RACK_SERVER_CKPS, SERVER_RACK_SCAN_CKPS)
+    server_rows = {'unit': np.concatenate([np.repeat(np.arange(units_count - singles_count), len(RACK_SERVER_CKPS)),
+                                           np.repeat(np.arange(units_count - singles_count, units_count),
+                                                     len(SINGLE_SERVER_CKPS))]),
+                   'CheckPointId': np.concatenate([np.tile(RACK_SERVER_CKPS, units_count - singles_count),
+                                                   np.tile(SINGLE_SERVER_CKPS, singles_count)]),
+                   'TransactionDate': np.concatenate([
+                       np.repeat(rack_start.to_numpy()[server_racks], len(RACK_SERVER_CKPS)) +
+                       pd.to_timedelta(rackServer_times.ravel(), unit='h').to_numpy(),
+                       np.repeat(single_start.to_numpy(), len(SINGLE_SERVER_CKPS)) +
+                       pd.to_timedelta(singleServer_times.ravel(), unit='h').to_numpy()]),
+                   'rack': np.concatenate([np.where(np.tile(scan_mask, units_count - singles_count),
+                                                    np.repeat(server_racks, len(RACK_SERVER_CKPS)), -1),
+                                           np.full(singles_count * len(SINGLE_SERVER_CKPS), -1)])}
+
+    raw_dfs = []
+    checkPointNames = {ckp: f"Checkpoint {ckp}" for ckp in set(rack_ckps + RACK_SERVER_CKPS + SINGLE_SERVER_CKPS)}
+    for rows, SNs, stockCodes in ((rack_rows, rack_SNs, rack_stockCode), (server_rows, server_SNs, server_stockCode)):
+        SKUs = pd.Series(stockCodes).map({stockCode: f"SKU-{stockCode}" for stockCode in set(stockCodes)})
+        rows_df = pd.DataFrame(rows)
+        # Scans of some checkpoints again later
+        rescan_df = rows_df[rng.random(rows_df.shape[0]) < RESCAN_SHARE].copy()
+        rescan_df['TransactionDate'] += pd.to_timedelta(rng.exponential(6, rescan_df.shape[0]), unit='h')
+        rows_df = pd.concat([rows_df, rescan_df], ignore_index=True)
+        # Checkpoints after today are not there yet
+        rows_df = rows_df[rows_df['TransactionDate'] <= today_now]
+        units = rows_df['unit'].to_numpy()
+        hipotStart_mask = rows_df['CheckPointId'].isin(HIPOT_START_CKPS).to_numpy()
+        raw_dfs.append(pd.DataFrame({
+            'Site': 'NJ',
+            'Building': np.where(units % 3 == 0, 'B4050', 'B350'),
+            'SerialNumber': SNs[units],
+            'StockCode': stockCodes[units],
+            'StringField1': np.where(rows_df['rack'].to_numpy() >= 0, rack_SNs[rows_df['rack'].clip(lower=0)], None),
+            'CheckPointId': rows_df['CheckPointId'].to_numpy(),
+            'CheckPointName': rows_df['CheckPointId'].map(checkPointNames).to_numpy(),
+            'TransactionDate': rows_df['TransactionDate'].dt.floor('ms').to_numpy(),
+            'Success': ~hipotStart_mask,
+            'Message': np.where(hipotStart_mask, 'Test Start', 'Pass'),
+            'SKU': rows_df['unit'].map(SKUs).to_numpy(),
+            'OrderType': np.array(ORDER_TYPES, dtype=object)[units % len(ORDER_TYPES)]}))
+
+    # Transaction IDs in the order of the transactions
+    transactionDates = np.concatenate([raw_df['TransactionDate'].to_numpy() for raw_df in raw_dfs])
+    transIDs = np.empty(len(transactionDates), dtype=np.int64)
+    transIDs[np.argsort(transactionDates, kind='stable')] = np.arange(len(transactionDates)) + 1_000_000
+    re_rawData_df, sr_rawData_df = [compact_dtypes(raw_df.assign(TransID=transIDs[start:start + raw_df.shape[0]])
+                                                   [RAW_COLUMNS])
+                                    for raw_df, start in zip(raw_dfs, (0, raw_dfs[0].shape[0]))]
+
+    # Rack build and End-of-Line data, as selected for the linkage
+    re_rackBuild_df, re_rackEoL_df = [
+        re_rawData_df[re_rawData_df['CheckPointId'].isin(ckps) & re_rawData_df['Success']]
+        .rename(columns={'SerialNumber': 'RackSN'}).drop(columns=['StringField1']).reset_index(drop=True)
+        for ckps in (RACK_BUILD_CKPS, RACK_EOL_CKPS)]
+
+    sr_sap_statusH_df, re_sap_statusH_df = [sap_statusHistory(rng, rawData_df)
+                                            for rawData_df in (sr_rawData_df, re_rawData_df)]
+    stockCodes = np.concatenate([server_stockCodes, rack_stockCodes])
+    customers_df = compact_dtypes(pd.DataFrame({
+        'Customer': np.array(['AZU', 'AMZ', 'C0001', 'C0002'], dtype=object)[np.arange(len(stockCodes)) % 4],
+        'StockCode': stockCodes}).iloc[:int(len(stockCodes) * 0.9)])
+    return (re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, sr_sap_statusH_df, re_sap_statusH_df,
+            customers_df)
+
+
+def sap_statusHistory(rng, rawData_df):
+    """
+    Function generates the SAP status changes of the units of synthetic raw data: up to len(SAP_STATUSES) changes per
+    unit, in order, between its first checkpoint and a day after its last one
+    :param rng: The random generator
+    :type rng: numpy.random.Generator
+    :param rawData_df: The synthetic raw data of the units
+    :type rawData_df: pandas.Dataframe
+    :return: The SAP historical status data of the units
+    :rtype: pandas.Dataframe
+    """
+    units_df = rawData_df.groupby('SerialNumber', sort=False).agg(StockCode=('StockCode', 'first'),
+                                                                  first=('TransactionDate', 'min'),
+                                                                  last=('TransactionDate', 'max'))
+    changes_count = rng.integers(1, len(SAP_STATUSES) + 1, units_df.shape[0])
+    unit_rows = np.repeat(np.arange(units_df.shape[0]), changes_count)
+    status_positions = np.arange(changes_count.sum()) - np.repeat(np.cumsum(changes_count) - changes_count,
+                                                                  changes_count)
+    spans = (units_df['last'] - units_df['first'] + timedelta(days=1)).to_numpy()[unit_rows]
+    return compact_dtypes(pd.DataFrame({
+        'SerialNumber': units_df.index.to_numpy()[unit_rows],
+        'StockCode': units_df['StockCode'].to_numpy()[unit_rows],
+        'STATUS': np.array(SAP_STATUSES, dtype=object)[status_positions],
+        'EXTRACTED_DATE_TIME': (units_df['first'].to_numpy()[unit_rows] +
+                                spans * ((status_positions + rng.random(len(unit_rows))) /
+                                         (changes_count[unit_rows] + 1))).astype('datetime64[ms]')}))
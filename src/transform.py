@@ -1,14 +1,23 @@
 # Functions for raw data transformations
+import numpy as np
 import pandas as pd
 from model import *
 from extraction import *
 from utilities import *
 from loading import *
+from storage import *
 from tqdm import tqdm
 import asyncio
 import logging
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta
 import multiprocessing
+import json
+
+# The raw data is handed to the cleaning pool in this many chunks per worker process, listed in the chunks manifest
+CHUNKS_PER_WORKER = 4
+CHUNKS_MANIFEST = "CleanedRecords_csv/wip_chunks.json"
+# Semaphore for concurrent loading processes. Each worker of the cleaning pool receives it from init_wip_worker
+WORKER_SEMAPHORE = None
 
 
 async def get_raw_data(async_pool_asbuilt, conn_sbi):
@@ -20,263 +29,304 @@ async def get_raw_data(async_pool_asbuilt, conn_sbi):
     :return: A tuple containing four dataframes for rack and server raw data
     :rtype: tuple
     """
+    extracted_dfs, linked_dfs = await extract_link_raw_data(async_pool_asbuilt, conn_sbi)
+    re_rawData_df, sr_rawData_df = linked_dfs
+    sr_sap_statusH_df, re_sap_statusH_df = extracted_dfs[4:6]
 
-    extraction_start = dt.now()
+    return re_rawData_df, sr_rawData_df, sr_sap_statusH_df, re_sap_statusH_df
+
+
+def start_extraction(async_pool_asbuilt, conn_sbi):
+    """
+    Function starts the SQL extraction functions as concurrent tasks
+    :param async_pool_asbuilt: Asynchronous pool for Asbuilt DB
+    :param conn_sbi: The connection for SBI DB
+    :return: The tasks of the product history raw data, rack build data, rack End-of-Line data, SAP historical status
+    data and customers extractions
+    :rtype: tuple
+    """
     # Run the select queries
     print("\nSELECT queries running concurrently in the background...\n")
     wip_maxDate = datetime_from_py_to_sql(select_wip_maxDate(conn_sbi))
-    results = await asyncio.gather(select_ph_rawData(async_pool_asbuilt, wip_maxDate),
-                                   select_ph_rackBuildData(async_pool_asbuilt, wip_maxDate),
-                                   select_ph_rackEoL_data(async_pool_asbuilt, wip_maxDate),
-                                   select_sap_historicalStatus(async_pool_asbuilt, wip_maxDate),
-                                   select_customers(async_pool_asbuilt))
+    # Serial numbers of the product history raw data, taken before the join with the reference tables, so that the
+    # units the join drops until their stock code reaches Agile keep their SAP history
+    serialNumbers_future = asyncio.get_running_loop().create_future() if SAP_SNS_FROM_PH else None
+    ph_rawData_task = asyncio.ensure_future(select_ph_rawData(async_pool_asbuilt, wip_maxDate,
+                                                              serialNumbers_future=serialNumbers_future))
+
+    async def select_sap_afterRawData():
+        # The SAP history is selected for the serial numbers of the product history raw data once it is extracted
+        serialNumbers_df = await serialNumbers_future
+        if serialNumbers_df is None:
+            return None
+        return await select_sap_historicalStatus(async_pool_asbuilt, wip_maxDate, serialNumbers_df=serialNumbers_df)
+
+    return (ph_rawData_task,
+            asyncio.ensure_future(select_ph_rackBuildData(async_pool_asbuilt, wip_maxDate)),
+            asyncio.ensure_future(select_ph_rackEoL_data(async_pool_asbuilt, wip_maxDate)),
+            asyncio.ensure_future(select_sap_afterRawData() if SAP_SNS_FROM_PH else
+                                  select_sap_historicalStatus(async_pool_asbuilt, wip_maxDate)),
+            asyncio.ensure_future(select_reference_data(async_pool_asbuilt, 'customers')))
+
+
+def extracted_data(results):
+    """
+    Function arranges the results of the extraction tasks into the extracted dataframes
+    :param results: The results of the tasks of start_extraction, in order
+    :type results: list
+    :return: A tuple containing the extracted dataframes: rack and server raw data, rack build data, rack End-of-Line
+    data, server and rack SAP historical status data, and customers
+    :rtype: tuple
+    """
+    re_rawData_df, sr_rawData_df = results[0]
+    sr_sap_statusH_df, re_sap_statusH_df = results[3]
+    extracted_dfs = (re_rawData_df, sr_rawData_df, results[1], results[2], sr_sap_statusH_df, re_sap_statusH_df,
+                     results[4])
+    print(f"Extracted data in memory: {sum(memory_footprint(df) for df in extracted_dfs):,.1f} MB\n")
+    return extracted_dfs
+
+
+async def extract_raw_data(async_pool_asbuilt, conn_sbi):
+    """
+    Function that runs the SQL extraction functions concurrently
+    :param async_pool_asbuilt: Asynchronous pool for Asbuilt DB
+    :param conn_sbi: The connection for SBI DB
+    :return: A tuple containing the extracted dataframes: rack and server raw data, rack build data, rack End-of-Line
+    data, server and rack SAP historical status data, and customers
+    :rtype: tuple
+    """
+    extraction_start = dt.now()
+    results = await asyncio.gather(*start_extraction(async_pool_asbuilt, conn_sbi))
     print(f"\nTOTAL extraction time: {dt.now() - extraction_start}")
+    return extracted_data(results)
 
-    allocation_start = dt.now()
-    print("Data allocation is running in the background...")
 
-    re_rawData_df, sr_rawData_df = results[0]
-    re_rackBuild_df = results[1]
-    re_rackEoL_df = results[2]
-    sr_sap_statusH_df, re_sap_statusH_df = results[3]
-    customers_df = results[4]
+async def extract_link_raw_data(async_pool_asbuilt, conn_sbi):
+    """
+    Function that runs the SQL extraction functions concurrently and links the raw data while the extraction is still
+    running. The linkage only needs the product history, rack build, rack End-of-Line and customers data, so it starts
+    in a worker thread as soon as those four complete, and the SAP history query, which is only needed for the
+    cleaning, keeps running meanwhile
+    :param async_pool_asbuilt: Asynchronous pool for Asbuilt DB
+    :param conn_sbi: The connection for SBI DB
+    :return: A tuple containing the extracted dataframes, as returned by extract_raw_data, and the linked rack and
+    server raw data, as returned by link_raw_data
+    :rtype: tuple
+    """
+    extraction_start = dt.now()
+    ph_rawData_task, rackBuild_task, rackEoL_task, sap_task, customers_task = \
+        start_extraction(async_pool_asbuilt, conn_sbi)
+
+    async def link_afterExtraction():
+        ph_rawData, re_rackBuild_df, re_rackEoL_df, customers_df = await asyncio.gather(
+            ph_rawData_task, rackBuild_task, rackEoL_task, customers_task)
+        print(f"Linkage inputs extracted. Linking while the SAP history extraction is "
+              f"{'complete' if sap_task.done() else 'running'}. T: {dt.now() - extraction_start}")
+        return await asyncio.get_running_loop().run_in_executor(None, link_raw_data, *ph_rawData, re_rackBuild_df,
+                                                                 re_rackEoL_df, customers_df)
+
+    linked_dfs, *results = await asyncio.gather(link_afterExtraction(), ph_rawData_task, rackBuild_task,
+                                                rackEoL_task, sap_task, customers_task)
+    print(f"\nTOTAL extraction and linkage time: {dt.now() - extraction_start}")
+    return extracted_data(results), linked_dfs
+
+
+def link_rack_events(sr_rawData_df, rack_events_df, lower_ckp, upper_ckp, rackOnLower=False):
+    """
+    Function links rack events to the servers of the rack. A rack event is linked to a server when it falls between a
+    lower and an upper checkpoint of the server, one of which is scanned with the rack serial number in StringField1.
+    Each server gets one window per rack, from its earliest lower checkpoint to its latest upper checkpoint, and the
+    rack events are matched to the windows with an interval join
+    :param sr_rawData_df: A dataframe containing the server raw data
+    :type sr_rawData_df: pandas.Dataframe
+    :param rack_events_df: A dataframe containing the rack events, with the rack serial number in RackSN
+    :type rack_events_df: pandas.Dataframe
+    :param lower_ckp: The server checkpoint before the rack events
+    :type lower_ckp: int
+    :param upper_ckp: The server checkpoint after the rack events
+    :type upper_ckp: int
+    :param rackOnLower: A flag to indicate whether the rack is scanned at the lower checkpoint (True) or at the upper
+    checkpoint (False)
+    :return: The linked rack events as server rows: the server serial number, stock code, SKU and order type of the
+    lower checkpoint, the rack serial number in StringField1 and a TransID made unique for each server
+    :rtype: pandas.Dataframe
+    """
+    lower_keys, upper_keys = (['SerialNumber', 'StringField1'], 'SerialNumber') if rackOnLower else \
+        ('SerialNumber', ['SerialNumber', 'StringField1'])
+    # Earliest lower checkpoint of each server (and rack), with the server stock code, SKU and order type
+    sr_lower_df = sr_rawData_df.loc[sr_rawData_df['CheckPointId'] == lower_ckp,
+                                    ['SerialNumber', 'StringField1', 'StockCode', 'TransactionDate', 'SKU',
+                                     'OrderType']]
+    sr_lower_df = sr_lower_df.sort_values('TransactionDate', kind='stable').drop_duplicates(lower_keys)
+    # Latest upper checkpoint of each server (and rack)
+    sr_upper_df = sr_rawData_df.loc[sr_rawData_df['CheckPointId'] == upper_ckp,
+                                    ['SerialNumber', 'StringField1', 'TransactionDate']]
+    sr_upper_df = sr_upper_df.sort_values('TransactionDate', ascending=False, kind='stable').drop_duplicates(upper_keys)
+
+    # Window of each server and rack
+    sr_windows_df = sr_lower_df.rename(columns={'TransactionDate': 'lower'}).drop(
+        columns=[] if rackOnLower else ['StringField1'])
+    sr_windows_df = sr_windows_df.merge(sr_upper_df.rename(columns={'TransactionDate': 'upper'}).drop(
+        columns=['StringField1'] if rackOnLower else []), on='SerialNumber', how='inner')
+    sr_windows_df = sr_windows_df.rename(columns={'StringField1': 'RackSN'})
+    sr_rackEvents_df = interval_join(sr_windows_df, rack_events_df, on='RackSN')
 
-    # Purge Rack Build, End-of-Line and Rack Hi-Pot data that might be in server data to avoid having
-    # duplicates further on
-    mask = ~sr_rawData_df['CheckPointId'].isin({200, 201, 235, 236, 254, 255, 208, 209, 252, 253,
-                                                216, 217, 218, 219, 260, 2470, 247})
-    sr_rawData_df = sr_rawData_df[mask]
-
-    # Merge rack build information for server:
-    # Server assembly finish data
-    sr_assemblyFinish_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 101]
-    sr_assemblyFinish_df = sr_assemblyFinish_df[['SerialNumber', 'StockCode', 'TransactionDate', 'CheckPointId', 'SKU',
-                                                 'OrderType']]
-    sr_assemblyFinish_df = sr_assemblyFinish_df.rename(columns={'StockCode': 'StockCode_af',
-                                                                'TransactionDate': 'TransactionDate_af',
-                                                                'SKU': 'SKU_af',
-                                                                'OrderType': 'OrderType_af'})
-
-    # SLT check-in data
-    sr_sltIn_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 150]
-    sr_sltIn_df = sr_sltIn_df[['SerialNumber', 'StringField1', 'TransactionDate', 'CheckPointId']]
-    sr_sltIn_df = sr_sltIn_df.rename(columns={'TransactionDate': 'TransactionDate_sltIn'})
-
-    # Merge SLT-in, Server assembly finish, and rack build dataframes.
-    # Then, drop rows whose rack build timestamps do not fall within server assembly finish and SLT-in timestamps
-    sr_rackBuild_df = sr_sltIn_df.merge(re_rackBuild_df, left_on='StringField1', right_on='RackSN', how='inner')
-    sr_rackBuild_df = sr_rackBuild_df.merge(sr_assemblyFinish_df, on='SerialNumber', how='inner')
-    sr_rackBuild_df = sr_rackBuild_df[(sr_rackBuild_df['TransactionDate_af'] <= sr_rackBuild_df['TransactionDate']) &
-                                      (sr_rackBuild_df['TransactionDate'] <= sr_rackBuild_df['TransactionDate_sltIn'])]
-    # Create a new trans ID by adding the SN and 10 billion to the original TransID to make it unique.
-    # Currently, it is not unique because it is using the RE TransID
-    sr_rackBuild_df['int_SN'] = sr_rackBuild_df['SerialNumber'].apply(str_extract_digits)
-    sr_rackBuild_df['TransID'] = sr_rackBuild_df['TransID'].add(10_000_000_000)
-    sr_rackBuild_df['TransID'] = sr_rackBuild_df['TransID'] + sr_rackBuild_df['int_SN']
-    # Move the SR stock code to the StockCode column, which currently has the RE-StockCode,
-    # and RE-checkpoint ID to the checkpoint ID column, as well as SKU, and OrderType for server
-    sr_rackBuild_df['StockCode'] = sr_rackBuild_df['StockCode_af']
-    sr_rackBuild_df['CheckPointId'] = sr_rackBuild_df['CheckPointId_y'].astype(int)
-    sr_rackBuild_df['SKU'] = sr_rackBuild_df['SKU_af']
-    sr_rackBuild_df['OrderType'] = sr_rackBuild_df['OrderType_af']
-
-    # Concatenate server rack build data to main server raw data and drop unnecessary columns
-    sr_rawData_df = pd.concat([sr_rawData_df, sr_rackBuild_df], ignore_index=True)
-    sr_rawData_df = sr_rawData_df.drop(columns=['TransactionDate_sltIn', 'CheckPointId_x', 'RackSN',
-                                                'CheckPointId_y', 'StockCode_af', 'SKU_af', 'OrderType_af',
-                                                'TransactionDate_af', 'int_SN'])
-
-    # Merge Rack End of Line data for server:
-    # Server SLT-pass data
-    sr_sltPass_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 102]
-    sr_sltPass_df = sr_sltPass_df[['SerialNumber', 'StockCode', 'TransactionDate', 'CheckPointId', 'SKU',
-                                   'OrderType']]
-    sr_sltPass_df = sr_sltPass_df.rename(columns={'StockCode': 'StockCode_sltP',
-                                                  'TransactionDate': 'TransactionDate_sltP',
-                                                  'SKU': 'SKU_sltP',
-                                                  'OrderType': 'OrderType_sltP'})
-
-    # Server rack scan 1 data
-    sr_rackScan_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 202]
-    sr_rackScan_df = sr_rackScan_df[['SerialNumber', 'StringField1', 'TransactionDate', 'CheckPointId']]
-    sr_rackScan_df = sr_rackScan_df.rename(columns={'TransactionDate': 'TransactionDate_rs'})
-
-    # Merge SLT-pass, server rack scan, and rack End-of-Line dataframes.
-    # Then, drop rows whose rack End-of-Line timestamps do not fall within server SLT-pass and Rack Scan timestamps
-    sr_rackEoL_df = sr_rackScan_df.merge(re_rackEoL_df, left_on='StringField1', right_on='RackSN', how='inner')
-    sr_rackEoL_df = sr_rackEoL_df.merge(sr_sltPass_df, on='SerialNumber', how='inner')
-    sr_rackEoL_df = sr_rackEoL_df[(sr_rackEoL_df['TransactionDate_sltP'] <= sr_rackEoL_df['TransactionDate']) &
-                                  (sr_rackEoL_df['TransactionDate'] <= sr_rackEoL_df['TransactionDate_rs'])]
     # Create a new trans ID by adding the SN and 10 billion to the original TransID to make it unique.
     # Currently, it is not unique because it is using the RE TransID
-    sr_rackEoL_df['int_SN'] = sr_rackEoL_df['SerialNumber'].apply(str_extract_digits)
-    sr_rackEoL_df['TransID'] = sr_rackEoL_df['TransID'].add(10_000_000_000)
-    sr_rackEoL_df['TransID'] = sr_rackEoL_df['TransID'] + sr_rackEoL_df['int_SN']
-    # Move the SR stock code to the StockCode column, which currently has the RE-StockCode,
-    # and RE-checkpoint ID to the checkpoint ID column, as well as SKU, and OrderType for server
-    sr_rackEoL_df['StockCode'] = sr_rackEoL_df['StockCode_sltP']
-    sr_rackEoL_df['CheckPointId'] = sr_rackEoL_df['CheckPointId_y'].astype(int)
-    sr_rackEoL_df['SKU'] = sr_rackEoL_df['SKU_sltP']
-    sr_rackEoL_df['OrderType'] = sr_rackEoL_df['OrderType_sltP']
-
-    # Concatenate server rack End-of-Line data to main server raw data and drop unnecessary columns
-    sr_rawData_df = pd.concat([sr_rawData_df, sr_rackEoL_df], ignore_index=True)
-    sr_rawData_df = sr_rawData_df.drop(columns=['TransactionDate_rs', 'CheckPointId_x', 'RackSN',
-                                                'CheckPointId_y', 'StockCode_sltP', 'SKU_sltP', 'OrderType_sltP',
-                                                'TransactionDate_sltP', 'int_SN'])
-
-    # Merge Rack Hi-Pot data for server. Note: Server data exists in rack hipot checkpoint, but it is not complete
-    # Server Rack Test check-out data
-    sr_rackTestOut_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 224]
-    sr_rackTestOut_df = sr_rackTestOut_df[['SerialNumber', 'StringField1', 'StockCode', 'TransactionDate',
-                                           'CheckPointId', 'SKU', 'OrderType']]
-    sr_rackTestOut_df = sr_rackTestOut_df.rename(columns={'StringField1': 'RackSN',
-                                                          'StockCode': 'StockCode_rt',
-                                                          'TransactionDate': 'TransactionDate_rt',
-                                                          'CheckPointId': 'CheckPointId_rt',
-                                                          'SKU': 'SKU_rt',
-                                                          'OrderType': 'OrderType_rt'})
-
-    # Server final touch check-in data
-    sr_finalTouch_df = sr_rawData_df[sr_rawData_df['CheckPointId'] == 228]
-    sr_finalTouch_df = sr_finalTouch_df[['SerialNumber', 'TransactionDate', 'CheckPointId']]
-    sr_finalTouch_df = sr_finalTouch_df.rename(columns={'TransactionDate': 'TransactionDate_ft',
-                                                        'CheckPointId': 'CheckPointId_ft'})
-
-    # Rack Hi-Pot data
+    int_SNs = {serialNumber: str_extract_digits(serialNumber)
+               for serialNumber in sr_rackEvents_df['SerialNumber'].unique()}
+    sr_rackEvents_df['TransID'] = sr_rackEvents_df['TransID'].add(10_000_000_000) + \
+        sr_rackEvents_df['SerialNumber'].map(int_SNs).astype('int64')
+    sr_rackEvents_df['CheckPointId'] = sr_rackEvents_df['CheckPointId'].astype(int)
+    sr_rackEvents_df['StringField1'] = sr_rackEvents_df['RackSN']
+    return sr_rackEvents_df.drop(columns=['RackSN', 'lower', 'upper'])
+
+
+def link_raw_data(re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, customers_df):
+    """
+    Function that links the rack build, rack End-of-Line and rack Hi-Pot data to the servers of each rack and assigns
+    the product types and the customers
+    :param re_rawData_df: A dataframe containing the rack raw data
+    :param sr_rawData_df: A dataframe containing the server raw data
+    :param re_rackBuild_df: A dataframe containing the rack build data
+    :param re_rackEoL_df: A dataframe containing the rack End-of-Line data
+    :param customers_df: A dataframe containing the customers and their stock codes
+    :return: A tuple containing the linked rack and server raw data
+    :rtype: tuple
+    """
+    allocation_start = dt.now()
+    print("Data allocation is running in the background...")
+    # The columns added below must not change the extracted rack data, which may be handed off meanwhile
+    re_rawData_df = re_rawData_df.copy(deep=False)
+
+    # The linked rack events are collected and added to the server raw data with a single concatenation at the end,
+    # so that the server raw data is copied once. The server checkpoints of the linkages are not purged below
+    # Link the rack build data to the servers: The rack build happens between the server assembly finish and the
+    # server SLT check-in, which is scanned with the rack serial number
+    sr_rackEvents_dfs = [link_rack_events(sr_rawData_df, re_rackBuild_df, lower_ckp=101, upper_ckp=150)]
+
+    # Link the rack End-of-Line data to the servers: The rack End-of-Line happens between the server SLT pass and the
+    # server rack scan 1, which is scanned with the rack serial number
+    sr_rackEvents_dfs.append(link_rack_events(sr_rawData_df, re_rackEoL_df, lower_ckp=102, upper_ckp=202))
+
+    # Link the rack Hi-Pot data to the servers. Note: Server data exists in rack hipot checkpoint, but it is not
+    # complete. The rack Hi-Pot happens between the server rack test check-out, which is scanned with the rack serial
+    # number, and the server final touch check-in
     re_hipot_df = re_rawData_df[(re_rawData_df['CheckPointId'] == 2470) | (re_rawData_df['CheckPointId'] == 247)]
     re_hipot_df = re_hipot_df.rename(columns={'SerialNumber': 'RackSN'})
+    sr_rackEvents_dfs.append(link_rack_events(sr_rawData_df, re_hipot_df, lower_ckp=224, upper_ckp=228,
+                                              rackOnLower=True))
+    del re_hipot_df
 
-    # Merge Rack Test check-out, final touch, and rack hi-pot dataframes.
-    # Then, drop rows whose rack hi-pot timestamps do not fall within rack test check-out and final touch check-in
-    sr_rackHipot_df = sr_rackTestOut_df.merge(re_hipot_df, on='RackSN', how='inner')
-    sr_rackHipot_df = sr_rackHipot_df.merge(sr_finalTouch_df, on='SerialNumber', how='inner')
-    sr_rackHipot_df = sr_rackHipot_df[(sr_rackHipot_df['TransactionDate_rt'] <= sr_rackHipot_df['TransactionDate']) &
-                                      (sr_rackHipot_df['TransactionDate'] <= sr_rackHipot_df['TransactionDate_ft'])]
-    # Create a new trans ID by adding the SN and 10 billion to the original TransID to make it unique.
-    # Currently, it is not unique because it is using the RE TransID
-    sr_rackHipot_df['int_SN'] = sr_rackHipot_df['SerialNumber'].apply(str_extract_digits)
-    sr_rackHipot_df['TransID'] = sr_rackHipot_df['TransID'].add(10_000_000_000)
-    sr_rackHipot_df['TransID'] = sr_rackHipot_df['TransID'] + sr_rackHipot_df['int_SN']
-    # Move the SR stock code to the StockCode column, which currently has the RE-StockCode,
-    # and RE-checkpoint ID to the checkpoint ID column, as well as RackSN, SKU, and OrderType for server
-    sr_rackHipot_df['StockCode'] = sr_rackHipot_df['StockCode_rt']
-    sr_rackHipot_df['CheckPointId'] = sr_rackHipot_df['CheckPointId'].astype(int)
-    sr_rackHipot_df['StringField1'] = sr_rackHipot_df['RackSN']
-    sr_rackHipot_df['SKU'] = sr_rackHipot_df['SKU_rt']
-    sr_rackHipot_df['OrderType'] = sr_rackHipot_df['OrderType_rt']
-
-    # Concatenate rack hi-pot for server data to main server raw data and drop unnecessary columns
-    sr_rawData_df = pd.concat([sr_rawData_df, sr_rackHipot_df], ignore_index=True)
-    sr_rawData_df = sr_rawData_df.drop(columns=['TransactionDate_ft', 'CheckPointId_ft', 'CheckPointId_rt',
-                                                'RackSN', 'StockCode_rt', 'SKU_rt', 'OrderType_rt',
-                                                'TransactionDate_rt', 'int_SN'])
-    # Label the unit type: Server or rack
-    sr_rawData_df['ProductType'] = "Server"
-    re_rawData_df['ProductType'] = "Rack"
-
-    # Drop unnecessary duplicates
-    sr_rawData_df = sr_rawData_df.drop_duplicates(subset=['TransID'])
-    re_rawData_df = re_rawData_df.drop_duplicates(subset=['TransID'])
-
-    # Assign customers
-    sr_rawData_df = sr_rawData_df.merge(customers_df, how='left', on='StockCode')
-    re_rawData_df = re_rawData_df.merge(customers_df, how='left', on='StockCode')
+    # Purge Rack Build, End-of-Line and Rack Hi-Pot data that might be in server data to avoid having
+    # duplicates further on
+    mask = ~sr_rawData_df['CheckPointId'].isin({200, 201, 235, 236, 254, 255, 208, 209, 252, 253,
+                                                216, 217, 218, 219, 260, 2470, 247})
+    sr_rawData_df = concat_compact([sr_rawData_df if mask.all() else sr_rawData_df[mask]] + sr_rackEvents_dfs,
+                                   ignore_index=True)
+    del sr_rackEvents_dfs, mask
+
+    for rawData_df, productType in ((sr_rawData_df, 'Server'), (re_rawData_df, 'Rack')):
+        # Label the unit type: Server or rack
+        rawData_df['ProductType'] = pd.Categorical.from_codes(np.zeros(rawData_df.shape[0], dtype='int8'),
+                                                              categories=[productType])
+        # Assign customers. The stock codes of customers_df are unique, so a lookup gives the same rows as a merge
+        rawData_df['Customer'] = rawData_df['StockCode'].map(customers_df.set_index('StockCode')['Customer'])
+
+    # Drop unnecessary duplicates. Most of the time there are none, and the data is not copied
+    sr_duplicates = sr_rawData_df.duplicated(subset=['TransID'])
+    if sr_duplicates.any():
+        sr_rawData_df = sr_rawData_df[~sr_duplicates]
+    re_duplicates = re_rawData_df.duplicated(subset=['TransID'])
+    if re_duplicates.any():
+        re_rawData_df = re_rawData_df[~re_duplicates]
+    del sr_duplicates, re_duplicates
+    sr_rawData_df.index = pd.RangeIndex(sr_rawData_df.shape[0])
+    re_rawData_df.index = pd.RangeIndex(re_rawData_df.shape[0])
+
+    # Keep the compact column types, for the cleaning pool
+    sr_rawData_df = compact_dtypes(sr_rawData_df)
+    re_rawData_df = compact_dtypes(re_rawData_df)
 
     print(f"\nTOTAL raw data allocation time: {dt.now() - allocation_start}")
 
-    return re_rawData_df, sr_rawData_df, sr_sap_statusH_df, re_sap_statusH_df
+    return re_rawData_df, sr_rawData_df
 
 
-def assign_wip(semaphore, isServerLevel=True):
+def assign_wip(semaphore, chunk_num, isServerLevel=True, vectorized=True, asIntervals=False, load=True):
     """
-    Function that cleans the processed raw data to make a full WIP report and uses another function to
+    Function that cleans one chunk of the processed raw data to make a full WIP report and uses another function to
      export the cleaned data to SQL or CSV
     :param semaphore: Semaphore for concurrent loading processes
     :type semaphore: multiprocessing.Semaphore
+    :param chunk_num: The number of the raw data chunk to clean, as listed in the chunks manifest
+    :type chunk_num: int
     :param isServerLevel: a flag that indicates whether the raw data is server data or rack data
+    :param vectorized: a flag that indicates whether to clean all units at once with PopulationHistory (True) or to
+    clean each unit one at a time with UnitHistory (False). Both produce the same WIP rows
+    :param asIntervals: a flag that indicates whether to store one row per unit and location with its first and last
+    snapshot dates (True) instead of one row per unit per day (False)
+    :param load: a flag that indicates whether to load the cleaned data right away (True) or to store it as the cleaned
+    chunk file, to be loaded by load_wip_chunk (False)
     """
     # Logger variables
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
-    # Process number
-    if multiprocessing.current_process().name == "SR_Pro_1":
-        pro_num = 1
-    elif multiprocessing.current_process().name == "SR_Pro_2":
-        pro_num = 2
-    elif multiprocessing.current_process().name == "SR_Pro_3":
-        pro_num = 3
-    elif multiprocessing.current_process().name == "SR_Pro_4":
-        pro_num = 4
-    else:  # RE Process
-        pro_num = 5
-
     # Import raw data
     import_start = dt.now()
-    print(f"({pro_num}) Importing raw data\n")
-    rawData_df = pd.read_hdf(f"CleanedRecords_csv/wip_rawData_p{pro_num}.h5", key='data')
-    sap_historicalStatus_df = pd.read_hdf(f"CleanedRecords_csv/sap_historyData_p{pro_num}.h5", key='data')
-    print(f"({pro_num}) Raw data import is complete. T: {dt.now() - import_start}")
+    print(f"({chunk_num}) Importing raw data\n")
+    rawData_df = read_chunk(chunk_path('wip_rawData', chunk_num))
+    sap_historicalStatus_df = read_chunk(chunk_path('sap_historyData', chunk_num))
+    print(f"({chunk_num}) Raw data import is complete. T: {dt.now() - import_start}")
 
     PARTITION_SIZE = 300_000
     cleaning_start = dt.now()
     unit_todayNow = dt.now()
     counter = 0
-    wip_list = []
+    wip_buffer = ColumnarBuffer(WIP_DTYPES)
     master_list = []
     areas = {'Server Build': [100, 101],
              'Rack Build': [200, 235, 254, 208, 252],
              'System Test': [150, 170],
              'End of Line': [216, 218, 260, 202, 243, 2470, 228, 270, 237, 230, 300, 301, 1510, 234, 302]}
-    wip_columns = ['Site', 'Building', 'SerialNumber', 'StockCode', 'SKU', 'CheckPointId',
-                   'CheckPointName', 'Area', 'TransID', 'TransactionDate', 'SnapshotTime',
-                   'DwellTime_calendar', 'DwellTime_working', 'OrderType', 'FactoryStatus',
-                   'ProductType', 'Customer', 'PackedIsLast_flag', 'PackedPreviously_flag',
-                   'ETL_time']  # 'isFrom_WIP' - Disabled indefinitely
+    wip_columns = list(WIP_DTYPES)
     distinctSN_count = rawData_df['SerialNumber'].nunique()
 
     # Reindex the raw data and concatenate with existing data from WIP table
     rawData_df = rawData_df.reindex(columns=wip_columns)
 
-    # Group the product history raw data and the SAP historical status data by Serial Number
-    ph_instances_grouped = rawData_df.groupby('SerialNumber')
-    sap_statusH_grouped = sap_historicalStatus_df.groupby('SerialNumber')
-
     # Flags for process progress
     nickel = dime = dime_2 = quarter = dime_3 = dime_4 = half = dime_6 = quarter_3 = dime_8 = ninety = ninety_5 = True
-    progress_prompt = f"\n({pro_num}) {'SR' if isServerLevel else 'RE'} WIP cleaning operation at "
+    progress_prompt = f"\n({chunk_num}) {'SR' if isServerLevel else 'RE'} WIP cleaning operation at "
+
+    # For the per-unit cleaning, sort the SAP historical status data once. The SAP status of all the units is resolved
+    # afterwards with one as-of join per WIP dataframe
+    if not vectorized:
+        sap_historicalStatus_df = sort_sap_historicalStatus(sap_historicalStatus_df)
 
     # Cleaning
-    if pro_num == 2:  # Cleaning for Server Level WIP - Process 2
-        for serialNumber, ph_instance_df in tqdm(ph_instances_grouped, desc="(2) SR WIP cleaning operation progress"):
-            # Get the SAP historical status data for this serial number
-            try:
-                sap_historicalStatus_df = sap_statusH_grouped.get_group(serialNumber).reset_index(drop=True)
-            except KeyError:
-                sap_historicalStatus_df = None
-
-            cleaned_wip = UnitHistory(ph_instance_df.reset_index(drop=True), sap_historicalStatus_df, unit_todayNow)
-            wip_list.extend(cleaned_wip.determine_processAndArea())
-            if len(wip_list) > PARTITION_SIZE:
-                master_list.append(wip_list.copy())
-                wip_list.clear()
-    else:  # Cleaning for Rack Level WIP and Server Level WIP - Processes 1 & 3
-        print(f"({pro_num}) {'SR' if isServerLevel else 'RE'} WIP cleaning operation is running on the background. "
+    if vectorized:  # Cleaning for all units at once
+        print(f"({chunk_num}) {'SR' if isServerLevel else 'RE'} WIP cleaning operation is running on the background "
+              f"for {distinctSN_count} items")
+        cleaned_wip = PopulationHistory(rawData_df, sap_historicalStatus_df, unit_todayNow, isServerLevel)
+        # The WIP dataframe is typed already: its string columns become categories, as in the columnar buffer, and
+        # its partitions are appended as they are
+        category_dtypes = {column: dtype for column, dtype in WIP_DTYPES.items() if dtype == 'category'}
+        population_wip_df = compact_dtypes(cleaned_wip.determine_processAndArea(), category_dtypes)
+        for i in range(0, population_wip_df.shape[0], PARTITION_SIZE):
+            master_list.append(population_wip_df.iloc[i: i + PARTITION_SIZE])
+        del population_wip_df
+        print(f"{progress_prompt}100%. Duration: {dt.now() - cleaning_start}\n")
+    else:  # Cleaning for each unit one at a time
+        print(f"({chunk_num}) {'SR' if isServerLevel else 'RE'} WIP cleaning operation is running on the background. "
               f"Progress will show intermittently")
-        for serialNumber, ph_instance_df in ph_instances_grouped:
-            # Get the SAP historical status data for this serial number
-            try:
-                sap_historicalStatus_df = sap_statusH_grouped.get_group(serialNumber).reset_index(drop=True)
-            except KeyError:
-                sap_historicalStatus_df = None
-
-            cleaned_wip = UnitHistory(ph_instance_df.reset_index(drop=True), sap_historicalStatus_df, unit_todayNow,
-                                      isServerLevel)
-            wip_list.extend(cleaned_wip.determine_processAndArea())
-            if len(wip_list) > PARTITION_SIZE:
-                master_list.append(wip_list.copy())
-                wip_list.clear()
+        # Sort the product history raw data by Serial Number once, and slice the rows of each unit
+        for serialNumber, ph_instance_df in UnitSlices(rawData_df):
+            cleaned_wip = UnitHistory(ph_instance_df, None, unit_todayNow, isServerLevel)
+            cleaned_wip.determine_processAndArea(wip_buffer)
+            if len(wip_buffer) > PARTITION_SIZE:
+                master_list.append(wip_buffer.to_frame())
 
             # Provide loop progress feedback for 5%, 10%, 20%, 25%, 30%, 40%, 50%, 60%, 75%, 80%, 90%, and 95%
             counter += 1
@@ -319,67 +369,247 @@ def assign_wip(semaphore, isServerLevel=True):
                 nickel = False
         print(f"{progress_prompt}100%. Duration: {dt.now() - cleaning_start}\n")
 
-    # Convert WIP list to a dataframe
+    # Convert the WIP buffer to a dataframe
     allocation_start = dt.now()
-    if 0 < len(wip_list) <= PARTITION_SIZE:  # Still append for wip_list less than 300 thousand
-        master_list.append(wip_list.copy())
-        wip_list.clear()
+    if 0 < len(wip_buffer) <= PARTITION_SIZE:  # Still append for wip_buffer less than 300 thousand
+        master_list.append(wip_buffer.to_frame())
     wip_dfs_list = []
 
-    print(f"\nAllocating the cleaned ({pro_num}){'SR' if isServerLevel else 'RE'} WIP data - "
+    print(f"\nAllocating the cleaned ({chunk_num}){'SR' if isServerLevel else 'RE'} WIP data - "
           f"{len(master_list)} items:\n")
-    for index, wip_list in enumerate(master_list):
+    for index, wip_df in enumerate(master_list):
         time_tracker = dt.now()
-        wip_df = pd.DataFrame(wip_list, columns=wip_columns)
+        if not vectorized:
+            wip_df['FactoryStatus'] = resolve_factoryStatus(wip_df, sap_historicalStatus_df).astype('category')
+            logger.info(f"({index + 1}) Initialized the ({chunk_num}){'SR' if isServerLevel else 'RE'} "
+                        f"WIP dataframe from the columnar buffer. T: {dt.now() - time_tracker}")
 
-        logger.info(f"({index + 1}) Initialized the ({pro_num}){'SR' if isServerLevel else 'RE'} "
-                    f"WIP dataframe from the tuples. T: {dt.now() - time_tracker}")
-
-        # Datetime to string conversion
         if wip_df.shape[0] > 0:
             # Dwell time calculations
-            print(f"{wip_df.shape[0]:,} items in ({pro_num}){'SR' if isServerLevel else 'RE'} "
+            print(f"{wip_df.shape[0]:,} items in ({chunk_num}){'SR' if isServerLevel else 'RE'} "
                   f"WIP dataframe ({index + 1})")
             time_tracker = dt.now()
             wip_df['DwellTime_calendar'] = wip_df['SnapshotTime'] - wip_df['TransactionDate']
             wip_df['DwellTime_calendar'] = wip_df['DwellTime_calendar'].dt.total_seconds()
             wip_df['DwellTime_calendar'] /= 3600
-            logger.info(f"({index + 1}) ({pro_num}){'SR' if isServerLevel else 'RE'} "
+            logger.info(f"({index + 1}) ({chunk_num}){'SR' if isServerLevel else 'RE'} "
                         f"WIP: Calendar dwell time calculations complete. T: {dt.now() - time_tracker}")
             time_tracker = dt.now()
-            wip_df['DwellTime_working'] = wip_df.apply(lambda row: delta_working_hours(row['TransactionDate'],
-                                                                                       row['SnapshotTime'],
-                                                                                       calendar=False), axis=1)
-            logger.info(f"({index + 1}) ({pro_num}){'SR' if isServerLevel else 'RE'} "
+            wip_df['DwellTime_working'] = delta_working_hours_array(wip_df['TransactionDate'], wip_df['SnapshotTime'],
+                                                                    calendar=False)
+            logger.info(f"({index + 1}) ({chunk_num}){'SR' if isServerLevel else 'RE'} "
                         f"WIP: Working time dwell time calculations complete. T: {dt.now() - time_tracker}")
 
             # Assign the process areas
             wip_df['Area'] = wip_df['Area'].astype(object)  # Explicitly cast column before assignment (pandas r.)
             for area, checkpoint_ids in tqdm(areas.items(), total=len(areas),
                                              desc=f"({index + 1}) Assigning the "
-                                                  f"({pro_num}){'SR' if isServerLevel else 'RE'} process areas"):
+                                                  f"({chunk_num}){'SR' if isServerLevel else 'RE'} process areas"):
                 wip_df.loc[wip_df['CheckPointId'].isin(checkpoint_ids), 'Area'] = area
 
-            # Convert python Datetime(s) to SQL Datetime
-            time_tracker = dt.now()
-            wip_df[['TransactionDate', 'SnapshotTime']] = wip_df[['TransactionDate', 'SnapshotTime']].applymap(
-                datetime_from_py_to_sql)
-            wip_df['ETL_time'] = datetime_from_py_to_sql(dt.now())
-            logger.info(f"({index + 1}) ({pro_num}){'SR' if isServerLevel else 'RE'} "
-                        f"WIP: Datetime conversions to string complete. T: {dt.now() - time_tracker}")
+            # Compress the consecutive days of each unit at the same location into intervals
+            if asIntervals:
+                time_tracker = dt.now()
+                wip_df = compress_wip_intervals(wip_df)
+                logger.info(f"({index + 1}) ({chunk_num}){'SR' if isServerLevel else 'RE'} "
+                            f"WIP: Compressed into {wip_df.shape[0]:,} intervals. T: {dt.now() - time_tracker}")
+
+            # The datetimes stay datetime64 down to the load, which sends them as typed parameters
+            wip_df['ETL_time'] = dt.now()
 
             wip_dfs_list.append(wip_df.copy())
 
     if len(wip_dfs_list) < 1:
-        final_wip_df = pd.DataFrame([], columns=wip_columns)  # Dummy DF to avoid producing an error
+        # Dummy DF to avoid producing an error
+        final_wip_df = pd.DataFrame([], columns=WIP_INTERVAL_COLUMNS if asIntervals else wip_columns)
     else:
-        print(f"Concatenating the ({pro_num}){'SR' if isServerLevel else 'RE'} dataframes in the background...")
+        print(f"Concatenating the ({chunk_num}){'SR' if isServerLevel else 'RE'} dataframes in the background...")
         final_wip_df = pd.concat(wip_dfs_list, ignore_index=True)
-    print(f"Cleaned ({pro_num}){'SR' if isServerLevel else 'RE'} WIP data allocation completed successfully in "
+    print(f"Cleaned ({chunk_num}){'SR' if isServerLevel else 'RE'} WIP data allocation completed successfully in "
           f"{dt.now() - allocation_start}\n")
 
     # Load results
-    load_wip_data(final_wip_df, semaphore, to_csv=False, isServer=isServerLevel)
+    if load:
+        load_wip_data(final_wip_df, semaphore, chunk_num, to_csv=False, isServer=isServerLevel,
+                      asIntervals=asIntervals)
+    else:
+        write_chunk(final_wip_df, chunk_path('wip_cleaned', chunk_num))
+
+
+def export_wip_chunks(sr_rawData_df, sr_sap_statusH_df, re_rawData_df, re_sap_statusH_df, chunks_count=None):
+    """
+    Function that splits the SR and RE raw data and their SAP historical status data into chunks of balanced cleaning
+    cost, exports each chunk in the HANDOFF_FORMAT and writes the chunks manifest for the cleaning pool. The chunks
+    are shared between SR and RE in proportion to their estimated costs
+    :param sr_rawData_df: A dataframe containing the processed server raw data
+    :type sr_rawData_df: pandas.Dataframe
+    :param sr_sap_statusH_df: A dataframe containing the SAP historical status data of the servers
+    :type sr_sap_statusH_df: pandas.Dataframe
+    :param re_rawData_df: A dataframe containing the processed rack raw data
+    :type re_rawData_df: pandas.Dataframe
+    :param re_sap_statusH_df: A dataframe containing the SAP historical status data of the racks
+    :type re_sap_statusH_df: pandas.Dataframe
+    :param chunks_count: The total number of chunks. Default is CHUNKS_PER_WORKER chunks for each CPU
+    :type chunks_count: int
+    :return: The chunks manifest, with the number, the server level flag and the estimated cost of each chunk
+    :rtype: list
+    """
+    today_now = dt.now()
+    chunks_count = chunks_count or multiprocessing.cpu_count() * CHUNKS_PER_WORKER
+    sr_costs = PopulationHistory(sr_rawData_df, None, today_now).estimate_unit_costs()
+    re_costs = PopulationHistory(re_rawData_df, None, today_now, isServer=False).estimate_unit_costs()
+    sr_chunks_count = max(round(chunks_count * sr_costs.sum() / max(sr_costs.sum() + re_costs.sum(), 1)), 1)
+
+    chunks_manifest = []
+    chunk_files = []
+    for rawData_df, sap_historicalStatus_df, unit_costs, partitions_count, isServerLevel in \
+            ((sr_rawData_df, sr_sap_statusH_df, sr_costs, sr_chunks_count, True),
+             (re_rawData_df, re_sap_statusH_df, re_costs, max(chunks_count - sr_chunks_count, 1), False)):
+        for rawData_chunk, sap_chunk, chunk_cost in df_partitioner(rawData_df, sap_historicalStatus_df,
+                                                                   partitions_count, unit_costs):
+            chunk_num = len(chunks_manifest) + 1
+            chunk_files += [(rawData_chunk, chunk_path('wip_rawData', chunk_num)),
+                            (sap_chunk, chunk_path('sap_historyData', chunk_num))]
+            chunks_manifest.append({'chunk': chunk_num, 'isServerLevel': isServerLevel, 'cost': int(chunk_cost)})
+    write_chunks(chunk_files)
+
+    with open(CHUNKS_MANIFEST, 'w') as manifest_file:
+        json.dump(chunks_manifest, manifest_file)
+    return chunks_manifest
+
+
+def init_wip_worker(semaphore):
+    """
+    Function that initializes a worker of the cleaning pool. A semaphore can only be shared between processes by
+    inheritance, so each worker receives it once here instead of with every chunk
+    :param semaphore: Semaphore for concurrent loading processes
+    :type semaphore: multiprocessing.Semaphore
+    :return: None
+    """
+    global WORKER_SEMAPHORE
+    WORKER_SEMAPHORE = semaphore
+
+
+def clean_wip_chunk(chunk_info, asIntervals=False, load=True):
+    """
+    Function that cleans one raw data chunk in a worker of the cleaning pool
+    :param chunk_info: The manifest entry of the chunk, with its number and its server level flag
+    :type chunk_info: dict
+    :param asIntervals: a flag that indicates whether to store the WIP history as intervals
+    :param load: a flag that indicates whether to load the cleaned chunk right away (True) or to store it for
+    load_wip_chunk (False)
+    :return: The number of the chunk
+    :rtype: int
+    """
+    assign_wip(WORKER_SEMAPHORE, chunk_info['chunk'], chunk_info['isServerLevel'], asIntervals=asIntervals,
+               load=load)
+    return chunk_info['chunk']
+
+
+def load_wip_chunk(chunk_info, asIntervals=False):
+    """
+    Function that loads one cleaned chunk, stored by clean_wip_chunk, in a worker of the loading pool
+    :param chunk_info: The manifest entry of the chunk, with its number and its server level flag
+    :type chunk_info: dict
+    :param asIntervals: a flag that indicates whether the cleaned chunk contains WIP intervals
+    :return: The number of the chunk
+    :rtype: int
+    """
+    wip_df = read_chunk(chunk_path('wip_cleaned', chunk_info['chunk']))
+    if not load_wip_data(wip_df, WORKER_SEMAPHORE, chunk_info['chunk'], to_csv=False,
+                         isServer=chunk_info['isServerLevel'], asIntervals=asIntervals):
+        raise RuntimeError(f"The cleaned WIP chunk {chunk_info['chunk']} was not loaded")
+    return chunk_info['chunk']
+
+
+def read_chunks_manifest():
+    """
+    Function that reads the chunks manifest written by export_wip_chunks
+    :return: The manifest entry of each chunk, with its number, its server level flag and its estimated cost
+    :rtype: list
+    """
+    with open(CHUNKS_MANIFEST) as manifest_file:
+        return json.load(manifest_file)
+
+
+def run_wip_pool(chunk_function, chunks_manifest, workers_count=None, description="WIP chunks processed"):
+    """
+    Generator function that processes raw data chunks with a pool of worker processes.
+    Each worker takes the next chunk from the shared task queue as soon as it is done with the previous one, so a
+    heavy chunk does not hold back the rest of the run. The most costly chunks are queued first
+    :param chunk_function: The function that processes one chunk from its manifest entry and returns its number
+    :param chunks_manifest: The manifest entries of the chunks to process
+    :type chunks_manifest: list
+    :param workers_count: The number of worker processes. Default is the number of CPUs
+    :type workers_count: int
+    :param description: The description of the progress bar
+    :type description: str
+    :return: The number of each chunk, as soon as it is processed
+    :rtype: int
+    """
+    if len(chunks_manifest) < 1:
+        return
+    chunks_manifest = sorted(chunks_manifest, key=lambda chunk_info: chunk_info['cost'], reverse=True)
+    workers_count = min(workers_count or multiprocessing.cpu_count(), len(chunks_manifest))
+    print(f"Processing {len(chunks_manifest)} chunks with {workers_count} worker processes\n")
+
+    semaphore = multiprocessing.Semaphore(1)  # Semaphore with counter value of 1 for concurrent data upload
+    with multiprocessing.Pool(workers_count, initializer=init_wip_worker, initargs=(semaphore,)) as pool:
+        yield from tqdm(pool.imap_unordered(chunk_function, chunks_manifest, chunksize=1),
+                        total=len(chunks_manifest), desc=description)
+
+
+def compress_wip_intervals(wip_df):
+    """
+    Function compresses the WIP rows into intervals (run-length storage). Consecutive snapshot days of a unit at the
+    same location become one row with the first and the last snapshot dates (SnapshotStart, SnapshotEnd). The dwell
+    times are not kept because they are derived from the interval, see expand_wip_intervals
+    :param wip_df: A dataframe containing cleaned WIP rows ordered by SerialNumber and SnapshotTime
+    :type wip_df: pandas.Dataframe
+    :return: A dataframe containing one row per WIP interval
+    :rtype: pandas.Dataframe
+    """
+    location_columns = [column for column in WIP_INTERVAL_COLUMNS
+                        if column not in {'SnapshotStart', 'SnapshotEnd', 'ETL_time'}]
+    snapshots = pd.to_datetime(wip_df['SnapshotTime'])
+
+    # A new interval starts when a day is skipped or when any location value changes from the previous row
+    newInterval_mask = (snapshots - snapshots.shift()) != timedelta(days=1)
+    for column in location_columns:
+        values = wip_df[column]
+        previous_values = values.shift()
+        newInterval_mask |= ~((values == previous_values) | (values.isna() & previous_values.isna()))
+    newInterval_mask = newInterval_mask.to_numpy()
+    endInterval_mask = np.append(newInterval_mask[1:], True)
+
+    intervals_df = wip_df[newInterval_mask].reset_index(drop=True)
+    intervals_df['SnapshotStart'] = snapshots[newInterval_mask].to_numpy()
+    intervals_df['SnapshotEnd'] = snapshots[endInterval_mask].to_numpy()
+    return intervals_df[WIP_INTERVAL_COLUMNS]
+
+
+def expand_wip_intervals(intervals_df):
+    """
+    Function expands WIP intervals back into one row per unit per day, with the same columns and dwell times as the
+    rows that assign_wip produces
+    :param intervals_df: A dataframe containing WIP intervals as returned by compress_wip_intervals
+    :type intervals_df: pandas.Dataframe
+    :return: A dataframe containing one row per unit per WIP snapshot date
+    :rtype: pandas.Dataframe
+    """
+    snapshot_starts = pd.to_datetime(intervals_df['SnapshotStart'])
+    snapshot_ends = pd.to_datetime(intervals_df['SnapshotEnd'])
+    days_count = ((snapshot_ends - snapshot_starts) // timedelta(days=1) + 1).clip(lower=0).to_numpy(dtype=np.int64)
+    day_offsets = np.arange(days_count.sum()) - np.repeat(np.cumsum(days_count) - days_count, days_count)
+
+    wip_df = intervals_df.iloc[np.repeat(np.arange(intervals_df.shape[0]), days_count)].reset_index(drop=True)
+    wip_df['TransactionDate'] = pd.to_datetime(wip_df['TransactionDate'])
+    wip_df['SnapshotTime'] = np.repeat(snapshot_starts.to_numpy(), days_count) + day_offsets * np.timedelta64(1, 'D')
+    # Dwell time calculations
+    wip_df['DwellTime_calendar'] = (wip_df['SnapshotTime'] - wip_df['TransactionDate']).dt.total_seconds() / 3600
+    wip_df['DwellTime_working'] = delta_working_hours_array(wip_df['TransactionDate'], wip_df['SnapshotTime'],
+                                                            calendar=False)
+    return wip_df[list(WIP_DTYPES)]
 
 
 def assign_shipmentStatus(db_conn):
@@ -397,33 +627,48 @@ def assign_shipmentStatus(db_conn):
     wip_df = wip_df.drop(columns=['LatestUpdateDate'])
     wip_df_columns = wip_df.columns.tolist()
 
-    wip_grouped = wip_df.groupby('SerialNumber')
+    # Sort the WIP data by Serial Number once, and go through the column arrays of each unit
+    wip_units = UnitSlices(wip_df)
+    wip_df = wip_units.frames[0]
+    snapshotDates = wip_df['WIP_SnapshotDate'].to_numpy(dtype='datetime64[ns]')
+    transactionDates = wip_df['TransactionDate'].to_numpy(dtype='datetime64[ns]')
+    checkpointIDs = wip_df['CheckpointID'].to_numpy()
+    snapshotDate_position = wip_df_columns.index('WIP_SnapshotDate')
 
     wip_shipped_SNs = set()
     wip_stillNotShipped_tuples = []
+    wip_stillNotShipped_maxTimestamps = []
 
     # Find the units that do not have Shipping Scan (for rack shipment) nor Carton Scan (for single servers)
-    for serialNumber, wipHistory_df in tqdm(wip_grouped, desc="Assigning Shipment Status"):
-        wipHistory_df = wipHistory_df.sort_values('WIP_SnapshotDate', ascending=False)
-        max_ckp = wipHistory_df['CheckpointID'].iloc[0]
-        max_timestamp = wipHistory_df['TransactionDate'].max(skipna=True)
-        instance_upper_boundary = wipHistory_df['WIP_SnapshotDate'].max(skipna=True)
+    for serialNumber, start, end in tqdm(wip_units.positions(), total=len(wip_units),
+                                         desc="Assigning Shipment Status"):
+        unit_snapshotDates = snapshotDates[start:end]
+        unit_transactionDates = transactionDates[start:end]
+        # Row of the latest snapshot date
+        snapshotDates_mask = ~np.isnat(unit_snapshotDates)
+        latest_row = start
+        if snapshotDates_mask.any():
+            latest_row += np.flatnonzero(unit_snapshotDates == unit_snapshotDates[snapshotDates_mask].max())[0]
+        max_ckp = checkpointIDs[latest_row]
+        transactionDates_mask = ~np.isnat(unit_transactionDates)
+        max_timestamp = pd.Timestamp(unit_transactionDates[transactionDates_mask].max()) \
+            if transactionDates_mask.any() else pd.NaT
+        instance_upper_boundary = pd.Timestamp(snapshotDates[latest_row])
 
         if max_ckp in criticalShipment_ckps:
             wip_shipped_SNs.add(serialNumber)
         else:
             # Add WIP for all days from the latest instance timestamp to current date (today)
+            max_row = list(wip_df.iloc[latest_row])
             current_date = instance_upper_boundary + timedelta(days=1)
             while current_date <= today_upperBoundary:
                 if current_date < max_timestamp:
                     current_date = current_date + timedelta(days=1)
                     continue
 
-                wipHistory_df['WIP_SnapshotDate'] = current_date
-                wipHistory_df['DwellTime_calendar'] = delta_working_hours(max_timestamp, current_date)
-                wipHistory_df['DwellTime_working'] = delta_working_hours(max_timestamp, current_date, calendar=False)
-                max_row_tuple = tuple(wipHistory_df.values[0])  # Convert to tuple for faster loading of data
-                wip_stillNotShipped_tuples.append(max_row_tuple)
+                max_row[snapshotDate_position] = current_date
+                wip_stillNotShipped_tuples.append(tuple(max_row))  # Convert to tuple for faster loading of data
+                wip_stillNotShipped_maxTimestamps.append(max_timestamp)
                 current_date = current_date + timedelta(days=1)
 
     # Create the WIP shipped dataframe
@@ -431,11 +676,12 @@ def assign_shipmentStatus(db_conn):
 
     # Create the WIP not-shipped dataframe
     wip_stillNotShipped_df = pd.DataFrame(wip_stillNotShipped_tuples, columns=wip_df_columns)
-    wip_stillNotShipped_df['ExtractionDate'] = datetime_from_py_to_sql(dt.now())
-    wip_stillNotShipped_df['TransactionDate'] = \
-        wip_stillNotShipped_df['TransactionDate'].apply(datetime_from_py_to_sql)
-    wip_stillNotShipped_df['WIP_SnapshotDate'] = \
-        wip_stillNotShipped_df['WIP_SnapshotDate'].apply(datetime_from_py_to_sql)
+    # Dwell time calculations for all the days at once
+    wip_stillNotShipped_df['DwellTime_calendar'] = delta_working_hours_array(
+        wip_stillNotShipped_maxTimestamps, wip_stillNotShipped_df['WIP_SnapshotDate'])
+    wip_stillNotShipped_df['DwellTime_working'] = delta_working_hours_array(
+        wip_stillNotShipped_maxTimestamps, wip_stillNotShipped_df['WIP_SnapshotDate'], calendar=False)
+    wip_stillNotShipped_df['ExtractionDate'] = dt.now()
 
     unshipped_toUpdate_df = pd.DataFrame(set(wip_stillNotShipped_df['SerialNumber']), columns=['SerialNumber'])
 
@@ -3,6 +3,7 @@ from tqdm import tqdm
 from alerts import *
 import pandas as pd
 from utilities import show_message, datetime_from_py_to_sql, items_to_SQL_values
+from metrics import execute_metered
 import logging
 from datetime import datetime as dt
 
@@ -78,7 +79,7 @@ def update_shipmentFlag(db_conn, wip_updated, to_csv=False):
                     if len(wip_shipped_set) > 0:
                         update_start = dt.now()
                         print("UPDATING WIP records for shipped units in the background...")
-                        cursor.execute(update_shipped_query)
+                        execute_metered(cursor, 'wip_shipped_update', update_shipped_query)
                         print(f"UPDATE for WIP shipped records is complete. T: {dt.now() - update_start}")
                     else:
                         print("No new records to UPDATE for shipped units\n")
@@ -86,7 +87,7 @@ def update_shipmentFlag(db_conn, wip_updated, to_csv=False):
                     if len(wip_notShipped_set) > 0:
                         update_start = dt.now()
                         print("UPDATING WIP shipment flag for not shipped units in the background...")
-                        cursor.execute(update_notShipped_query)
+                        execute_metered(cursor, 'wip_notShipped_update', update_notShipped_query)
                         print(f"UPDATE for WIP unshipped records is complete. T: {dt.now() - update_start}")
                     else:
                         print("No new records to UPDATE for not shipped units\n")
@@ -100,48 +101,3 @@ def update_shipmentFlag(db_conn, wip_updated, to_csv=False):
         else:
             print("\nNo new records to UPDATE\n")
 
-
-def update_orderType_factoryStatus(db_conn, saved_as_csv=False):
-    """
-    Function to update the columns [OrderType], [FactoryStatus] based if they have the string value 'NULL',
-    then set them to actual NULL
-    :param db_conn: the connection to the database
-    :param saved_as_csv: Flag to indicate if the load operation was previously saved as CSV or directly to SQL
-    :return: None
-    """
-    update_query = """
-                UPDATE [SBILearning].[dbo].[DNun_tbl_Production_WIP_history]
-                SET [OrderType] =
-                    CASE
-                        WHEN [OrderType] = 'NULL'
-                        THEN NULL
-                        ELSE [OrderType]
-                    END
-                ,[FactoryStatus] =
-                    CASE
-                        WHEN [FactoryStatus] = 'NULL'
-                        THEN NULL
-                        ELSE [FactoryStatus]
-                    END
-                ,[Customer] =
-                    CASE
-                        WHEN [Customer] = 'NULL'
-                        THEN NULL
-                        ELSE [Customer]
-                    END;    
-    """
-    if saved_as_csv:
-        pass
-    else:
-        try:
-            update_start = dt.now()
-            with db_conn.cursor() as cursor:
-                print("Updating Order Type and Factory status NULL values in the background...")
-                cursor.execute(update_query)
-        except Exception as e:
-            print(repr(e))
-            LOGGER.error(SQL_U_ERROR, exc_info=True)
-            show_message(AlertType.FAILED)
-        else:
-            db_conn.commit()
-            print(f"\nUPDATE operation ran successfully\nT: {dt.now() - update_start}\n")
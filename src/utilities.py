@@ -4,8 +4,19 @@ import tkinter as tk
 from tkinter import messagebox
 from alerts import *
 import time as ti
+import heapq
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
+# Storage type of each column of the raw data, from the extraction to the cleaning pool. Low-cardinality strings are
+# categories, so each row holds a small int code instead of a Python string
+RAW_DTYPES = {'Site': 'category', 'Building': 'category', 'StockCode': 'category', 'CheckPointName': 'category',
+              'Message': 'category', 'SKU': 'category', 'OrderType': 'category', 'STATUS': 'category',
+              'Customer': 'category', 'ProductType': 'category', 'CheckPointId': 'int16', 'Success': 'bool',
+              'IsRack': 'bool',
+              'TransID': 'int64', 'TransactionDate': 'datetime64[ns]', 'EXTRACTED_DATE_TIME': 'datetime64[ns]'}
+
 
 def fixed_date(dayDateTime, fixedHour=9):
     """
@@ -20,6 +31,19 @@ def fixed_date(dayDateTime, fixedHour=9):
     return dt.combine(dayDateTime.date(), time(fixedHour, 0))
 
 
+def fixed_dates(dayDateTimes, fixedHour=9):
+    """
+    Function returns fixed datetimes from a whole column of datetimes. It is the column-level version of fixed_date
+    :param dayDateTimes: A column of datetimes
+    :type dayDateTimes: pandas.Series
+    :param fixedHour: A fixed hour during the day. Default is 9AM
+    :type fixedHour: int
+    :return: The combination of the date portion of each datetime and fixedHour
+    :rtype: pandas.Series
+    """
+    return dayDateTimes.dt.normalize() + pd.Timedelta(hours=fixedHour)
+
+
 def datetime_from_py_to_sql(py_datetime):
     """
     Function that converts python datetime format to SQL datetime format
@@ -129,6 +153,53 @@ def delta_working_hours(actual_start, actual_end, calendar=True):
         return ((actual_end - actual_start).total_seconds() / 3600) - (weekend_days * 24)
 
 
+def delta_working_hours_array(actual_starts, actual_ends, calendar=True):
+    """
+    Function gets the differences between two columns of datetimes in one NumPy pass. It is the column-level version
+    of delta_working_hours and gives the same results, including the weekend clipping of the standard flag.
+    The weekend days in between are counted with a closed formula instead of a day-by-day loop
+    :param actual_starts: The actual start times
+    :type actual_starts: pandas.Series or numpy.ndarray
+    :param actual_ends: The actual end times
+    :type actual_ends: pandas.Series or numpy.ndarray
+    :param calendar: Flag, if True calculate as calendar, if False, calculate as standard working hours
+    :return: The time deltas between actual_starts and actual_ends in hours
+    :rtype: numpy.ndarray
+    """
+    actual_starts = np.asarray(actual_starts, dtype='datetime64[ns]')
+    actual_ends = np.asarray(actual_ends, dtype='datetime64[ns]')
+    one_day = np.timedelta64(1, 'D')
+    hours_between = (actual_ends - actual_starts) / np.timedelta64(1, 's') / 3600
+
+    if calendar:
+        return np.where(hours_between < 0, 0, hours_between)
+
+    # Standard time calculation
+    start_dates = actual_starts.astype('datetime64[D]')
+    end_dates = actual_ends.astype('datetime64[D]')
+    # Weekday of each date, Monday is 0 (1970-01-01 was a Thursday)
+    start_weekdays = (start_dates.astype(np.int64) + 3) % 7
+    end_weekdays = (end_dates.astype(np.int64) + 3) % 7
+
+    # Assign a new start or end of actual start or actual end if date falls on the weekend
+    standard_end_T = np.timedelta64(23 * 3600 + 59 * 60 + 59, 's') + np.timedelta64(9999, 'us')
+    new_starts = np.where(start_weekdays == 5, start_dates + 2 * one_day,
+                          np.where(start_weekdays == 6, start_dates + one_day, actual_starts))
+    new_ends = np.where(end_weekdays == 5, end_dates - one_day + standard_end_T,
+                        np.where(end_weekdays == 6, end_dates - 2 * one_day + standard_end_T, actual_ends))
+    new_start_weekdays = np.where(start_weekdays >= 5, 0, start_weekdays)
+
+    # Find weekend days in between the start and end: the days start + i for i in 1..(days between - 1)
+    days_between = np.maximum((new_ends - new_starts) // one_day - 1, 0)
+    weekend_days = (((new_start_weekdays + days_between + 2) // 7 + (new_start_weekdays + days_between + 1) // 7) -
+                    ((new_start_weekdays + 2) // 7 + (new_start_weekdays + 1) // 7))
+    standard_hours = ((new_ends - new_starts) / np.timedelta64(1, 's') / 3600) - (weekend_days * 24)
+
+    # When the work operation occurs on the same day or up to 1 day difference, keep the plain difference
+    standard_hours = np.where(end_dates - start_dates < 2 * one_day, hours_between, standard_hours)
+    return np.where(hours_between < 0, 0, standard_hours)
+
+
 def str_extract_digits(str_input):
     """
     Function converts a string into an int by extracting all its digits and ignoring any non-digit character
@@ -140,47 +211,157 @@ def str_extract_digits(str_input):
     return int(int_number)
 
 
-def items_to_SQL_values(collection, isForUpdate=True, chunk_size=1_000):
+def items_to_SQL_values(collection):
     """
     Converts a collection of individual items into a collection of SQL values. It's useful for large UPDATE queries
     :param collection: The collection to convert to SQL values collection
-    :param isForUpdate: Flag that indicates if the return values would be for the UPDATE query
-    :param chunk_size: The size of the chunk for the INSERT query
     :return: The collection in SQL Values format
     :rtype: str
     """
     sql_values_str = ""
-    if isForUpdate:  # Values for UPDATE query
-        sql_values = ["(" + "'" + item + "'" + ")" + "," for item in collection]
-        for item in tqdm(sql_values, total=len(sql_values), desc="Creating SQL Values list"):
-            sql_values_str += item
-    else:  # Placeholder values for INSERT query
-        sql_values_str = "('{}', '{}', '{}', '{}', '{}', {}, '{}', '{}', {}, '{}', '{}', {}, {}, " \
-                          "'{}', '{}', '{}', '{}', {}, {}, '{}'),"
-        sql_values_str *= chunk_size
-    return sql_values_str.format(*collection)[:-1]  # Omit the last comma
+    sql_values = ["(" + "'" + item + "'" + ")" + "," for item in collection]
+    for item in tqdm(sql_values, total=len(sql_values), desc="Creating SQL Values list"):
+        sql_values_str += item
+    return sql_values_str[:-1]  # Omit the last comma
 
 
-def df_splitter(dataframe, category_name='SerialNumber'):
+def df_partitioner(dataframe, sap_dataframe, n_partitions, category_costs, category_name='SerialNumber'):
     """
-    Function splits a dataframe by category into four partitions (15%-35%-20%-30%)
-    :param dataframe: The dataframe to be split into four
+    Function splits a dataframe and its SAP historical status dataframe by category into n_partitions partitions of
+    balanced cost. The categories go from the most to the least costly, each one to the partition with the least cost
+    so far. Both dataframes are then split in one pass each by mapping every category to its partition
+    :param dataframe: The dataframe to be split
     :type dataframe: pandas.Dataframe
+    :param sap_dataframe: The SAP historical status dataframe of the same categories
+    :type sap_dataframe: pandas.Dataframe
+    :param n_partitions: The number of partitions
+    :type n_partitions: int
+    :param category_costs: The cost of each category of dataframe, indexed by category
+    :type category_costs: pandas.Series
     :param category_name: The column name of the category to use for the splitting
-    :return: a tuple containing three dataframes, and three lists. The list contains the unique categories
-    of each new DF
-    :rtype: tuple
-    """
-    unique_categories = list(set(dataframe[category_name]))
-    partition_sizes = (int(len(unique_categories) * 0.15), int(len(unique_categories) * 0.50),
-                       int(len(unique_categories) * 0.70))
-    division_1 = unique_categories[:partition_sizes[0]]
-    division_2 = unique_categories[partition_sizes[0]: partition_sizes[1]]
-    division_3 = unique_categories[partition_sizes[1]: partition_sizes[2]]
-    division_4 = unique_categories[partition_sizes[2]:]
-    new_df_1 = dataframe[dataframe[category_name].isin(division_1)]
-    new_df_2 = dataframe[dataframe[category_name].isin(division_2)]
-    new_df_3 = dataframe[dataframe[category_name].isin(division_3)]
-    new_df_4 = dataframe[dataframe[category_name].isin(division_4)]
-
-    return new_df_1, new_df_2, new_df_3, new_df_4, division_1, division_2, division_3, division_4
+    :return: a list of tuples, each containing a partition of dataframe, the matching partition of sap_dataframe and
+    the cost of the partition. Empty partitions are left out
+    :rtype: list
+    """
+    category_costs = category_costs.sort_values(ascending=False, kind='stable')
+    partition_loads = [(0, partition) for partition in range(n_partitions)]
+    partitions_array = np.empty(len(category_costs), dtype=np.int64)
+    for position, cost in enumerate(category_costs.to_numpy()):
+        load, partition = heapq.heappop(partition_loads)
+        partitions_array[position] = partition
+        heapq.heappush(partition_loads, (load + cost, partition))
+    partition_of_category = pd.Series(partitions_array, index=category_costs.index)
+    partition_costs = category_costs.groupby(partitions_array).sum()
+
+    sap_partitions = dict(tuple(sap_dataframe.groupby(sap_dataframe[category_name].map(partition_of_category))))
+    partitions = []
+    for partition, new_df in dataframe.groupby(dataframe[category_name].map(partition_of_category)):
+        partitions.append((new_df, sap_partitions.get(partition, sap_dataframe.iloc[:0]), partition_costs[partition]))
+    return partitions
+
+
+def interval_join(windows_df, events_df, on, lower='lower', upper='upper', time_column='TransactionDate'):
+    """
+    Function matches each window to the events of the same key whose time falls within it, lower <= time <= upper.
+    The events are sorted once by key and time, and each window finds its range of events with two binary searches,
+    so only the matching pairs are built, instead of every pair of window and event of a key like a merge does
+    :param windows_df: The windows, with the key and the lower and upper datetimes of each window
+    :type windows_df: pandas.Dataframe
+    :param events_df: The events, with the key and the datetime of each event
+    :type events_df: pandas.Dataframe
+    :param on: The key column of both dataframes
+    :type on: str
+    :param lower: The column of the lower limits of the windows
+    :type lower: str
+    :param upper: The column of the upper limits of the windows
+    :type upper: str
+    :param time_column: The column of the event datetimes
+    :type time_column: str
+    :return: One row per matched event and window, with the columns of the event and the columns of the window. The
+    window columns replace the event columns of the same name
+    :rtype: pandas.Dataframe
+    """
+    key_codes, _ = pd.factorize(np.concatenate([np.asarray(windows_df[on], dtype=object),
+                                                np.asarray(events_df[on], dtype=object)]))
+    window_codes, event_codes = key_codes[:windows_df.shape[0]], key_codes[windows_df.shape[0]:]
+    # Rank all the datetimes together so that a key and a datetime fit in one int64 sort key
+    _, time_ranks = np.unique(np.concatenate([windows_df[lower].to_numpy(dtype='datetime64[ns]'),
+                                              windows_df[upper].to_numpy(dtype='datetime64[ns]'),
+                                              events_df[time_column].to_numpy(dtype='datetime64[ns]')]),
+                              return_inverse=True)
+    time_ranks = time_ranks.reshape(-1)
+    scale = np.int64(time_ranks.max(initial=0) + 1)
+    lower_ranks, upper_ranks, event_ranks = np.split(time_ranks, [windows_df.shape[0], 2 * windows_df.shape[0]])
+
+    event_keys = event_codes * scale + event_ranks
+    event_order = np.argsort(event_keys, kind='stable')
+    event_keys = event_keys[event_order]
+    starts = np.searchsorted(event_keys, window_codes * scale + lower_ranks, side='left')
+    counts = np.maximum(np.searchsorted(event_keys, window_codes * scale + upper_ranks, side='right') - starts, 0)
+
+    # Expand each window into its range of sorted events
+    window_positions = np.repeat(np.arange(windows_df.shape[0]), counts)
+    event_positions = event_order[np.repeat(starts - (np.cumsum(counts) - counts), counts) +
+                                  np.arange(counts.sum())]
+    joined_df = events_df.iloc[event_positions].reset_index(drop=True)
+    for column, values in windows_df.items():
+        joined_df[column] = values.iloc[window_positions].reset_index(drop=True)
+    return joined_df
+
+
+def compact_dtypes(dataframe, dtypes=None):
+    """
+    Function casts the columns of a dataframe to their compact storage type. Integer and boolean columns that hold
+    missing values are left as they are, since those types cannot hold them
+    :param dataframe: A dataframe with any of the columns of dtypes
+    :type dataframe: pandas.Dataframe
+    :param dtypes: The storage type of each column. Default is RAW_DTYPES
+    :type dtypes: dict
+    :return: The dataframe with its columns cast
+    :rtype: pandas.Dataframe
+    """
+    dtypes = RAW_DTYPES if dtypes is None else dtypes
+    casts = {}
+    for column, dtype in dtypes.items():
+        if column not in dataframe.columns or dataframe[column].dtype == dtype:
+            continue
+        if dtype != 'category' and not dtype.startswith('datetime64') and dataframe[column].isna().any():
+            continue
+        casts[column] = dtype
+    return dataframe.astype(casts) if casts else dataframe
+
+
+def concat_compact(dataframes, **concat_kwargs):
+    """
+    Function concatenates dataframes like pandas.concat, but keeps the category columns as categories. pandas.concat
+    turns a category column into strings when its categories differ between the dataframes, so the categories of each
+    column are merged first
+    :param dataframes: The dataframes to concatenate
+    :type dataframes: list
+    :param concat_kwargs: Keyword arguments of pandas.concat, e.g. ignore_index
+    :return: The concatenated dataframe
+    :rtype: pandas.Dataframe
+    """
+    dataframes = [dataframe.copy(deep=False) for dataframe in dataframes]
+    if len(dataframes) > 1:
+        for column in dataframes[0].columns:
+            if not all(column in dataframe.columns and isinstance(dataframe[column].dtype, pd.CategoricalDtype)
+                       for dataframe in dataframes):
+                continue
+            categories = dataframes[0][column].cat.categories
+            for dataframe in dataframes[1:]:
+                categories = categories.union(dataframe[column].cat.categories)
+            for dataframe in dataframes:
+                dataframe[column] = dataframe[column].cat.set_categories(categories)
+    return pd.concat(dataframes, **concat_kwargs)
+
+
+def memory_footprint(dataframe):
+    """
+    Function returns the memory used by a dataframe, including the Python strings of its object columns
+    :param dataframe: A dataframe
+    :type dataframe: pandas.Dataframe
+    :return: The memory used in MB
+    :rtype: float
+    """
+    return dataframe.memory_usage(index=True, deep=True).sum() / 1_048_576
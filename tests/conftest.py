@@ -0,0 +1,37 @@
+# Fixtures of the tests: the modules of src are imported by name, the way main.py imports them
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import pytest
+from synthetic import generate_raw_data
+from transform import link_raw_data
+from storage import HANDOFF_DIRECTORY
+
+# Number of servers of the synthetic history, small enough to clean each unit one at a time
+TEST_UNITS_COUNT = 300
+
+
+@pytest.fixture(scope='session')
+def linked_raw_data():
+    """
+    Fixture generates a synthetic manufacturing history and links its rack data to the servers, as the link stage does
+    :return: The rack and server raw data and the rack and server SAP historical status data
+    :rtype: tuple
+    """
+    (re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df, sr_sap_statusH_df, re_sap_statusH_df,
+     customers_df) = generate_raw_data(TEST_UNITS_COUNT, seed=0)
+    re_rawData_df, sr_rawData_df = link_raw_data(re_rawData_df, sr_rawData_df, re_rackBuild_df, re_rackEoL_df,
+                                                 customers_df)
+    return re_rawData_df, sr_rawData_df, re_sap_statusH_df, sr_sap_statusH_df
+
+
+@pytest.fixture
+def handoff_directory(tmp_path, monkeypatch):
+    """
+    Fixture runs a test in an empty directory with the hand-off directory of the chunk files
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(HANDOFF_DIRECTORY)
+    return tmp_path
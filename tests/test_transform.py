@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+from storage import chunk_path, read_chunk, write_chunks
+from transform import assign_wip, compress_wip_intervals, expand_wip_intervals
+
+TEST_CHUNK_NUM = 1
+
+
+def clean_chunk(rawData_df, sap_historicalStatus_df, isServerLevel, vectorized):
+    """
+    Function cleans the raw data as one chunk with assign_wip and reads back the cleaned chunk
+    :return: The cleaned WIP rows, without the ETL time of the run
+    :rtype: pandas.Dataframe
+    """
+    write_chunks([(rawData_df, chunk_path('wip_rawData', TEST_CHUNK_NUM)),
+                  (sap_historicalStatus_df, chunk_path('sap_historyData', TEST_CHUNK_NUM))])
+    assign_wip(None, TEST_CHUNK_NUM, isServerLevel, vectorized=vectorized, load=False)
+    return read_chunk(chunk_path('wip_cleaned', TEST_CHUNK_NUM)).drop(columns=['ETL_time'])
+
+
+def as_objects(dataframe):
+    return dataframe.astype(object).where(dataframe.notna(), None)
+
+
+@pytest.mark.parametrize('isServerLevel', [True, False])
+def test_assign_wip_vectorized_matches_per_unit(linked_raw_data, handoff_directory, isServerLevel):
+    re_rawData_df, sr_rawData_df, re_sap_statusH_df, sr_sap_statusH_df = linked_raw_data
+    rawData_df, sap_historicalStatus_df = ((sr_rawData_df, sr_sap_statusH_df) if isServerLevel
+                                           else (re_rawData_df, re_sap_statusH_df))
+
+    vectorized_df = clean_chunk(rawData_df, sap_historicalStatus_df, isServerLevel, vectorized=True)
+    perUnit_df = clean_chunk(rawData_df, sap_historicalStatus_df, isServerLevel, vectorized=False)
+
+    assert vectorized_df.shape[0] > 0
+    pd.testing.assert_frame_equal(as_objects(vectorized_df), as_objects(perUnit_df))
+
+
+def test_wip_intervals_round_trip(linked_raw_data, handoff_directory):
+    _, sr_rawData_df, _, sr_sap_statusH_df = linked_raw_data
+    write_chunks([(sr_rawData_df, chunk_path('wip_rawData', TEST_CHUNK_NUM)),
+                  (sr_sap_statusH_df, chunk_path('sap_historyData', TEST_CHUNK_NUM))])
+    assign_wip(None, TEST_CHUNK_NUM, True, load=False)
+    wip_df = read_chunk(chunk_path('wip_cleaned', TEST_CHUNK_NUM))
+
+    intervals_df = compress_wip_intervals(wip_df)
+
+    assert intervals_df.shape[0] < wip_df.shape[0]
+    pd.testing.assert_frame_equal(as_objects(expand_wip_intervals(intervals_df)), as_objects(wip_df))
@@ -0,0 +1,20 @@
+from datetime import datetime as dt, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from utilities import delta_working_hours, delta_working_hours_array
+
+
+@pytest.mark.parametrize('calendar', [True, False])
+def test_delta_working_hours_array_matches_scalar(calendar):
+    rng = np.random.default_rng(0)
+    # Starts and ends on every weekday and around the weekends, including ends before their starts
+    actual_starts = pd.Series(dt(2023, 10, 2) + pd.to_timedelta(rng.uniform(0, 21 * 24, 2_000), unit='h'))
+    actual_ends = actual_starts + pd.to_timedelta(rng.uniform(-24, 15 * 24, 2_000), unit='h')
+    actual_ends[:7] = actual_starts[:7] + timedelta(days=2)
+
+    expected = [delta_working_hours(actual_start, actual_end, calendar=calendar)
+                for actual_start, actual_end in zip(actual_starts, actual_ends)]
+
+    np.testing.assert_allclose(delta_working_hours_array(actual_starts, actual_ends, calendar=calendar), expected,
+                               rtol=1e-9, atol=1e-9)